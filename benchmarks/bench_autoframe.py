@@ -0,0 +1,66 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Throughput of GenomeHandle.autoframe on random genomes
+
+Usage: python benchmarks/bench_autoframe.py [count [nsamples]]
+"""
+import os
+import sys
+import time
+
+try:
+    import pyflam3ng
+except ImportError:
+    sys.path.insert(0,
+            os.path.join(os.path.dirname(__file__), '..'))
+    import pyflam3ng
+
+from pyflam3ng import flam3
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 1000
+    nsamples = int(argv[2]) if len(argv) > 2 else 10000
+
+    variations = flam3.get_variation_list()[:20]
+    handles = []
+    for i in xrange(count):
+        handle = flam3.GenomeHandle()
+        handle.random(variations, False, 0)
+        handles.append(handle)
+
+    failed = 0
+    start = time.time()
+    for handle in handles:
+        try:
+            handle.autoframe(640, 480, 0.05, 0.01, nsamples)
+        except ValueError:
+            failed += 1
+    elapsed = time.time() - start
+
+    print '%d genomes, %d samples each' % (count, nsamples)
+    print '%.1f genomes/s, %d could not be framed' % (count / elapsed, failed)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
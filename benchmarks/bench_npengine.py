@@ -0,0 +1,88 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Compare the numpy chaos game engine against libflam3
+
+Renders the first genome of a flame file with both engines and reports
+iterations per second, so the batch size of pyflam3ng.npengine can be
+tuned against the native renderer.
+
+Usage: python benchmarks/bench_npengine.py [flame_file [size [quality]]]
+"""
+import os
+import sys
+import time
+
+try:
+    import pyflam3ng
+except ImportError:
+    sys.path.insert(0,
+            os.path.join(os.path.dirname(__file__), '..'))
+    import pyflam3ng
+
+from lxml import etree
+
+from pyflam3ng import flam3, npengine, load_flame
+
+
+DEFAULT_FLAME = os.path.join(os.path.dirname(__file__), '..', 'share', 'test.flam3')
+BATCHES = (1<<12, 1<<14, 1<<16, 1<<18)
+
+
+def bench(render, genome, buffer, **kwargs):
+    start = time.time()
+    stats = render(genome, buffer, **kwargs)
+    elapsed = time.time() - start
+
+    return stats['num_iters'], elapsed
+
+
+def main(argv):
+    path = argv[1] if len(argv) > 1 else DEFAULT_FLAME
+    size = int(argv[2]) if len(argv) > 2 else 320
+    quality = float(argv[3]) if len(argv) > 3 else 50.0
+
+    # quality and size are set on the xml so both engines see them
+    flame = etree.parse(path).xpath('//flame')[0]
+    flame.set('quality', str(quality))
+    flame.set('size', '%d %d' % (size, size))
+    genome = load_flame(etree.tostring(flame))[0]
+
+    buffer = flam3.RenderBuffer(size, size, 3)
+
+    print '%s, %dx%d, quality %g' % (os.path.basename(path), size, size, quality)
+    print '%-20s %12s %10s %12s' % ('engine', 'iterations', 'seconds', 'iters/s')
+
+    def report(name, iters, elapsed):
+        print '%-20s %12d %10.3f %12.0f' % (name, iters, elapsed, iters / elapsed)
+
+    iters, elapsed = bench(lambda g, b, **kw: g.render(b, **kw), genome, buffer)
+    report('flam3', iters, elapsed)
+
+    for batch in BATCHES:
+        iters, elapsed = bench(npengine.render, genome, buffer,
+                               quality=quality, batch=batch, seed=1)
+        report('numpy batch=%d' % batch, iters, elapsed)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
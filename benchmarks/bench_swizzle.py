@@ -0,0 +1,86 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Micro-benchmark of the RenderBuffer pixel format conversions
+
+Usage: python benchmarks/bench_swizzle.py [width height [repeat]]
+"""
+import os
+import sys
+import time
+
+try:
+    import pyflam3ng
+except ImportError:
+    sys.path.insert(0,
+            os.path.join(os.path.dirname(__file__), '..'))
+    import pyflam3ng
+
+from pyflam3ng import flam3, swizzle
+
+
+FORMATS = [ ('RGB', swizzle.RGB)
+          , ('RGBA', swizzle.RGBA)
+          , ('RGBA_PREMULTIPLIED', swizzle.RGBA_PREMULTIPLIED)
+          , ('RGBX', swizzle.RGBX)
+          , ('BGRA', swizzle.BGRA)
+          , ('BGRA_PREMULTIPLIED', swizzle.BGRA_PREMULTIPLIED)
+          , ('BGRX', swizzle.BGRX)
+          , ('ARGB', swizzle.ARGB)
+          , ('ARGB_PREMULTIPLIED', swizzle.ARGB_PREMULTIPLIED)
+          , ('XRGB', swizzle.XRGB)
+          ]
+
+
+def bench_format(buffer, format, repeat):
+    dest = bytearray(buffer.width * buffer.height * swizzle.bytes_per_pixel(format))
+
+    buffer.write_to_legacy_buffer(dest, format)
+
+    start = time.time()
+    for i in xrange(repeat):
+        buffer.write_to_legacy_buffer(dest, format)
+    elapsed = (time.time() - start) / repeat
+
+    return elapsed
+
+
+def main(argv):
+    width = int(argv[1]) if len(argv) > 2 else 1920
+    height = int(argv[2]) if len(argv) > 2 else 1080
+    repeat = int(argv[3]) if len(argv) > 3 else 50
+
+    print '%dx%d, mean of %d runs' % (width, height, repeat)
+    print '%-8s %-20s %10s %10s' % ('source', 'format', 'ms/frame', 'Mpix/s')
+
+    for channels in (3, 4):
+        buffer = flam3.RenderBuffer(width, height, channels)
+        buffer.as_array()[:] = 0x80
+
+        for name, format in FORMATS:
+            elapsed = bench_format(buffer, format, repeat)
+            print '%-8s %-20s %10.3f %10.1f' % ('RGB' if channels == 3 else 'RGBA',
+                    name, elapsed * 1000.0, width * height / elapsed / 1e6)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
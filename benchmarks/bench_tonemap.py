@@ -0,0 +1,83 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Time re-tonemapping a histogram
+
+Iterates the first genome of a flame file into a histogram once, then
+times tonemap with density estimation on and off, and again after
+changing only the color settings, which reuses the estimated buckets.
+
+Usage: python benchmarks/bench_tonemap.py [flame_file [width height [oversample]]]
+"""
+import os
+import sys
+import time
+
+try:
+    import pyflam3ng
+except ImportError:
+    sys.path.insert(0,
+            os.path.join(os.path.dirname(__file__), '..'))
+    import pyflam3ng
+
+import numpy
+
+from pyflam3ng import load_flame
+from pyflam3ng.histogram import render_histogram, tonemap
+
+
+DEFAULT_FLAME = os.path.join(os.path.dirname(__file__), '..', 'share', 'test.flam3')
+
+
+def bench(histogram, genome, image):
+    start = time.time()
+    tonemap(histogram, genome, image)
+
+    return time.time() - start
+
+
+def main(argv):
+    path = argv[1] if len(argv) > 1 else DEFAULT_FLAME
+    width = int(argv[2]) if len(argv) > 2 else 1280
+    height = int(argv[3]) if len(argv) > 3 else 720
+    oversample = int(argv[4]) if len(argv) > 4 else 1
+
+    genome = load_flame(filename=path)[0]
+    genome.estimator = 9.0
+    histogram = render_histogram(genome, width, height, quality=10,
+                                 oversample=oversample, seed=1)
+    image = numpy.zeros((height, width, 3), numpy.uint8)
+
+    print '%s, %dx%d, oversample %d' % (os.path.basename(path), width, height, oversample)
+
+    print '%-28s %8.3f s' % ('estimator 9', bench(histogram, genome, image))
+
+    genome.gamma *= 1.5
+    genome.brightness *= 2
+    print '%-28s %8.3f s' % ('estimator 9, colors changed', bench(histogram, genome, image))
+
+    genome.estimator = 0.0
+    print '%-28s %8.3f s' % ('estimator off', bench(histogram, genome, image))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
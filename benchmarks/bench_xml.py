@@ -0,0 +1,83 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Parse and serialize throughput of genome xml, in genomes/s
+
+Builds a document of count copies of the flames in share/test.flam3 and
+times each loading and saving path over it.
+
+Usage: python benchmarks/bench_xml.py [count]
+"""
+import os
+import sys
+import time
+
+try:
+    import pyflam3ng
+except ImportError:
+    sys.path.insert(0,
+            os.path.join(os.path.dirname(__file__), '..'))
+    import pyflam3ng
+
+from lxml import etree
+from pyflam3ng import flam3
+
+
+TEST_FLAME = os.path.join(os.path.dirname(__file__), '..', 'share', 'test.flam3')
+
+
+def _document(count):
+    flames = etree.parse(TEST_FLAME).getroot().xpath('//flame')
+    root = etree.Element('flames')
+    for i in xrange(count):
+        root.append(etree.fromstring(etree.tostring(flames[i % len(flames)])))
+    return etree.tostring(root)
+
+
+def _time(label, count, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '%-28s %10.1f genomes/s' % (label, count / elapsed)
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 2000
+    source = _document(count)
+    nodes = etree.fromstring(source).xpath('//flame')
+
+    print '%d genomes, %d bytes of xml' % (count, len(source))
+
+    _time('flam3.from_xml', count, lambda: flam3.from_xml(source))
+    _time('load_flame', count, lambda: pyflam3ng.load_flame(xml_source=source))
+    _time('load_genome per node', count,
+          lambda: [pyflam3ng.load_genome(flame_node=node) for node in nodes])
+
+    genomes = pyflam3ng.load_flame(xml_source=source)
+    _time('flam3.to_xml', count,
+          lambda: [flam3.to_xml(genome.genome_handle) for genome in genomes])
+    _time('Genome.to_xml', count,
+          lambda: [etree.tostring(genome.to_xml()) for genome in genomes])
+
+
+if __name__ == '__main__':
+    main(sys.argv)
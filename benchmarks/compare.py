@@ -0,0 +1,113 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Compare two render_suite.py result files
+
+A case regresses when its iterations/s drop, or its wall time or peak
+RSS grow, by more than the threshold (a fraction).  Exits with status 1
+if any case regressed.
+
+Usage: python benchmarks/compare.py [--threshold 0.05] old.json new.json
+"""
+from __future__ import with_statement
+
+import json
+import optparse
+import sys
+
+
+# (key, True if larger is better)
+MEASURES = [ ('iters_per_second', True)
+           , ('wall_seconds', False)
+           , ('peak_rss_kb', False)
+           ]
+
+
+def _load(path):
+    with open(path) as f:
+        data = json.load(f)
+    return dict((result['name'], result) for result in data['results'])
+
+
+def change(old, new):
+    """The relative change from old to new"""
+    if not old:
+        return 0.0
+    return (new - old) / float(old)
+
+
+def compare(old, new, threshold, rss_threshold):
+    """[(name, {measure: change}, regressed measures)] for the cases in
+    both old and new"""
+    rows = []
+
+    for name in sorted(set(old) & set(new)):
+        changes = {}
+        regressed = []
+
+        for key, larger_is_better in MEASURES:
+            delta = change(old[name][key], new[name][key])
+            changes[key] = delta
+
+            limit = rss_threshold if key == 'peak_rss_kb' else threshold
+            if (-delta if larger_is_better else delta) > limit:
+                regressed.append(key)
+
+        rows.append((name, changes, regressed))
+
+    return rows
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] old.json new.json')
+    parser.add_option('--threshold', type='float', default=0.05,
+                      help='allowed slowdown as a fraction (default 0.05)')
+    parser.add_option('--rss-threshold', type='float', default=0.10,
+                      help='allowed peak RSS growth as a fraction (default 0.10)')
+    options, args = parser.parse_args(argv[1:])
+
+    if len(args) != 2:
+        parser.error('expected two result files')
+
+    old, new = _load(args[0]), _load(args[1])
+    rows = compare(old, new, options.threshold, options.rss_threshold)
+
+    print '%-20s %12s %12s %12s' % ('case', 'iters/s', 'wall', 'peak rss')
+    for name, changes, regressed in rows:
+        print '%-20s %+11.1f%% %+11.1f%% %+11.1f%% %s' % (name,
+                changes['iters_per_second'] * 100, changes['wall_seconds'] * 100,
+                changes['peak_rss_kb'] * 100,
+                'REGRESSED' if regressed else '')
+
+    for name in sorted(set(old) ^ set(new)):
+        print '%-20s only in %s' % (name, args[0] if name in old else args[1])
+
+    failed = [row for row in rows if row[2]]
+    if failed:
+        print '%d of %d cases regressed' % (len(failed), len(rows))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,231 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Render throughput sweep
+
+Renders share/test.flam3 and generated genomes while sweeping one
+parameter at a time away from a baseline: image size, quality,
+oversample, nthreads, channel count and number of xforms.  Each case
+runs in its own process so its peak RSS can be measured, and the best
+of --repeat runs is kept.  Results are written as json for compare.py.
+
+The generated genomes are built from a fixed seed and variation list
+in Python, so every checkout and machine renders the same genomes.
+
+Usage: python benchmarks/render_suite.py [-o results.json] [--quick]
+"""
+from __future__ import with_statement
+
+import json
+import optparse
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+try:
+    import pyflam3ng
+except ImportError:
+    sys.path.insert(0,
+            os.path.join(os.path.dirname(__file__), '..'))
+    import pyflam3ng
+
+from lxml import etree
+from pyflam3ng import flam3
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TEST_FLAME = os.path.join(ROOT, 'share', 'test.flam3')
+VARIATIONS = ('linear', 'sinusoidal', 'spherical', 'swirl', 'horseshoe',
+              'polar', 'handkerchief', 'heart', 'disc', 'spiral')
+
+BASELINE = dict(genome='test', width=640, height=480, quality=50,
+                oversample=1, nthreads=0, channels=4)
+
+SWEEPS = [ ('size', [(320, 240), (640, 480), (1280, 960)])
+         , ('quality', [10, 50, 200])
+         , ('oversample', [1, 2, 3])
+         , ('nthreads', [1, 2, 4, 0])
+         , ('channels', [3, 4])
+         , ('xforms', [2, 4, 8])
+         ]
+
+QUICK = dict(width=160, height=120, quality=5)
+
+
+def _test_flame():
+    node = etree.parse(TEST_FLAME).getroot()
+    if node.tag != 'flame':
+        node = node.find('flame')
+    return node
+
+
+def _generated_genome(count):
+    """The test flame with its xforms replaced by count xforms drawn
+    from a generator seeded with count"""
+    rng = random.Random(count)
+    node = _test_flame()
+    for xform in node.findall('xform'):
+        node.remove(xform)
+
+    for i in xrange(count):
+        xform = etree.SubElement(node, 'xform')
+        xform.set('weight', repr(1.0 / count))
+        xform.set('color', repr(float(i) / max(count - 1, 1)))
+        for name in rng.sample(VARIATIONS, 2):
+            xform.set(name, repr(round(rng.uniform(0.2, 1.0), 4)))
+        xform.set('coefs', ' '.join(repr(round(rng.uniform(-1.0, 1.0), 6))
+                                    for j in xrange(6)))
+
+    node.set('name', 'xforms-%d' % count)
+    return node
+
+
+def plan_cases(quick=False):
+    """(name, params) of every case, the baseline first"""
+    baseline = dict(BASELINE)
+    if quick:
+        baseline.update(QUICK)
+
+    cases = [('baseline', baseline)]
+
+    for sweep, values in SWEEPS:
+        for value in values:
+            params = dict(baseline)
+
+            if sweep == 'size':
+                width, height = value
+                if quick:
+                    width, height = width / 4, height / 4
+                params.update(width=width, height=height)
+                name = 'size-%dx%d' % (width, height)
+            elif sweep == 'xforms':
+                params['genome'] = 'xforms-%d' % value
+                name = 'xforms-%d' % value
+            else:
+                params[sweep] = value
+                name = '%s-%s' % (sweep, value)
+
+            if params != baseline:
+                cases.append((name, params))
+
+    return cases
+
+
+def run_case(params, repeat):
+    """Render one case in this process and return its measurements"""
+    if params['genome'] == 'test':
+        node = _test_flame()
+    else:
+        node = _generated_genome(int(params['genome'].split('-')[1]))
+
+    node.set('size', '%d %d' % (params['width'], params['height']))
+    node.set('quality', str(params['quality']))
+    node.set('oversample', str(params['oversample']))
+
+    genome = flam3.from_xml(etree.tostring(node))[0]
+    buffer = flam3.RenderBuffer(params['width'], params['height'], params['channels'])
+
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        stats = genome.render(buffer, nthreads=params['nthreads'])
+        wall = time.time() - start
+
+        if best is None or wall < best[0]:
+            best = wall, stats
+
+    wall, stats = best
+    return { 'wall_seconds': wall
+           , 'num_iters': stats['num_iters']
+           , 'iters_per_second': stats['num_iters'] / wall if wall else 0.0
+           , 'badvals': stats['badvals']
+           , 'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+           }
+
+
+def _run_in_child(params, repeat):
+    command = [sys.executable, os.path.abspath(__file__),
+               '--case', json.dumps(params), '--repeat', str(repeat)]
+    child = subprocess.Popen(command, stdout=subprocess.PIPE)
+    output = child.communicate()[0]
+
+    if child.returncode != 0:
+        raise RuntimeError('case %r failed with exit code %d'
+                           % (params, child.returncode))
+
+    return json.loads(output)
+
+
+def _metadata():
+    return { 'time': time.time()
+           , 'python': platform.python_version()
+           , 'platform': platform.platform()
+           , 'machine': platform.machine()
+           , 'cpu_count': os.sysconf('SC_NPROCESSORS_ONLN')
+           }
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output', default='render_results.json',
+                      help='where to write the results json')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='runs per case; the fastest is kept')
+    parser.add_option('--quick', action='store_true', default=False,
+                      help='small images and low quality, for smoke runs')
+    parser.add_option('--only', default=None,
+                      help='only run cases whose name starts with this')
+    parser.add_option('--case', default=None, help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args(argv[1:])
+
+    if options.case is not None:
+        result = run_case(json.loads(options.case), options.repeat)
+        sys.stdout.write(json.dumps(result))
+        return 0
+
+    results = []
+    for name, params in plan_cases(options.quick):
+        if options.only and not name.startswith(options.only):
+            continue
+
+        result = _run_in_child(params, options.repeat)
+        result.update(name=name, params=params)
+        results.append(result)
+
+        print '%-20s %8.3fs %12.0f iters/s %8d KB' % (name,
+                result['wall_seconds'], result['iters_per_second'],
+                result['peak_rss_kb'])
+
+    with open(options.output, 'w') as f:
+        json.dump(dict(meta=_metadata(), results=results), f,
+                  indent=2, sort_keys=True)
+
+    print 'wrote %d results to %s' % (len(results), options.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -33,13 +33,42 @@ from lxml import etree
 from func import *
 
 from .variations import variation_registry
-from . import flam3
-from . import util
+from . import constants
+from . import histogram
+from .metrics import metered_render
+from . import progressive
 from . import vector_utils as vu
 
+try:
+    from . import util
+except ImportError:
+    # Compiled extension; only Palette.smooth needs it
+    util = None
+
+try:
+    from . import flam3
+except ImportError:
+    # Without libflam3 genomes are parsed in python and only
+    # pyflam3ng.npengine can render them
+    flam3 = None
+
 
 EPSILON = 0.0000000000001
 
+# Genome.to_xml lookup tables
+_FILTER_SHAPES = ['gaussian', 'hermite', 'box', 'triangle', 'bell', 'bspline',
+                  'lanczos3', 'lanczos2', 'mitchell', 'blackman', 'catrom',
+                  'hamming', 'hanning', 'quadratic']
+_INTERPOLATION_TYPES = ['linear', 'log', 'old', 'older']
+_COLOR_INDICES = [str(i) for i in xrange(256)]
+
+# Index of each flam3 variation in XformHandle.var
+if flam3 is not None:
+    _VARIATION_INDICES = dict((name, index) for index, name in
+                              enumerate(flam3.get_variation_list()))
+else:
+    _VARIATION_INDICES = {}
+
 def float_equality(x, y):
     return abs(x-y) < (x * EPSILON)
 
@@ -57,6 +86,9 @@ def load_flame(xml_source=None, fd=None, filename=None):
         Loads the genomes directly from the string
 
     Parameters are tested in this order
+
+    The document is parsed once by lxml and once by flam3, and each
+    Genome is built from its node and its GenomeHandle together.
     """
     if filename is not None:
         fd = open(filename)
@@ -71,9 +103,39 @@ def load_flame(xml_source=None, fd=None, filename=None):
     tree = etree.fromstring(xml_source)
     genome_nodes = tree.xpath('//flame')
 
+    if flam3 is not None:
+        handles = flam3.from_xml(xml_source)
+
+        # flam3 skips flames it cannot parse; fall back to one at a time
+        if len(handles) == len(genome_nodes):
+            return [Genome(flame_node=node, genome_handle=handle)
+                    for node, handle in zip(genome_nodes, handles)]
+
     return [load_genome(flame_node=node) for node in genome_nodes]
 
 
+def iter_flames(source, predicate=None):
+    """Yield the genomes of an xml document one at a time
+
+    source is a filename or a filelike object.  The document is parsed
+    incrementally and each <flame> element is dropped once its Genome
+    is built, so memory use does not grow with the size of the file.
+
+    predicate, if given, is called with each flame's lxml element before
+    any Genome is built; flames it rejects are skipped cheaply.
+    """
+    for event, node in etree.iterparse(source, events=('end',), tag='flame'):
+        try:
+            if predicate is None or predicate(node):
+                # The genome keeps its node, so give it a copy that
+                # survives the cleanup below
+                yield Genome(flame_node=copy.deepcopy(node))
+        finally:
+            node.clear()
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+
+
 def load_genome(flame_node=None, xml_source=None, genome_handle=None):
     """Load a genome from a variety of sources
 
@@ -385,6 +447,8 @@ class Palette(object):
         self.array = numpy.zeros((256,3), numpy.float32)
 
     def smooth(self, ntries=50, trysize=10000):
+        if util is None:
+            raise RuntimeError('Palette.smooth needs the pyflam3ng.util extension')
         self.array = util.palette_improve(self.array, ntries, trysize)
 
     def adjust_hue(self, val):
@@ -507,7 +571,7 @@ class Palette(object):
         self.smooth()
 
 class Xform(object):
-    def __init__(self, xml_node=None, **kwargs):
+    def __init__(self, xml_node=None, xform_handle=None, **kwargs):
         self._weight = kwargs.get('weight', 0.0)
         self._color = kwargs.get('color', 0.0)
         self._symmetry = kwargs.get('symmetry', 0.0)
@@ -527,10 +591,28 @@ class Xform(object):
 
         if xml_node is not None:
             self._load_xml(xml_node)
+        elif xform_handle is not None:
+            self._load_handle(xform_handle)
 
     def copy(self):
         return copy.deepcopy(self)
 
+    def _fingerprint_state(self, values, names):
+        values.extend([self.weight, self.color, self.symmetry, self.opacity])
+        values.extend(self.coefs)
+        values.extend(self.post)
+
+        for name, weight in sorted(self.vars.values.items()):
+            if weight == 0.0:
+                continue
+
+            names.append(name)
+            values.append(weight)
+
+            for var_name, value in sorted((self.vars.variation_vars(name) or {}).items()):
+                names.append(var_name)
+                values.append(float(value))
+
     def get_pad(self):
         hole_vars = ['spherical', 'ngon', 'julian', 'juliascope', 'polar'
                     ,'wedge_sph', 'wedge_julia']
@@ -812,21 +894,174 @@ class Xform(object):
 
             #TODO: chaos
 
+    def _load_handle(self, xform_handle):
+        """Copy a flam3.XformHandle"""
+        self.weight = xform_handle.weight
+        self.color = xform_handle.color
+        self.symmetry = xform_handle.symmetry
+        self.coefs = xform_handle.coefs.ravel().tolist()
+        self.post = xform_handle.post.ravel().tolist()
+
+        for name, weight in xform_handle.variations.iteritems():
+            self.vars.set_variation(name, weight)
+
+        for name, variables in xform_handle.variables.iteritems():
+            for var_name, value in variables.iteritems():
+                try:
+                    self.vars.set_variable(name, var_name, value)
+                except KeyError:
+                    pass
+
+    def _fits_handle(self, xform_handle):
+        """Whether _write_handle can update xform_handle: the same
+        variations in use, with the same variables"""
+        names = set(name for name, weight in self.vars.values.items()
+                    if weight != 0.0)
+        if names != set(xform_handle.variations):
+            return False
+
+        for name, variables in xform_handle.variables.iteritems():
+            ours = self.vars.variation_vars(name) or {}
+            for var_name, value in variables.iteritems():
+                if var_name in ours and float(ours[var_name]) != value:
+                    return False
+
+        return True
+
+    def _write_handle(self, xform_handle):
+        """Copy into a flam3.XformHandle; XformHandle can't set the
+        variables, so check _fits_handle first"""
+        xform_handle.weight = self.weight
+        xform_handle.color = self.color
+        xform_handle.symmetry = self.symmetry
+        xform_handle.coefs[:] = numpy.reshape(self.coefs, (3, 2))
+        xform_handle.post[:] = numpy.reshape(self.post, (3, 2))
+
+        var = xform_handle.var
+        var[:] = 0.0
+        for name, weight in self.vars.values.items():
+            if name in _VARIATION_INDICES:
+                var[_VARIATION_INDICES[name]] = weight
+
 
 #---end Xform
 
+# Genome settings that live in the flam3 struct once there is a handle
+_HANDLE_ATTRIBUTES = ( 'time', 'width', 'height', 'rotate', 'pixels_per_unit'
+                     , 'zoom', 'brightness', 'contrast', 'gamma', 'vibrancy'
+                     , 'hue_rotation', 'symmetry', 'spatial_oversample'
+                     , 'spatial_filter_radius', 'spatial_filter_select'
+                     , 'sample_density', 'nbatches', 'ntemporal_samples'
+                     , 'estimator', 'estimator_minimum', 'estimator_curve'
+                     , 'gam_lin_thresh', 'interpolation', 'interpolation_type'
+                     , 'palette_interpolation', 'temporal_filter_type'
+                     , 'temporal_filter_width', 'temporal_filter_exp'
+                     )
+
+
+class _HandleAttribute(object):
+    """A Genome attribute read from and written to its GenomeHandle, or
+    kept on the instance when there is no handle"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, genome, owner):
+        if genome is None:
+            return self
+
+        handle = genome.__dict__.get('_handle')
+        if handle is not None:
+            return getattr(handle, self.name)
+
+        try:
+            return genome.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, genome, value):
+        handle = genome.__dict__.get('_handle')
+        if handle is not None:
+            setattr(handle, self.name, value)
+        else:
+            genome.__dict__[self.name] = value
+
+
 class Genome(object):
+    time = _HandleAttribute('time')
+    width = _HandleAttribute('width')
+    height = _HandleAttribute('height')
+    rotate = _HandleAttribute('rotate')
+    pixels_per_unit = _HandleAttribute('pixels_per_unit')
+    zoom = _HandleAttribute('zoom')
+    brightness = _HandleAttribute('brightness')
+    contrast = _HandleAttribute('contrast')
+    gamma = _HandleAttribute('gamma')
+    vibrancy = _HandleAttribute('vibrancy')
+    hue_rotation = _HandleAttribute('hue_rotation')
+    symmetry = _HandleAttribute('symmetry')
+    spatial_oversample = _HandleAttribute('spatial_oversample')
+    spatial_filter_radius = _HandleAttribute('spatial_filter_radius')
+    spatial_filter_select = _HandleAttribute('spatial_filter_select')
+    sample_density = _HandleAttribute('sample_density')
+    nbatches = _HandleAttribute('nbatches')
+    ntemporal_samples = _HandleAttribute('ntemporal_samples')
+    estimator = _HandleAttribute('estimator')
+    estimator_minimum = _HandleAttribute('estimator_minimum')
+    estimator_curve = _HandleAttribute('estimator_curve')
+    gam_lin_thresh = _HandleAttribute('gam_lin_thresh')
+    interpolation = _HandleAttribute('interpolation')
+    interpolation_type = _HandleAttribute('interpolation_type')
+    palette_interpolation = _HandleAttribute('palette_interpolation')
+    temporal_filter_type = _HandleAttribute('temporal_filter_type')
+    temporal_filter_width = _HandleAttribute('temporal_filter_width')
+    temporal_filter_exp = _HandleAttribute('temporal_filter_exp')
+
+    _handle = None
+    _synced = None
+
     def __init__(self, random=True, flame_node=None, genome_handle=None):
         self.set_defaults()
 
-        if flame_node is not None:
+        if flame_node is not None and genome_handle is not None:
+            self._init_from_parsed(flame_node, genome_handle)
+        elif flame_node is not None:
             self._init_from_node(flame_node)
         elif genome_handle is not None:
             self._init_from_handle(genome_handle)
         else:
-            self.genome_handle = flam3.GenomeHandle()
+            self._use_handle(flam3.GenomeHandle() if flam3 else None, seed=True)
             if random: self.random()
 
+        self._mark_synced()
+
+    def _get_genome_handle(self):
+        if self._handle is not None:
+            self._sync_handle()
+        return self._handle
+
+    def _set_genome_handle(self, genome_handle):
+        self._handle = genome_handle
+
+    genome_handle = property(_get_genome_handle, _set_genome_handle,
+             doc='The flam3.GenomeHandle, with edits to the xforms, '
+                 'palette, center and background written into it first.')
+
+    def _use_handle(self, genome_handle, seed=False):
+        """Keep the handle attributes in genome_handle from now on; seed
+        copies the values set so far into it"""
+        if genome_handle is None:
+            self.genome_handle = None
+            return
+
+        values = [(name, self.__dict__.pop(name)) for name in _HANDLE_ATTRIBUTES
+                  if name in self.__dict__]
+        self.genome_handle = genome_handle
+
+        if seed:
+            for name, value in values:
+                setattr(genome_handle, name, value)
+
     def set_defaults(self):
         self.time = 0.0
 
@@ -836,7 +1071,7 @@ class Genome(object):
 
         self.palette = Palette()
 
-        self.center = numpy.zeros(1, [('x', numpy.float32), ('y', numpy.float32)])
+        self.center = numpy.zeros(1, [('x', numpy.float64), ('y', numpy.float64)])
 
         self.gamma = 4.0
         self.vibrancy = 1.0
@@ -849,12 +1084,12 @@ class Genome(object):
         self.rotate = 0.0
 
         self.pixels_per_unit = 50
-        self.interpolation = flam3.flam3_interpolation_linear
-        self.palette_interpolation = flam3.flam3_palette_interpolation_hsv
+        self.interpolation = constants.flam3_interpolation_linear
+        self.palette_interpolation = constants.flam3_palette_interpolation_hsv
 
         self.highlight_power = -1.0
 
-        self.background = numpy.zeros(1, [('r', numpy.uint8), ('g', numpy.uint8), ('b', numpy.uint8)])
+        self.background = numpy.zeros(1, [('r', numpy.float64), ('g', numpy.float64), ('b', numpy.float64)])
 
         self.width = 100
         self.height = 100
@@ -876,15 +1111,15 @@ class Genome(object):
 
         self.ntemporal_samples = 1000
 
-        self.spatial_filter_select = flam3.flam3_gaussian_kernel
+        self.spatial_filter_select = constants.flam3_gaussian_kernel
 
-        self.interpolation_type = flam3.flam3_inttype_log
+        self.interpolation_type = constants.flam3_inttype_log
 
-        self.temporal_filter_type = flam3.flam3_temporal_box
+        self.temporal_filter_type = constants.flam3_temporal_box
         self.temporal_filter_width = 1.0
         self.temporal_filter_exp = 0.0
 
-        self.palette_mode = flam3.flam3_palette_mode_step
+        self.palette_mode = constants.flam3_palette_mode_step
 
         self.xforms = []
 
@@ -931,13 +1166,33 @@ class Genome(object):
 
     def _init_from_node(self, flame_node):
         self._flame_node = flame_node
-        self._refresh_handle_from_self()
-        self._refresh_self_from_handle()
+
+        if flam3 is None:
+            self.genome_handle = None
+            self._load_flame_node(flame_node)
+            return
+
+        self._init_from_parsed(flame_node,
+                flam3.from_xml(etree.tostring(flame_node))[0])
 
     def _init_from_handle(self, genome_handle):
-        self.genome_handle = genome_handle
+        self._use_handle(genome_handle)
         self._refresh_self_from_handle()
 
+    def _init_from_parsed(self, flame_node, genome_handle):
+        """Mirror a genome flam3 already parsed from flame_node, without
+        printing the handle back to xml and parsing that"""
+        self._use_handle(genome_handle)
+        self._flame_node = flame_node
+        self._load_flame_node(flame_node)
+        self._load_handle_palette()
+
+    def _load_handle_palette(self):
+        """Take the palette flam3 resolved, indexed palettes expanded"""
+        # Whole numbers, like the <color> entries flam3 prints
+        rgb = self._handle.palette[:, :3] * 255.0
+        self.palette.array[:] = numpy.trunc(numpy.round(rgb, 3))
+
     #start xml
     def to_xml(self):
         root = etree.Element('flame')
@@ -951,26 +1206,22 @@ class Genome(object):
             root.set('zoom', str(self.zoom))
         root.set('oversample', str(self.spatial_oversample))
         root.set('filter', str(self.spatial_filter_radius))
-        shapes = ['gaussian', 'hermite', 'box', 'triangle', 'bell', 'bspline',
-                  'lanczos3', 'lanczos2', 'mitchell', 'blackman', 'catrom',
-                  'hamming', 'hanning', 'quadratic']
-        root.set('filter_shape', shapes[self.spatial_filter_select])
+        root.set('filter_shape', _FILTER_SHAPES[self.spatial_filter_select])
         root.set('quality', str(self.nbatches))
         root.set('brightness', str(self.brightness))
         root.set('gamma', str(self.gamma))
         root.set('vibrancy', str(self.vibrancy))
         root.set('contrast', str(self.contrast))
         root.set('highlight_power', str(self.highlight_power))
-        root.set('background', '%d %d %d' % tuple(self.background[0]))
+        root.set('background', '%f %f %f' % tuple(self.background[0]))
         if self.symmetry <> 0:
             root.set('symmetry', str(self.symmetry))
         if self.interpolation == 1:
             root.set('interpolation', 'smooth')
         if self.palette_interpolation == 1:
             root.set('palette_interpolation', 'sweep')
-        types = ['linear', 'log', 'old', 'older']
         if self.interpolation_type <> 0:
-            root.set('interpolation_type', types[self.interpolation_type])
+            root.set('interpolation_type', _INTERPOLATION_TYPES[self.interpolation_type])
         root.set('estimator_radius', str(self.estimator))
         root.set('estimator_minimum', str(self.estimator_minimum))
         root.set('estimator_curve', str(self.estimator_curve))
@@ -1011,52 +1262,262 @@ class Genome(object):
                     for vari, valu in self.final.vars.variables[var].items():
                         froot.set('%s_%s' % (var,vari), str(valu))
 
-        for i in xrange(256):
+        # tolist() formats python floats, much faster than numpy scalars
+        for index, rgb in zip(_COLOR_INDICES, self.palette.array.tolist()):
             croot = etree.SubElement(root, "color")
-            croot.set('index', str(i))
-            croot.set('rgb', '%.2f %.2f %.2f' % tuple(self.palette.array[i]))
+            croot.set('index', index)
+            croot.set('rgb', '%.2f %.2f %.2f' % tuple(rgb))
         return root
     #end xml
 
 
     def clone(self):
-        return load_genome(xml_source=etree.tostring(self._flame_node))
+        if self._handle is None:
+            return load_genome(xml_source=etree.tostring(self.to_xml()))
+
+        other = Genome(genome_handle=self.genome_handle.clone())
+        other.name = self.name
+        other.highlight_power = self.highlight_power
+        other.palette_mode = self.palette_mode
+        return other
+
+    def fingerprint(self, tolerance=1e-6):
+        """A hex digest of the genome's numeric state
+
+        Covers the camera, color and filter settings, every xform's
+        coefs, post, weights, variations and variables, the final xform
+        and the palette, each rounded to a multiple of tolerance.  The
+        size is left out; it belongs to the render, not the genome.  Use
+        the digest, not the genome, to key dicts and sets of genomes.
+        """
+        values = [self.center[0][0], self.center[0][1], self.rotate,
+                  self.pixels_per_unit, self.zoom, self.brightness,
+                  self.contrast, self.gamma, self.vibrancy, self.hue_rotation,
+                  self.highlight_power, self.spatial_filter_radius,
+                  self.estimator, self.estimator_minimum, self.estimator_curve,
+                  self.symmetry, len(self.xforms)]
+        values.extend(self.background[0])
+        names = []
+
+        for xform in self.xforms:
+            names.append('xform')
+            xform._fingerprint_state(values, names)
+
+        if self.has_final():
+            names.append('finalxform')
+            self.final._fingerprint_state(values, names)
+
+        values.extend(numpy.asarray(self.palette.array, numpy.float64).ravel())
+
+        return quantized_digest(values, names, tolerance)
+
+    def render(self, buffer, cache=None, metrics=None, **kwargs):
+        """Render into buffer, through a rendercache.RenderCache if given
+
+        metrics, a metrics.RenderMetrics or metrics.Registry (True for
+        the default registry), records stage timings, and cache hits.
+        """
+        if cache is not None:
+            return cache.render(self, buffer, metrics=metrics, **kwargs)
+
+        if metrics is not None:
+            return metered_render(self, buffer, metrics, **kwargs)
 
-    def render(self, buffer, **kwargs):
         return self.genome_handle.render(buffer, **kwargs)
 
+    def render_tiled(self, buffer, max_bytes, parallel=False, **kwargs):
+        """Render in tiles that each fit in max_bytes of flam3 memory
+
+        See GenomeHandle.render_tiled.
+        """
+        return self.genome_handle.render_tiled(buffer, max_bytes, parallel, **kwargs)
+
+    def estimate_bounds(self, eps=0.01, nsamples=10000, seed=None):
+        """((xmin, ymin), (xmax, ymax)) of the attractor, ignoring a
+        fraction eps of outlying points on each side, as flam3 does; see
+        GenomeHandle.estimate_bounds"""
+        if self.genome_handle is not None:
+            return self.genome_handle.estimate_bounds(eps, nsamples, seed)
+
+        from . import npengine
+        points = numpy.concatenate([s[:, :2].copy() for s in
+                                    npengine.iterate(self, nsamples, seed=seed)])
+        lo = numpy.percentile(points, 100.0 * eps, axis=0)
+        hi = numpy.percentile(points, 100.0 - 100.0 * eps, axis=0)
+
+        return (lo[0], lo[1]), (hi[0], hi[1])
+
+    def autoframe(self, width=None, height=None, margin=0.05, eps=0.01,
+                  nsamples=10000, seed=None):
+        """Set size, center, pixels_per_unit and zoom so the attractor
+        fills width x height, leaving margin of each side empty"""
+        width = width or self.width
+        height = height or self.height
+
+        if self.genome_handle is not None:
+            cx, cy, ppu = self.genome_handle.autoframe(width, height, margin,
+                                                       eps, nsamples, seed)
+        else:
+            bmin, bmax = self.estimate_bounds(eps, nsamples, seed)
+            cx, cy, ppu = frame_bounds(bmin, bmax, width, height, margin, self.rotate)
+
+        self.width = width
+        self.height = height
+        self.center[0] = (cx, cy)
+        self.pixels_per_unit = ppu
+        self.zoom = 0.0
+
+    def render_adaptive(self, buffer, **kwargs):
+        """Render until the image converges, see
+        pyflam3ng.progressive.render_adaptive"""
+        return progressive.render_adaptive(self, buffer, **kwargs)
+
+    def render_histogram(self, **kwargs):
+        """Iterate into a pyflam3ng.histogram.Histogram that tonemap can
+        turn into images repeatedly while the color settings change"""
+        return histogram.render_histogram(self, self.width, self.height, **kwargs)
+
+    def tonemap(self, hist, buffer=None, **kwargs):
+        return histogram.tonemap(hist, self, buffer, **kwargs)
+
     def random(self, variations=None, symmetry=False, num_xforms=2):
+        if flam3 is None:
+            raise RuntimeError('random genomes need libflam3')
+
         if variations is None:
             variations = flam3.get_variation_list()
 
-        self.genome_handle.random(variations, symmetry, num_xforms)
+        self._handle.random(variations, symmetry, num_xforms)
         self._refresh_self_from_handle()
 
     def _refresh_handle_from_self(self):
-        self.genome_handle = flam3.from_xml(etree.tostring(self._flame_node))[0]
+        self._use_handle(flam3.from_xml(etree.tostring(self._flame_node))[0])
 
     def _refresh_self_from_handle(self):
-        xml_source = flam3.to_xml(self.genome_handle)
-        self._flame_node = etree.fromstring(xml_source)
-        attrib = self._flame_node.attrib
+        """Mirror the parts of the handle that are not struct backed
+        attributes: name, center, background, palette and xforms"""
+        handle = self._handle
 
-        def scalar_attrib(src_name, dest_name=None, coerce_type=float, node=self._flame_node):
+        self.name = handle.name or 'unknown'
+        self.center[0] = handle.center
+        self.background[0] = handle.background
+        self._load_handle_palette()
+
+        self.xforms = [Xform(xform_handle=xform) for xform in handle.xforms]
+
+        final = handle.final_xform
+        self._finalx = final is not None
+        if final is not None:
+            self._final = Xform(xform_handle=final)
+
+        self._mark_synced()
+
+    def _mirror_state(self):
+        """The center, background, palette and xforms, in a form
+        _sync_handle can compare to spot edits"""
+        values = []
+        names = []
+
+        for xform in self.xforms:
+            names.append('xform')
+            xform._fingerprint_state(values, names)
+
+        if self.has_final():
+            names.append('finalxform')
+            self.final._fingerprint_state(values, names)
+
+        return [tuple(self.center[0]), tuple(self.background[0]),
+                self.palette.array.tostring(), (values, names)]
+
+    def _mark_synced(self):
+        self._synced = self._mirror_state()
+
+    def _sync_handle(self):
+        """Write the center, background, palette and xforms into the
+        handle where they changed since it was last mirrored or synced
+
+        Edit either the mirrors or the handle between syncs, not both:
+        a changed mirror overwrites its part of the handle.  Adding or
+        removing xforms or changing their variations rebuilds the handle,
+        so XformHandles taken from the old one no longer apply.
+        """
+        if self._synced is None:
+            return
+
+        state = self._mirror_state()
+        if state == self._synced:
+            return
+
+        center, background, palette, xforms = [new != old for new, old
+                                               in zip(state, self._synced)]
+        handle = self._handle
+
+        if xforms:
+            pairs = zip(self.xforms, handle.xforms)
+            if self.has_final() and handle.final_xform is not None:
+                pairs.append((self.final, handle.final_xform))
+
+            if (len(self.xforms) != len(handle.xforms)
+                    or self.has_final() != (handle.final_xform is not None)
+                    or not all(xform._fits_handle(h) for xform, h in pairs)):
+                handle = self._rebuild_handle()
+                pairs = zip(self.xforms, handle.xforms)
+                if self.has_final():
+                    pairs.append((self.final, handle.final_xform))
+
+            for xform, xform_handle in pairs:
+                xform._write_handle(xform_handle)
+
+        if center:
+            handle.center = state[0]
+        if background:
+            handle.background = state[1]
+        if palette:
+            rgb = numpy.asarray(self.palette.array, numpy.float64)
+            handle.palette[:, :3] = rgb / 255.0
+
+        self._synced = state
+
+    def _rebuild_handle(self):
+        """Replace the handle with one parsed from to_xml, for a new
+        set of xforms, keeping everything else the old handle holds"""
+        old = self._handle
+        handle = flam3.from_xml(etree.tostring(self.to_xml()))[0]
+
+        for name in _HANDLE_ATTRIBUTES:
+            setattr(handle, name, getattr(old, name))
+        handle.name = old.name
+        handle.center = old.center
+        handle.background = old.background
+        handle.palette[:] = old.palette
+
+        self._handle = handle
+        return handle
+
+    def _load_flame_node(self, flame_node):
+        attrib = flame_node.attrib
+
+        def scalar_attrib(src_name, dest_name=None, coerce_type=float, node=flame_node):
             if src_name in node.attrib:
                 setattr(self, dest_name if dest_name else src_name,
                         coerce_type(node.attrib[src_name]))
 
-        def whitespace_array(src_name, coerce_type=float, node=self._flame_node):
-            return map(coerce_type, node.attrib.get(src_name).split(' '))
+        def whitespace_array(src_name, coerce_type=float, node=flame_node):
+            return map(coerce_type, node.attrib.get(src_name).split())
 
-        def mapped_attrib(src_name, dest_name=None, mapping={}, node=self._flame_node):
+        def mapped_attrib(src_name, dest_name=None, mapping={}, node=flame_node):
             if src_name in node.attrib:
                 setattr(self, dest_name if dest_name else src_name,
                         mapping[node.attrib[src_name]])
 
-        self.width, self.height = whitespace_array('size', int)
+        if 'size' in attrib:
+            self.width, self.height = whitespace_array('size', int)
+
+        if 'center' in attrib:
+            self.center[0] = tuple(whitespace_array('center'))
 
-        self.center.fill(buffer(numpy.array(whitespace_array('center'))))
-        self.background.fill(buffer(numpy.array(whitespace_array('background'))))
+        if 'background' in attrib:
+            self.background[0] = tuple(whitespace_array('background'))
 
         self.name = 'unknown'
         scalar_attrib('name', coerce_type=str)
@@ -1081,70 +1542,70 @@ class Genome(object):
         scalar_attrib('supersample', 'spatial_oversample', int)
 
         mapped_attrib('interpolation', mapping={
-            'linear': flam3.flam3_interpolation_linear,
-            'smooth': flam3.flam3_interpolation_smooth,
+            'linear': constants.flam3_interpolation_linear,
+            'smooth': constants.flam3_interpolation_smooth,
         })
 
         mapped_attrib('palette_interpolation', mapping={
-            'hsv': flam3.flam3_palette_interpolation_hsv,
-            'sweep': flam3.flam3_palette_interpolation_sweep,
+            'hsv': constants.flam3_palette_interpolation_hsv,
+            'sweep': constants.flam3_palette_interpolation_sweep,
         })
 
         mapped_attrib('filter_shape', 'spatial_filter_select', mapping={
-            'gaussian': flam3.flam3_gaussian_kernel,
-            'hermite': flam3.flam3_hermite_kernel,
-            'box': flam3.flam3_box_kernel,
-            'triangle': flam3.flam3_triangle_kernel,
-            'bell': flam3.flam3_bell_kernel,
-            'bspline': flam3.flam3_b_spline_kernel,
-            'lanczos3': flam3.flam3_lanczos3_kernel,
-            'lanczos2': flam3.flam3_lanczos2_kernel,
-            'mitchell': flam3.flam3_mitchell_kernel,
-            'blackman': flam3.flam3_blackman_kernel,
-            'catrom': flam3.flam3_catrom_kernel,
-            'hamming': flam3.flam3_hamming_kernel,
-            'hanning': flam3.flam3_hanning_kernel,
-            'quadratic': flam3.flam3_quadratic_kernel,
+            'gaussian': constants.flam3_gaussian_kernel,
+            'hermite': constants.flam3_hermite_kernel,
+            'box': constants.flam3_box_kernel,
+            'triangle': constants.flam3_triangle_kernel,
+            'bell': constants.flam3_bell_kernel,
+            'bspline': constants.flam3_b_spline_kernel,
+            'lanczos3': constants.flam3_lanczos3_kernel,
+            'lanczos2': constants.flam3_lanczos2_kernel,
+            'mitchell': constants.flam3_mitchell_kernel,
+            'blackman': constants.flam3_blackman_kernel,
+            'catrom': constants.flam3_catrom_kernel,
+            'hamming': constants.flam3_hamming_kernel,
+            'hanning': constants.flam3_hanning_kernel,
+            'quadratic': constants.flam3_quadratic_kernel,
         })
 
         mapped_attrib('temporal_filter_type', mapping={
-            'box': flam3.flam3_temporal_box,
-            'gaussian': flam3.flam3_temporal_gaussian,
-            'exp': flam3.flam3_temporal_exp,
+            'box': constants.flam3_temporal_box,
+            'gaussian': constants.flam3_temporal_gaussian,
+            'exp': constants.flam3_temporal_exp,
         })
 
 
         mapped_attrib('palette_mode', mapping={
-            'step': flam3.flam3_palette_mode_step,
-            'linear': flam3.flam3_palette_mode_linear,
+            'step': constants.flam3_palette_mode_step,
+            'linear': constants.flam3_palette_mode_linear,
         })
 
         mapped_attrib('interpolation', mapping={
-            'linear': flam3.flam3_interpolation_linear,
-            'smooth': flam3.flam3_interpolation_smooth,
+            'linear': constants.flam3_interpolation_linear,
+            'smooth': constants.flam3_interpolation_smooth,
         })
 
         mapped_attrib('interpolation_type', mapping={
-            'linear': flam3.flam3_inttype_linear,
-            'log': flam3.flam3_inttype_log,
-            'old': flam3.flam3_inttype_compat,
-            'older': flam3.flam3_inttype_older,
+            'linear': constants.flam3_inttype_linear,
+            'log': constants.flam3_inttype_log,
+            'old': constants.flam3_inttype_compat,
+            'older': constants.flam3_inttype_older,
         })
 
         mapped_attrib('palette_interpolation', mapping={
-            'hsv': flam3.flam3_palette_interpolation_hsv,
-            'sweep': flam3.flam3_palette_interpolation_sweep ,
+            'hsv': constants.flam3_palette_interpolation_hsv,
+            'sweep': constants.flam3_palette_interpolation_sweep ,
         })
 
 
-        sym_node = self._flame_node.xpath('//symmetry')
+        sym_node = flame_node.xpath('symmetry')
 
         if sym_node:
             scalar_attrib('symmetry', coerce_type=int, node=sym_node[0])
 
         self.palette = Palette()
 
-        for color_node in self._flame_node.xpath('//color'):
+        for color_node in flame_node.xpath('color'):
             # should this be int(math.floor(float(... ?
             #TODO: This loses all the float palette entries from flam3.  Is this what we want?
             index = int(float(color_node.attrib['index']))
@@ -1152,5 +1613,5 @@ class Genome(object):
             self.palette.array[index] = rgb
 
         self.xforms = []
-        for xform_node in self._flame_node.xpath('//xform'):
+        for xform_node in flame_node.xpath('xform'):
             self.xforms.append(Xform(xml_node=xform_node))
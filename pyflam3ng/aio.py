@@ -0,0 +1,233 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Event loop front end for rendering
+
+Built on trollius, the asyncio port for Python 2, so coroutines use
+``yield From(...)`` and ``raise Return(...)`` instead of await/return:
+
+    stats = yield From(aio.render(genome, buffer))
+
+    queue = aio.AsyncRenderQueue(max_in_flight=4)
+    task = yield From(queue.submit(genome, buffer))
+    while 1:
+        update = yield From(task.next_progress())
+        if update is None:
+            break
+    stats = yield From(task.wait())
+
+flam3_render always runs on another thread; results, progress and
+errors come back through call_soon_threadsafe.  Cancelling a coroutine
+that waits on a render cancels the render through its progress
+callback.
+"""
+import functools
+import threading
+
+import trollius as asyncio
+from trollius import From, Return
+
+from .renderqueue import RenderJob, RenderQueue
+
+
+__all__ = [ 'render'
+          , 'AsyncRenderQueue'
+          , 'RenderTask'
+          ]
+
+
+@asyncio.coroutine
+def render(genome, buffer, progress=None, loop=None, executor=None, **kwargs):
+    """Render genome into buffer on an executor thread
+
+    progress(progress, stage), if given, is called on the event loop.
+    Other keyword arguments go to genome.render.  Returns its stats.
+    """
+    loop = loop or asyncio.get_event_loop()
+    cancelled = threading.Event()
+
+    def progress_proc(value, stage, eta):
+        if cancelled.isSet():
+            return 1
+
+        if progress is not None:
+            loop.call_soon_threadsafe(progress, value, stage)
+        return 0
+
+    future = loop.run_in_executor(executor, functools.partial(
+            genome.render, buffer, progress=progress_proc, **kwargs))
+
+    try:
+        stats = yield From(asyncio.shield(future, loop=loop))
+    except asyncio.CancelledError:
+        # Stop flam3 and let the thread let go of buffer before the
+        # cancellation reaches the caller
+        cancelled.set()
+        try:
+            yield From(future)
+        except Exception:
+            pass
+        raise
+
+    raise Return(stats)
+
+
+class _AsyncRenderJob(RenderJob):
+    """A RenderJob that reports back to its RenderTask on the loop"""
+
+    def process_progress(self, progress, stage):
+        RenderJob.process_progress(self, progress, stage)
+        self.task._call(self.task._on_progress, progress, stage)
+
+
+class RenderTask(object):
+    """A render queued through AsyncRenderQueue
+
+    wait() returns the render stats; next_progress() returns the next
+    (progress, stage) update, or None once the render has finished.
+    cancel() stops the render through its progress callback.  A task
+    still pending when its queue quits is cancelled.
+    """
+
+    def __init__(self, owner, genome, buffer, **kwargs):
+        self.loop = owner.loop
+        self._owner = owner
+        self._finished = False
+        self.future = asyncio.Future(loop=self.loop)
+        self._progress = asyncio.Queue(loop=self.loop)
+
+        self.job = _AsyncRenderJob(genome, buffer,
+                cancel_cb=lambda job: self._call(self._on_cancelled),
+                completed_cb=lambda job: self._call(self._on_completed, job.stats),
+                error_cb=lambda job, error: self._call(self._on_error, error),
+                **kwargs)
+        self.job.task = self
+
+    def _call(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def _on_progress(self, progress, stage):
+        if not self.future.done():
+            self._progress.put_nowait((progress, stage))
+
+    def _finish(self):
+        # Give the slot back once, whichever callback ends the task
+        if self._finished:
+            return
+        self._finished = True
+
+        try:
+            self._progress.put_nowait(None)
+        finally:
+            self._owner._slots.release()
+
+    def _on_completed(self, stats):
+        try:
+            if not self.future.done():
+                self.future.set_result(stats)
+        finally:
+            self._finish()
+
+    def _on_cancelled(self):
+        try:
+            if not self.future.done():
+                self.future.cancel()
+        finally:
+            self._finish()
+
+    def _on_error(self, error):
+        try:
+            if not self.future.done():
+                self.future.set_exception(error)
+        finally:
+            self._finish()
+
+    def cancel(self):
+        self.job.cancel = True
+
+    @asyncio.coroutine
+    def wait(self):
+        try:
+            stats = yield From(asyncio.shield(self.future, loop=self.loop))
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+        raise Return(stats)
+
+    @asyncio.coroutine
+    def next_progress(self):
+        update = yield From(self._progress.get())
+        if update is None:
+            # Leave the end marker for any other reader
+            self._progress.put_nowait(None)
+
+        raise Return(update)
+
+
+class AsyncRenderQueue(object):
+    """A RenderQueue driven from an event loop
+
+    At most max_in_flight renders are queued or running at once; submit
+    waits for a free slot, which pushes back on callers instead of
+    piling jobs into the queue.  queue_kwargs build the RenderQueue
+    when queue is not given.
+    """
+
+    def __init__(self, queue=None, max_in_flight=4, loop=None, **queue_kwargs):
+        self.loop = loop or asyncio.get_event_loop()
+        self.queue = queue if queue is not None else RenderQueue(**queue_kwargs)
+        self._slots = asyncio.Semaphore(max_in_flight, loop=self.loop)
+
+        if not self.queue.isAlive():
+            self.queue.start()
+
+    @asyncio.coroutine
+    def submit(self, genome, buffer, **kwargs):
+        """Queue a render once a slot is free and return its RenderTask
+
+        Keyword arguments are those of RenderJob, such as priority.
+        """
+        yield From(self._slots.acquire())
+
+        try:
+            task = RenderTask(self, genome, buffer, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+        try:
+            self.queue.queue(task.job)
+        except Exception, e:
+            task._on_error(e)
+
+        raise Return(task)
+
+    @asyncio.coroutine
+    def render(self, genome, buffer, **kwargs):
+        task = yield From(self.submit(genome, buffer, **kwargs))
+        stats = yield From(task.wait())
+        raise Return(stats)
+
+    def close(self):
+        """Quit the queue; pending tasks are cancelled"""
+        self.queue.quit = True
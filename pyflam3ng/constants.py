@@ -60,6 +60,8 @@ flam3_quadratic_kernel = 13
 flam3_temporal_box = 0
 flam3_temporal_gaussian = 1
 flam3_temporal_exp = 2
+flam3_palette_mode_step = 0
+flam3_palette_mode_linear = 1
 
 
 flam3_VAR_LINEAR = 0
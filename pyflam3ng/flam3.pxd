@@ -33,9 +33,13 @@ cdef extern from "string.h":
 
 cdef extern from "Python.h":
     int PyObject_AsWriteBuffer(object, void **, Py_ssize_t *)    except -1
+    int PyObject_AsReadBuffer(object, void **, Py_ssize_t *)    except -1
     void *PyCObject_AsVoidPtr(object) except NULL
     object PyString_FromStringAndSize (char *, Py_ssize_t)
+    char *PyString_AS_STRING(object)
     object PyBuffer_FromMemory(void *ptr, Py_ssize_t size) 
+    int PyBUF_FORMAT
+    Py_ssize_t PY_SSIZE_T_MAX
 
 
 cdef enum:
@@ -54,8 +58,15 @@ cdef extern from "flam3.h":
 
     char *flam3_variation_names[]
 
+    # From isaac.h, which flam3.h includes
+    enum: RANDSIZ
+    ctypedef unsigned long ub4
+
     ctypedef struct randctx:
-        pass
+        ub4 randcnt
+        ub4 randrsl[RANDSIZ]
+
+    void irandinit(randctx *ctx, int flag) nogil
 
     ctypedef struct flam3_img_comments:
         char *genome
@@ -217,7 +228,7 @@ cdef extern from "flam3.h":
         double estimator_curve
         double estimator_minimum
 
-#        xmlDocPtr edits
+        void *edits
 
         double gam_lin_thresh
 
@@ -312,17 +323,48 @@ cdef extern from "flam3.h":
     void sheep_edge(flam3_genome *cp, double blend, int seqflag, double stagger) nogil
 
 
+cdef extern from *:
+    """
+    /* Exported by libflam3 but only declared in its private headers */
+    int prepare_xform_fn_ptrs(flam3_genome *cp, randctx *rc);
+    """
+    int prepare_xform_fn_ptrs(flam3_genome *cp, randctx *rc) nogil
+
+
+cdef struct render_progress:
+    double progress
+    double eta
+    int stage
+    int cancel
+    int cancelled
+    long updates
+
+
+cdef class RenderProgress:
+    cdef render_progress _state
+
+
 cdef class RenderBuffer:
     cdef unsigned char* _buffer
     cdef int _bytes_per_pixel
     cdef unsigned int _width
     cdef unsigned int _height
+    cdef object _base
+    cdef int _exports
+    cdef Py_ssize_t _shape[3]
+    cdef Py_ssize_t _strides[3]
+
+    cdef Py_ssize_t _size(RenderBuffer self)
 
     cpdef resize(RenderBuffer self, unsigned int width, unsigned int height, int channels)
+    cdef _attach(RenderBuffer self, unsigned char *data, unsigned int width, unsigned int height, int channels, object base)
+    cdef _convert_to(RenderBuffer self, unsigned char *dest, int format, Py_ssize_t dest_stride)
 
 cdef class GenomeHandle:
     cdef flam3_genome* _genome
 
+    cdef void _free_xforms(self)
     cdef void copy_genome(self, flam3_genome* genome)
     cdef _render(GenomeHandle self, void *out_buffer, unsigned int channels, int transparent, object progress, double pixel_aspect_ratio, int bits, double time, int nthreads)
+    cdef dict _render_tile(GenomeHandle self, RenderBuffer out_buffer, unsigned int x0, unsigned int y0, unsigned int core_w, unsigned int core_h, object progress, dict kwargs)
 
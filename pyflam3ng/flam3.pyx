@@ -22,7 +22,14 @@
 ##############################################################################
 
 import sys
+import hashlib
+import mmap
+import struct
+import threading
+import numpy
+from pyflam3ng.func import quantized_digest, frame_bounds
 cimport flam3
+cimport swizzle
 cimport numpy as np
 cimport stdlib
 
@@ -129,6 +136,29 @@ flam3_temporal_gaussian = 1
 flam3_temporal_exp = 2
 
 
+_pil_formats = {
+    'RGB': swizzle.FORMAT_RGB,
+    'RGBA': swizzle.FORMAT_RGBA,
+    'RGBa': swizzle.FORMAT_RGBA_PREMULTIPLIED,
+}
+
+# QImage::Format values mapped to their in-memory byte order
+if sys.byteorder == 'little':
+    _qimage_formats = {
+        4: swizzle.FORMAT_BGRX,                     # Format_RGB32
+        5: swizzle.FORMAT_BGRA,                     # Format_ARGB32
+        6: swizzle.FORMAT_BGRA_PREMULTIPLIED,       # Format_ARGB32_Premultiplied
+        13: swizzle.FORMAT_RGB,                     # Format_RGB888
+    }
+else:
+    _qimage_formats = {
+        4: swizzle.FORMAT_XRGB,
+        5: swizzle.FORMAT_ARGB,
+        6: swizzle.FORMAT_ARGB_PREMULTIPLIED,
+        13: swizzle.FORMAT_RGB,
+    }
+
+
 cdef int PyString_Check(object op):
     return isinstance(op, str)
 
@@ -138,6 +168,16 @@ cdef void* _malloc(size):
     return memset(p, 0, size)
 
 
+cdef Py_ssize_t _image_size(unsigned int width, unsigned int height, int channels) except -1:
+    """width * height * channels bytes, raising OverflowError instead of
+    wrapping"""
+    if <object>width * height * channels > PY_SSIZE_T_MAX:
+        raise OverflowError('a %dx%d image with %d channels is too large' %
+                            (width, height, channels))
+
+    return <Py_ssize_t>width * height * channels
+
+
 #Return value needs to be freed using flam3_free
 cdef char* _create_str_copy(object source_str):
     if not PyString_Check(source_str) or source_str is None:
@@ -154,122 +194,356 @@ cdef char* _create_str_copy(object source_str):
     return strncpy(c_buffer_copy, c_string, string_len + 1)
 
 
+DEF CHOOSE_XFORM_GRAIN = 10000
+
+
 def random_seed():
     flam3_srandom()
 
 
+cdef inline unsigned long long _splitmix64(unsigned long long *state):
+    cdef unsigned long long z
+
+    state[0] += 0x9E3779B97F4A7C15ULL
+    z = state[0]
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL
+    return z ^ (z >> 31)
+
+
+cdef object _seed_key(object seed):
+    # ints and strings by value so seeds agree across builds
+    if isinstance(seed, (int, long)):
+        return 'int:%d' % seed
+    if isinstance(seed, unicode):
+        seed = seed.encode('utf-8')
+    if isinstance(seed, str):
+        return 'str:' + seed
+    return 'hash:%d' % hash(seed)
+
+
+cdef int _seed_randctx(randctx *rc, object seed) except -1:
+    """Seed an ISAAC context like flam3_init_frame, but from seed if given
+
+    The seed is hashed with sha1 and expanded into the whole ISAAC state
+    with splitmix64, so nearby seeds give unrelated streams.
+    """
+    cdef flam3_frame frame
+    cdef unsigned long long state
+    cdef unsigned long long z
+    cdef int idx
+
+    if seed is None:
+        flam3_init_frame(&frame)
+        memmove(rc, &frame.rc, sizeof(randctx))
+        return 0
+
+    state = struct.unpack('<Q', hashlib.sha1(_seed_key(seed)).digest()[:8])[0]
+    memset(rc, 0, sizeof(randctx))
+
+    for 0 <= idx < RANDSIZ / 2:
+        z = _splitmix64(&state)
+        rc.randrsl[2 * idx] = <ub4>(z & 0xffffffffULL)
+        rc.randrsl[2 * idx + 1] = <ub4>(z >> 32)
+
+    irandinit(rc, 1)
+    return 0
+
+
 cdef class RenderBuffer:
     def __cinit__(RenderBuffer self, unsigned int width=0, unsigned int height=0, int channels=0):
         self._buffer = NULL
         self._bytes_per_pixel = 0
         self._width = 0
         self._height = 0
+        self._base = None
+        self._exports = 0
 
         if width != 0:
             self.resize(width, height, channels)
 
+    @classmethod
+    def from_array(cls, np.ndarray array not None):
+        """Wrap a (height, width, channels) uint8 ndarray without copying
+
+        The buffer keeps a reference to the array and renders straight
+        into its memory.
+        """
+        cdef RenderBuffer self
+
+        if array.ndim != 3 or array.dtype != numpy.uint8:
+            raise ValueError('expected a (height, width, channels) uint8 array')
+
+        if array.shape[2] not in (3, 4):
+            raise ValueError('expected 3 or 4 channels')
+
+        if not array.flags.c_contiguous or not array.flags.writeable:
+            raise ValueError('array must be writeable and C contiguous')
+
+        self = cls()
+        self._attach(<unsigned char*>np.PyArray_DATA(array), array.shape[1],
+                array.shape[0], array.shape[2], array)
+        return self
+
+    @classmethod
+    def mapped(cls, str path, unsigned int width, unsigned int height, int channels, str header='pnm'):
+        """Create a buffer backed by a memory mapped image file at path
+
+        header is 'pnm' for a binary PPM (3 channels) or PAM (4 channels)
+        header in front of the pixels, or 'raw' for bare pixel data.
+        Renders land directly in the file; call flush() or close() to make
+        sure everything is on disk.
+        """
+        cdef RenderBuffer self
+        cdef unsigned char *data = NULL
+        cdef Py_ssize_t data_len = 0
+        cdef Py_ssize_t size
+
+        if channels not in (3, 4):
+            raise ValueError('expected 3 or 4 channels')
+
+        size = _image_size(width, height, channels)
+
+        if header == 'raw':
+            header_bytes = ''
+        elif header == 'pnm' and channels == 3:
+            header_bytes = 'P6\n%d %d\n255\n' % (width, height)
+        elif header == 'pnm':
+            header_bytes = ('P7\nWIDTH %d\nHEIGHT %d\nDEPTH 4\nMAXVAL 255\n'
+                            'TUPLTYPE RGB_ALPHA\nENDHDR\n' % (width, height))
+        else:
+            raise ValueError('Unknown header type %r' % header)
+
+        fd = open(path, 'w+b')
+        try:
+            fd.write(header_bytes)
+            fd.truncate(len(header_bytes) + size)
+            fd.flush()
+            mapping = mmap.mmap(fd.fileno(), len(header_bytes) + size)
+        finally:
+            fd.close()
+
+        PyObject_AsWriteBuffer(mapping, <void**>&data, &data_len)
+
+        self = cls()
+        self._attach(data + len(header_bytes), width, height, channels, mapping)
+        return self
+
+    def flush(RenderBuffer self):
+        """Write a memory mapped buffer back to its file"""
+        if isinstance(self._base, mmap.mmap):
+            self._base.flush()
+
+    def close(RenderBuffer self):
+        """Release memory the buffer does not own, unmapping mapped files
+
+        The buffer is empty afterwards.
+        """
+        if self._base is None:
+            return
+
+        if self._exports:
+            raise BufferError('cannot close while views are exported')
+
+        base = self._base
+        self._base = None
+        self._buffer = NULL
+        self._width = 0
+        self._height = 0
+        self._bytes_per_pixel = 0
+
+        if isinstance(base, mmap.mmap):
+            base.flush()
+            base.close()
+
+    cdef _attach(RenderBuffer self, unsigned char *data, unsigned int width, unsigned int height, int channels, object base):
+        if self._exports:
+            raise BufferError('cannot replace memory while views are exported')
+
+        if self._base is None and self._buffer != NULL:
+            stdlib.free(self._buffer)
+
+        self._buffer = data
+        self._width = width
+        self._height = height
+        self._bytes_per_pixel = channels
+        self._base = base
+
+    cdef Py_ssize_t _size(RenderBuffer self):
+        return <Py_ssize_t>self._width * self._height * self._bytes_per_pixel
+
     cpdef resize(RenderBuffer self, unsigned int width, unsigned int height, int channels):
+        cdef Py_ssize_t size
+        cdef unsigned char *data
+
         if self._width != width or self._height != height or self._bytes_per_pixel != channels:
+            if self._exports:
+                raise BufferError('cannot resize while views are exported')
+
+            if self._base is not None:
+                raise ValueError('cannot resize a buffer over foreign memory')
+
+            size = _image_size(width, height, channels)
+            data = <unsigned char*>stdlib.realloc(self._buffer, size)
+            if data == NULL and size != 0:
+                raise MemoryError('Unable to allocate a %dx%d buffer' % (width, height))
+
+            self._buffer = data
             self._bytes_per_pixel = channels
             self._width = width
             self._height = height
 
-            self._buffer = <unsigned char*>stdlib.realloc(self._buffer, width * height * self._bytes_per_pixel)
+    def __getbuffer__(RenderBuffer self, Py_buffer *view, int flags):
+        if self._buffer == NULL:
+            raise BufferError('Buffer is empty')
+
+        self._shape[0] = self._height
+        self._shape[1] = self._width
+        self._shape[2] = self._bytes_per_pixel
+        self._strides[0] = <Py_ssize_t>self._width * self._bytes_per_pixel
+        self._strides[1] = self._bytes_per_pixel
+        self._strides[2] = 1
+
+        view.buf = <void*>self._buffer
+        view.obj = self
+        view.len = self._size()
+        view.readonly = 0
+        view.itemsize = 1
+        view.format = NULL
+        if flags & PyBUF_FORMAT:
+            view.format = 'B'
+        view.ndim = 3
+        view.shape = self._shape
+        view.strides = self._strides
+        view.suboffsets = NULL
+        view.internal = NULL
+
+        self._exports += 1
+
+    def __releasebuffer__(RenderBuffer self, Py_buffer *view):
+        self._exports -= 1
+
+    def as_array(RenderBuffer self):
+        """Return a (height, width, channels) uint8 ndarray sharing the buffer
+
+        The array keeps the buffer alive, and the buffer refuses to resize
+        while any array is still looking at it.
+        """
+        return numpy.asarray(self)
+
+    cdef _convert_to(RenderBuffer self, unsigned char *dest, int format, Py_ssize_t dest_stride):
+        cdef int result
+
+        if self._buffer == NULL:
+            raise RuntimeError('Buffer is empty')
+
+        with nogil:
+            result = swizzle.convert(self._buffer, self._bytes_per_pixel, 0,
+                    dest, format, dest_stride, self._width, self._height)
 
-    def to_image(RenderBuffer, self, object image):
-        """Write the buffer to a PIL Image"""
-        cdef str mode
+        if result < 0:
+            raise RuntimeError('Unsupported pixel format conversion')
+
+    def to_image(RenderBuffer self, str mode=None):
+        """Write the buffer to a PIL Image
+
+        mode may be 'RGB', 'RGBA' or 'RGBa' (premultiplied alpha) and
+        defaults to the layout of the buffer.
+        """
         cdef object Image
-        cdef object py_buffer
-        cdef int size = self._width*self._height*self._bytes_per_pixel
+        cdef object data
+        cdef int format
 
         if 'Image' not in sys.modules:
             raise RuntimeError('You must import Image before calling this method')
 
         Image = sys.modules['Image']
 
-        if self._bytes_per_pixel == 3:
-            mode = 'RGB'
-        else:
-            mode = 'RGBA'
-
-        py_buffer = PyBuffer_FromMemory(<void*>self._buffer, size)
+        if mode is None:
+            mode = 'RGB' if self._bytes_per_pixel == 3 else 'RGBA'
 
-        img = Image.frombuffer(mode, size, py_buffer, 'raw')
+        try:
+            format = _pil_formats[mode]
+        except KeyError:
+            raise ValueError('Unsupported image mode %r' % mode)
 
-        return img
+        data = PyString_FromStringAndSize(NULL,
+                <Py_ssize_t>self._width * self._height * swizzle.format_bytes_per_pixel(format))
+        self._convert_to(<unsigned char*>PyString_AS_STRING(data), format, 0)
 
+        return Image.frombuffer(mode, (self._width, self._height), data, 'raw', mode, 0, 1)
 
     def write_to_qimage(RenderBuffer self, object qimage):
-        """Write the buffer to a PyQt4 QImage"""
+        """Write the buffer to a PyQt4 QImage
+
+        Supports Format_RGB32, Format_ARGB32, Format_ARGB32_Premultiplied
+        and Format_RGB888 targets.
+        """
         if self._buffer == NULL:
             raise RuntimeError('Buffer is empty')
 
         cdef unsigned char *dest_p = <unsigned char*>PyCObject_AsVoidPtr(qimage.bits().ascobject())
-        cdef Py_ssize_t total_len = self._width * self._height * self._bytes_per_pixel
-        cdef int x = 0
-        cdef int y = 0
 
         if qimage.width() != self._width or qimage.height() != self._height:
             raise RuntimeError('Image dimensions do not match')
 
-        if qimage.format() == 5: # Format_ARGB32
-            if self._bytes_per_pixel != 4:
-                raise RuntimeError('Image formats do not match')
-
-            for 0 <= y <= self._height:
-                for 0 <= x <= self._width:
-                    dest_p[(y * 4 * self._width) + (x * 4) + 0] = self._buffer[(y * 4 * self._width) + (x * 4) + 2]
-                    dest_p[(y * 4 * self._width) + (x * 4) + 1] = self._buffer[(y * 4 * self._width) + (x * 4) + 1]
-                    dest_p[(y * 4 * self._width) + (x * 4) + 2] = self._buffer[(y * 4 * self._width) + (x * 4) + 0]
-                    dest_p[(y * 4 * self._width) + (x * 4) + 3] = self._buffer[(y * 4 * self._width) + (x * 4) + 3]
-
-        elif qimage.format() == 4: # Format_RGB32
-            # Source is RGB
-            if self._bytes_per_pixel == 3:
-                for 0 <= y <= self._height:
-                    for 0 <= x <= self._width:
-                        dest_p[(y * 4 * self._width) + (x * 4) + 0] = self._buffer[(y * 3 * self._width) + (x * 3) + 2]
-                        dest_p[(y * 4 * self._width) + (x * 4) + 1] = self._buffer[(y * 3 * self._width) + (x * 3) + 1]
-                        dest_p[(y * 4 * self._width) + (x * 4) + 2] = self._buffer[(y * 3 * self._width) + (x * 3) + 0]
-                        dest_p[(y * 4 * self._width) + (x * 4) + 3] = 0xFF
-
-            # Source is ARGB with or without transparency
-            else:
-                for 0 <= y <= self._height:
-                    for 0 <= x <= self._width:
-                        dest_p[(y * 4 * self._width) + (x * 4) + 0] = self._buffer[(y * 4 * self._width) + (x * 4) + 2]
-                        dest_p[(y * 4 * self._width) + (x * 4) + 1] = self._buffer[(y * 4 * self._width) + (x * 4) + 1]
-                        dest_p[(y * 4 * self._width) + (x * 4) + 2] = self._buffer[(y * 4 * self._width) + (x * 4) + 0]
-                        dest_p[(y * 4 * self._width) + (x * 4) + 3] = 0xFF
-
-        elif qimage.format() == 13: # Format_RGB888
-            if self._bytes_per_pixel != 3:
-                raise RuntimeError('Image formats do not match')
-
-            for 0 <= y <= self._height:
-                for 0 <= x <= self._width:
-                    dest_p[(y * 3 * self._width) + (x * 3) + 0] = self._buffer[(y * 3 * self._width) + (x * 3) + 0]
-                    dest_p[(y * 3 * self._width) + (x * 3) + 1] = self._buffer[(y * 3 * self._width) + (x * 3) + 1]
-                    dest_p[(y * 3 * self._width) + (x * 3) + 2] = self._buffer[(y * 3 * self._width) + (x * 3) + 2]
-
-        else:
+        try:
+            format = _qimage_formats[qimage.format()]
+        except KeyError:
             raise RuntimeError('Unsupported QImage format')
 
-    def write_to_legacy_buffer(RenderBuffer self, object legacy_buffer):
+        self._convert_to(dest_p, format, qimage.bytesPerLine())
+
+    def write_to_legacy_buffer(RenderBuffer self, object legacy_buffer, object format=None):
+        """Copy the buffer into anything exposing a writable buffer
+
+        format is one of the pyflam3ng.swizzle layouts and defaults to the
+        layout of the buffer itself.
+        """
         if self._buffer == NULL:
             raise RuntimeError('Buffer is empty')
 
         cdef unsigned char* dest_p = NULL
         cdef Py_ssize_t dest_len = 0
-        cdef Py_ssize_t total_len = self._width * self._height * self._bytes_per_pixel
+        cdef int c_format
+
+        if format is None:
+            c_format = swizzle.FORMAT_RGB if self._bytes_per_pixel == 3 else swizzle.FORMAT_RGBA
+        else:
+            c_format = format
+
+        if swizzle.format_bytes_per_pixel(c_format) < 0:
+            raise ValueError('Unknown pixel format %r' % format)
 
         PyObject_AsWriteBuffer(legacy_buffer, <void**>&dest_p, &dest_len)
 
-        if dest_len < total_len:
+        if dest_len < <Py_ssize_t>self._width * self._height * swizzle.format_bytes_per_pixel(c_format):
             raise RuntimeError("buffer isn't large enough")
 
-        memmove(dest_p, self._buffer, total_len)
+        self._convert_to(dest_p, c_format, 0)
+
+    def read_from_legacy_buffer(RenderBuffer self, object legacy_buffer):
+        """Fill the buffer from anything exposing the buffer interface"""
+        if self._buffer == NULL:
+            raise RuntimeError('Buffer is empty')
+
+        cdef unsigned char* src_p = NULL
+        cdef Py_ssize_t src_len = 0
+        cdef Py_ssize_t total_len = self._size()
+
+        PyObject_AsReadBuffer(legacy_buffer, <void**>&src_p, &src_len)
+
+        if src_len < total_len:
+            raise RuntimeError("buffer isn't large enough")
+
+        memmove(self._buffer, src_p, total_len)
+
+    def to_string(RenderBuffer self):
+        """Return a copy of the pixel data as a string"""
+        if self._buffer == NULL:
+            raise RuntimeError('Buffer is empty')
+
+        return PyString_FromStringAndSize(<char*>self._buffer, self._size())
 
     property width:
         def __get__(RenderBuffer self):
@@ -285,12 +559,14 @@ cdef class RenderBuffer:
 
     property size_in_bytes:
         def __get__(RenderBuffer self):
-            return self._width * self._height * self._bytes_per_pixel
+            return self._size()
 
     def __dealloc__(RenderBuffer self):
-        if self._buffer != NULL:
+        if self._buffer != NULL and self._base is None:
             stdlib.free(self._buffer)
-            self._buffer = NULL
+
+        self._buffer = NULL
+        self._base = None
 
 def interpolate(list genome_list, double time, double stagger=0.0):
     cdef flam3_genome* genomes
@@ -314,6 +590,154 @@ cdef int __render_callback(void *context, double progress, int stage, double eta
         return <int>(<object>context)(progress, stage, eta)
 
 
+cdef int __progress_callback(void *context, double progress, int stage, double eta) nogil:
+    cdef render_progress *state = <render_progress*>context
+    state.progress = progress
+    state.stage = stage
+    state.eta = eta
+    state.updates += 1
+    if state.cancel:
+        state.cancelled = 1
+    return state.cancel
+
+
+cdef class RenderProgress:
+    """Progress of a render, written by flam3 without taking the GIL
+
+    Pass one as progress= to GenomeHandle.render and read it from any
+    thread; setting cancel stops the render.  It is also an ordinary
+    progress callable, so paths that call back through Python accept it.
+    """
+    def __cinit__(RenderProgress self):
+        memset(&self._state, 0, sizeof(render_progress))
+
+    def __call__(RenderProgress self, double progress, int stage, double eta):
+        return __progress_callback(&self._state, progress, stage, eta)
+
+    def reset(RenderProgress self):
+        memset(&self._state, 0, sizeof(render_progress))
+
+    property progress:
+        def __get__(RenderProgress self):
+            return self._state.progress
+
+    property stage:
+        def __get__(RenderProgress self):
+            return self._state.stage
+
+    property eta:
+        def __get__(RenderProgress self):
+            return self._state.eta
+
+    property updates:
+        """How many times flam3 has reported progress"""
+        def __get__(RenderProgress self):
+            return self._state.updates
+
+    property cancel:
+        def __get__(RenderProgress self):
+            return bool(self._state.cancel)
+
+        def __set__(RenderProgress self, value):
+            self._state.cancel = 1 if value else 0
+
+    property cancelled:
+        """Whether flam3 saw cancel and stopped the render"""
+        def __get__(RenderProgress self):
+            return bool(self._state.cancelled)
+
+
+cdef class _DoubleView:
+    """Exports doubles inside a flam3 struct through the buffer protocol,
+    keeping the struct's owner alive for as long as a view is held"""
+    cdef object _owner
+    cdef double *_data
+    cdef int _ndim
+    cdef Py_ssize_t _shape[2]
+    cdef Py_ssize_t _strides[2]
+
+    def __getbuffer__(_DoubleView self, Py_buffer *view, int flags):
+        view.buf = <void*>self._data
+        view.obj = self
+        view.len = self._shape[0] * self._shape[1] * sizeof(double)
+        view.readonly = 0
+        view.itemsize = sizeof(double)
+        view.format = NULL
+        if flags & PyBUF_FORMAT:
+            view.format = 'd'
+        view.ndim = self._ndim
+        view.shape = self._shape
+        view.strides = self._strides
+        view.suboffsets = NULL
+        view.internal = NULL
+
+
+cdef object _double_array(object owner, double *data, int ndim,
+        Py_ssize_t rows, Py_ssize_t cols, Py_ssize_t row_stride):
+    """An ndarray over rows x cols doubles at data, or rows doubles if
+    ndim is 1"""
+    cdef _DoubleView view = _DoubleView()
+
+    view._owner = owner
+    view._data = data
+    view._ndim = ndim
+    view._shape[0] = rows
+    view._shape[1] = cols if ndim == 2 else 1
+    view._strides[0] = row_stride
+    view._strides[1] = sizeof(double)
+
+    return numpy.asarray(view)
+
+
+cdef list _xform_variables(flam3_xform *xf):
+    """The parametric variables of xf, grouped by variation name"""
+    return [ ('blob', (xf.blob_low, xf.blob_high, xf.blob_waves))
+           , ('pdj', (xf.pdj_a, xf.pdj_b, xf.pdj_c, xf.pdj_d))
+           , ('fan2', (xf.fan2_x, xf.fan2_y))
+           , ('rings2', (xf.rings2_val,))
+           , ('perspective', (xf.perspective_angle, xf.perspective_dist))
+           , ('julian', (xf.juliaN_power, xf.juliaN_dist))
+           , ('juliascope', (xf.juliaScope_power, xf.juliaScope_dist))
+           , ('radial_blur', (xf.radialBlur_angle,))
+           , ('pie', (xf.pie_slices, xf.pie_rotation, xf.pie_thickness))
+           , ('ngon', (xf.ngon_sides, xf.ngon_power, xf.ngon_circle, xf.ngon_corners))
+           , ('curl', (xf.curl_c1, xf.curl_c2))
+           , ('rectangles', (xf.rectangles_x, xf.rectangles_y))
+           , ('amw', (xf.amw_amp,))
+           , ('disc2', (xf.disc2_rot, xf.disc2_twist))
+           , ('super_shape', (xf.supershape_rnd, xf.supershape_m, xf.supershape_n1,
+                              xf.supershape_n2, xf.supershape_n3, xf.supershape_holes))
+           , ('flower', (xf.flower_petals, xf.flower_holes))
+           , ('conic', (xf.conic_eccen, xf.conic_holes))
+           , ('parabola', (xf.parabola_height, xf.parabola_width))
+           ]
+
+
+# Variable names of the parametric variations, in _xform_variables order
+_xform_variable_names = { 'blob': ('low', 'high', 'waves')
+                        , 'pdj': ('a', 'b', 'c', 'd')
+                        , 'fan2': ('x', 'y')
+                        , 'rings2': ('val',)
+                        , 'perspective': ('angle', 'dist')
+                        , 'julian': ('power', 'dist')
+                        , 'juliascope': ('power', 'dist')
+                        , 'radial_blur': ('angle',)
+                        , 'pie': ('slices', 'rotation', 'thickness')
+                        , 'ngon': ('sides', 'power', 'circle', 'corners')
+                        , 'curl': ('c1', 'c2')
+                        , 'rectangles': ('x', 'y')
+                        , 'amw': ('amp',)
+                        , 'disc2': ('rot', 'twist')
+                        , 'super_shape': ('rnd', 'm', 'n1', 'n2', 'n3', 'holes')
+                        , 'flower': ('petals', 'holes')
+                        , 'conic': ('eccentricity', 'holes')
+                        , 'parabola': ('height', 'width')
+                        }
+
+
+cdef dict _variation_index = None
+
+
 cdef class GenomeHandle:
     def __cinit__(self):
         self._genome = <flam3_genome*>_malloc(sizeof(flam3_genome));
@@ -335,11 +759,24 @@ cdef class GenomeHandle:
 
         stdlib.free(vars)
 
+    cdef void _free_xforms(self):
+        """Free the xform array, which the genome owns"""
+        if self._genome.xform != NULL:
+            flam3_free(self._genome.xform)
+            self._genome.xform = NULL
+
+        self._genome.num_xforms = 0
+        self._genome.final_xform_index = -1
+
     cdef void copy_genome(self, flam3_genome* genome):
+        """Take over genome and its xforms"""
+        self._free_xforms()
         memmove(self._genome, genome, sizeof(flam3_genome))
 
-    def __dealloc(self):
-        flam3_free(self._genome)
+    def __dealloc__(self):
+        if self._genome != NULL:
+            self._free_xforms()
+            flam3_free(self._genome)
 
     def clone(self):
         cdef GenomeHandle other = GenomeHandle()
@@ -369,7 +806,10 @@ cdef class GenomeHandle:
         frame.time = time
         frame.nthreads = nthreads
 
-        if progress is not None:
+        if isinstance(progress, RenderProgress):
+            frame.progress = __progress_callback
+            frame.progress_parameter = <void*>&(<RenderProgress>progress)._state
+        elif progress is not None:
             frame.progress = __render_callback
             frame.progress_parameter = <void*>progress
         else:
@@ -389,6 +829,10 @@ cdef class GenomeHandle:
         return py_stats
 
     def render(self, RenderBuffer out_buffer, **kwargs):
+        cdef object cache = kwargs.pop('cache', None)
+        if cache is not None:
+            return cache.render(self, out_buffer, **kwargs)
+
         cdef int transparent = <int>kwargs.get('transparent', 0)
         cdef void *data = out_buffer._buffer
         cdef unsigned int channels = out_buffer._bytes_per_pixel
@@ -403,6 +847,652 @@ cdef class GenomeHandle:
 
         return self._render(data, channels, transparent, progress, pixel_aspect_ratio, bits, time, nthreads)
 
+    def iterate(GenomeHandle self, long nsamples, int fuse=15, int chunk=1<<20, object seed=None):
+        """Generate raw chaos game samples from flam3_iterate
+
+        Yields (n, 4) float64 arrays of (x, y, color, alpha) rows, at most
+        chunk rows at a time, until nsamples have been produced.  The same
+        array is refilled for every chunk, so copy anything you want to
+        keep before advancing.  The first fuse iterations are discarded
+        and later chunks continue the orbit where the previous one ended.
+        """
+        cdef GenomeHandle genome = self.clone()
+        cdef randctx rc
+        cdef unsigned short *xform_distrib = NULL
+        cdef np.ndarray samples
+        cdef double *data
+        cdef double last[4]
+        cdef long remaining = nsamples
+        cdef int n
+
+        if chunk <= 0:
+            raise ValueError('chunk must be positive')
+
+        _seed_randctx(&rc, seed)
+        prepare_xform_fn_ptrs(genome._genome, &rc)
+
+        xform_distrib = <unsigned short*>stdlib.malloc(
+                CHOOSE_XFORM_GRAIN * (genome._genome.num_xforms + 1) * sizeof(unsigned short))
+        if xform_distrib == NULL:
+            raise MemoryError('Unable to allocate xform distribution')
+
+        try:
+            flam3_create_xform_distrib(genome._genome, xform_distrib)
+
+            samples = numpy.empty((min(chunk, max(nsamples, 1)), 4), numpy.float64)
+            data = <double*>np.PyArray_DATA(samples)
+
+            last[0] = flam3_random_isaac_11(&rc)
+            last[1] = flam3_random_isaac_11(&rc)
+            last[2] = flam3_random_isaac_01(&rc)
+            last[3] = flam3_random_isaac_01(&rc)
+
+            while remaining > 0:
+                n = <int>min(chunk, remaining)
+                memmove(data, last, sizeof(last))
+
+                with nogil:
+                    flam3_iterate(genome._genome, n, fuse, data, xform_distrib, &rc)
+
+                memmove(last, data + 4 * (n - 1), sizeof(last))
+                remaining -= n
+                fuse = 0
+
+                if n == samples.shape[0]:
+                    yield samples
+                else:
+                    yield samples[:n]
+        finally:
+            stdlib.free(xform_distrib)
+
+    def memory_required(GenomeHandle self, unsigned int width, unsigned int height, int bits=33):
+        """Estimate the bytes flam3_render needs for a width x height frame"""
+        cdef flam3_frame frame
+        cdef int old_width = self._genome.width
+        cdef int old_height = self._genome.height
+        cdef double required
+
+        flam3_init_frame(&frame)
+        frame.genomes = self._genome
+        frame.ngenomes = 1
+        frame.bits = bits
+
+        self._genome.width = width
+        self._genome.height = height
+        required = flam3_render_memory_required(&frame)
+        self._genome.width = old_width
+        self._genome.height = old_height
+
+        return required
+
+    def render_tiled(GenomeHandle self, RenderBuffer out_buffer, double max_bytes, bint parallel=False, **kwargs):
+        """Render in tiles so no single flam3_render needs more than max_bytes
+
+        Each tile is rendered by shifting the camera center and copied
+        into out_buffer.  flam3 already iterates into a gutter as wide as
+        its spatial and density estimation filters around every frame, so
+        tiles need no overlap.  Each tile iterates as many samples per
+        pixel as the whole frame would, so it matches the full render.
+        With parallel set, as many tiles as fit in max_bytes render at
+        once and split the nthreads budget between them.
+        """
+        cdef unsigned int width = out_buffer._width
+        cdef unsigned int height = out_buffer._height
+        cdef int channels = out_buffer._bytes_per_pixel
+        cdef int bits = <int>kwargs.get('bits', 33)
+        cdef int cols = 1
+        cdef int rows = 1
+        cdef unsigned int core_w, core_h
+        cdef double required
+
+        if out_buffer._buffer == NULL:
+            raise RuntimeError('Buffer is empty')
+
+        while 1:
+            core_w = (width + cols - 1) / cols
+            core_h = (height + rows - 1) / rows
+            required = self.memory_required(core_w, core_h, bits)
+
+            if required <= max_bytes:
+                break
+
+            if core_w <= 1 and core_h <= 1:
+                raise MemoryError('a single pixel tile needs %d bytes' % required)
+
+            if core_w >= core_h:
+                cols += 1
+            else:
+                rows += 1
+
+        tiles = [(c * core_w, r * core_h) for r in range(rows) for c in range(cols)
+                 if c * core_w < width and r * core_h < height]
+
+        concurrency = 1
+        if parallel:
+            concurrency = max(1, min(len(tiles), int(max_bytes / required)))
+
+        progress = kwargs.pop('progress', None)
+        nthreads = <int>kwargs.pop('nthreads', 0)
+        if nthreads == 0:
+            nthreads = flam3_count_nthreads()
+        kwargs['nthreads'] = max(1, nthreads / concurrency)
+
+        totals = {'badvals': 0.0, 'num_iters': 0, 'render_seconds': 0, 'tiles': len(tiles)}
+        state = {'done': 0, 'cancel': False, 'error': None}
+        lock = threading.Lock()
+        pending = list(tiles)
+
+        def tile_progress(p, stage, eta):
+            if state['cancel']:
+                return 1
+
+            if progress is not None:
+                with lock:
+                    overall = (state['done'] + p / 100.0) * 100.0 / len(tiles)
+
+                if progress(overall, stage, eta):
+                    state['cancel'] = True
+                    return 1
+
+            return 0
+
+        def worker():
+            while 1:
+                with lock:
+                    if not pending or state['cancel'] or state['error'] is not None:
+                        return
+                    x0, y0 = pending.pop(0)
+
+                try:
+                    stats = self._render_tile(out_buffer, x0, y0, core_w, core_h,
+                            tile_progress, kwargs)
+                except Exception, e:
+                    with lock:
+                        state['error'] = e
+                    return
+
+                with lock:
+                    state['done'] += 1
+                    totals['badvals'] += stats['badvals']
+                    totals['num_iters'] += stats['num_iters']
+                    totals['render_seconds'] += stats['render_seconds']
+
+        if concurrency == 1:
+            worker()
+        else:
+            threads = [threading.Thread(target=worker) for i in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if state['error'] is not None:
+            raise state['error']
+
+        return totals
+
+    cdef dict _render_tile(GenomeHandle self, RenderBuffer out_buffer, unsigned int x0, unsigned int y0,
+            unsigned int core_w, unsigned int core_h, object progress, dict kwargs):
+        cdef GenomeHandle tile = self.clone()
+        cdef RenderBuffer tile_buffer
+        cdef unsigned int w = min(core_w, out_buffer._width - x0)
+        cdef unsigned int h = min(core_h, out_buffer._height - y0)
+        cdef int channels = out_buffer._bytes_per_pixel
+        cdef double pixel_aspect_ratio = <double>kwargs.get('pixel_aspect_ratio', 1.0)
+        cdef double ppuy = self._genome.pixels_per_unit * 2.0 ** self._genome.zoom
+        cdef double ppux = ppuy / pixel_aspect_ratio
+        cdef unsigned int y
+        cdef Py_ssize_t src_stride, dest_stride
+
+        tile_buffer = RenderBuffer(w, h, channels)
+
+        # Rotation stays anchored on the full frame's center
+        tile._genome.rot_center[0] = self._genome.center[0]
+        tile._genome.rot_center[1] = self._genome.center[1]
+        # flam3 scales the samples and the tone curve by the frame's
+        # area; keep the full frame's samples per pixel
+        tile._genome.sample_density *= (<double>out_buffer._width * out_buffer._height) / (w * h)
+        tile._genome.center[0] += (x0 + w / 2.0 - out_buffer._width / 2.0) / ppux
+        tile._genome.center[1] += (y0 + h / 2.0 - out_buffer._height / 2.0) / ppuy
+
+        stats = tile.render(tile_buffer, progress=progress, **kwargs)
+
+        src_stride = tile_buffer._width * channels
+        dest_stride = out_buffer._width * channels
+
+        for 0 <= y < h:
+            memmove(out_buffer._buffer + (y0 + y) * dest_stride + x0 * channels,
+                    tile_buffer._buffer + y * src_stride, w * channels)
+
+        return stats
+
+    def estimate_bounds(GenomeHandle self, double eps=0.01, int nsamples=10000, object seed=None):
+        """Estimate the attractor's extent with flam3_estimate_bounding_box
+
+        Iterates nsamples points and returns ((xmin, ymin), (xmax, ymax))
+        in world units, trimming a fraction eps of outlying points from
+        each side.  Runs on a clone, so the genome is left untouched.
+        """
+        cdef GenomeHandle genome = self.clone()
+        cdef randctx rc
+        cdef double bmin[2]
+        cdef double bmax[2]
+
+        if nsamples <= 0:
+            raise ValueError('nsamples must be positive')
+
+        _seed_randctx(&rc, seed)
+        prepare_xform_fn_ptrs(genome._genome, &rc)
+
+        with nogil:
+            flam3_estimate_bounding_box(genome._genome, eps, nsamples, bmin, bmax, &rc)
+
+        return (bmin[0], bmin[1]), (bmax[0], bmax[1])
+
+    def autoframe(GenomeHandle self, unsigned int width, unsigned int height, double margin=0.05,
+            double eps=0.01, int nsamples=10000, object seed=None):
+        """Set the size, center and scale so the attractor fills the frame
+
+        Leaves margin of the frame empty on each side and resets zoom to
+        0.  Returns (center x, center y, pixels_per_unit); raises
+        ValueError for attractors that collapse to a line or escape.
+        """
+        bmin, bmax = self.estimate_bounds(eps, nsamples, seed)
+        cx, cy, ppu = frame_bounds(bmin, bmax, width, height, margin, self._genome.rotate)
+
+        self._genome.width = width
+        self._genome.height = height
+        self._genome.center[0] = self._genome.rot_center[0] = cx
+        self._genome.center[1] = self._genome.rot_center[1] = cy
+        self._genome.pixels_per_unit = ppu
+        self._genome.zoom = 0.0
+
+        return cx, cy, ppu
+
+    def fingerprint(GenomeHandle self, double tolerance=1e-6):
+        """A hex digest of the genome's numeric state
+
+        Covers the same state as Genome.fingerprint, read from the flam3
+        struct: camera, color and filter settings, every xform's weights,
+        coefs, post and variations, the variables of its active
+        variations, and the palette.  Digests of a Genome and of a
+        GenomeHandle are not comparable with each other.
+        """
+        global _variation_index
+        cdef flam3_genome *g = self._genome
+        cdef flam3_xform *xf
+        cdef list names = []
+        cdef list values
+        cdef int i, j
+
+        if _variation_index is None:
+            _variation_index = dict((flam3_variation_names[j], j)
+                                    for j in range(flam3_nvariations))
+
+        values = [g.center[0], g.center[1], g.rotate, g.pixels_per_unit,
+                  g.zoom, g.brightness, g.contrast, g.gamma, g.vibrancy,
+                  g.hue_rotation, g.background[0], g.background[1],
+                  g.background[2], g.spatial_filter_radius, g.estimator,
+                  g.estimator_minimum, g.estimator_curve, g.symmetry,
+                  g.num_xforms, g.final_xform_index, g.final_xform_enable]
+
+        for 0 <= i < g.num_xforms:
+            xf = &g.xform[i]
+            values.extend([xf.density, xf.color[0], xf.symmetry])
+            values.extend([xf.c[j // 2][j % 2] for j in range(6)])
+            values.extend([xf.post[j // 2][j % 2] for j in range(6)])
+            values.extend([xf.var[j] for j in range(flam3_nvariations)])
+
+            for name, params in _xform_variables(xf):
+                j = _variation_index.get(name, -1)
+                if j >= 0 and xf.var[j] != 0.0:
+                    names.append(name)
+                    values.extend(params)
+
+        for 0 <= i < 256:
+            values.extend([g.palette[i].color[0], g.palette[i].color[1],
+                           g.palette[i].color[2]])
+
+        return quantized_digest(values, names, tolerance)
+
+    # Struct backed attributes, named like the Genome attributes they
+    # back.  Integer fields accept floats, as the xml loaders produce.
+
+    property time:
+        def __get__(GenomeHandle self):
+            return self._genome.time
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.time = value
+
+    property rotate:
+        def __get__(GenomeHandle self):
+            return self._genome.rotate
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.rotate = value
+
+    property pixels_per_unit:
+        def __get__(GenomeHandle self):
+            return self._genome.pixels_per_unit
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.pixels_per_unit = value
+
+    property zoom:
+        def __get__(GenomeHandle self):
+            return self._genome.zoom
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.zoom = value
+
+    property brightness:
+        def __get__(GenomeHandle self):
+            return self._genome.brightness
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.brightness = value
+
+    property contrast:
+        def __get__(GenomeHandle self):
+            return self._genome.contrast
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.contrast = value
+
+    property gamma:
+        def __get__(GenomeHandle self):
+            return self._genome.gamma
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.gamma = value
+
+    property vibrancy:
+        def __get__(GenomeHandle self):
+            return self._genome.vibrancy
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.vibrancy = value
+
+    property hue_rotation:
+        def __get__(GenomeHandle self):
+            return self._genome.hue_rotation
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.hue_rotation = value
+
+    property spatial_filter_radius:
+        def __get__(GenomeHandle self):
+            return self._genome.spatial_filter_radius
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.spatial_filter_radius = value
+
+    property sample_density:
+        def __get__(GenomeHandle self):
+            return self._genome.sample_density
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.sample_density = value
+
+    property estimator:
+        def __get__(GenomeHandle self):
+            return self._genome.estimator
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.estimator = value
+
+    property estimator_minimum:
+        def __get__(GenomeHandle self):
+            return self._genome.estimator_minimum
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.estimator_minimum = value
+
+    property estimator_curve:
+        def __get__(GenomeHandle self):
+            return self._genome.estimator_curve
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.estimator_curve = value
+
+    property gam_lin_thresh:
+        def __get__(GenomeHandle self):
+            return self._genome.gam_lin_thresh
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.gam_lin_thresh = value
+
+    property temporal_filter_width:
+        def __get__(GenomeHandle self):
+            return self._genome.temporal_filter_width
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.temporal_filter_width = value
+
+    property temporal_filter_exp:
+        def __get__(GenomeHandle self):
+            return self._genome.temporal_filter_exp
+
+        def __set__(GenomeHandle self, double value):
+            self._genome.temporal_filter_exp = value
+
+    property width:
+        def __get__(GenomeHandle self):
+            return self._genome.width
+
+        def __set__(GenomeHandle self, value):
+            self._genome.width = int(value)
+
+    property height:
+        def __get__(GenomeHandle self):
+            return self._genome.height
+
+        def __set__(GenomeHandle self, value):
+            self._genome.height = int(value)
+
+    property spatial_oversample:
+        def __get__(GenomeHandle self):
+            return self._genome.spatial_oversample
+
+        def __set__(GenomeHandle self, value):
+            self._genome.spatial_oversample = int(value)
+
+    property spatial_filter_select:
+        def __get__(GenomeHandle self):
+            return self._genome.spatial_filter_select
+
+        def __set__(GenomeHandle self, value):
+            self._genome.spatial_filter_select = int(value)
+
+    property nbatches:
+        def __get__(GenomeHandle self):
+            return self._genome.nbatches
+
+        def __set__(GenomeHandle self, value):
+            self._genome.nbatches = int(value)
+
+    property ntemporal_samples:
+        def __get__(GenomeHandle self):
+            return self._genome.ntemporal_samples
+
+        def __set__(GenomeHandle self, value):
+            self._genome.ntemporal_samples = int(value)
+
+    property interpolation:
+        def __get__(GenomeHandle self):
+            return self._genome.interpolation
+
+        def __set__(GenomeHandle self, value):
+            self._genome.interpolation = int(value)
+
+    property interpolation_type:
+        def __get__(GenomeHandle self):
+            return self._genome.interpolation_type
+
+        def __set__(GenomeHandle self, value):
+            self._genome.interpolation_type = int(value)
+
+    property palette_interpolation:
+        def __get__(GenomeHandle self):
+            return self._genome.palette_interpolation
+
+        def __set__(GenomeHandle self, value):
+            self._genome.palette_interpolation = int(value)
+
+    property temporal_filter_type:
+        def __get__(GenomeHandle self):
+            return self._genome.temporal_filter_type
+
+        def __set__(GenomeHandle self, value):
+            self._genome.temporal_filter_type = int(value)
+
+    property symmetry:
+        def __get__(GenomeHandle self):
+            return self._genome.symmetry
+
+        def __set__(GenomeHandle self, value):
+            self._genome.symmetry = int(value)
+
+    property name:
+        def __get__(GenomeHandle self):
+            return self._genome.flame_name
+
+        def __set__(GenomeHandle self, bytes value):
+            strncpy(self._genome.flame_name, value, c_flam3_name_len)
+            self._genome.flame_name[c_flam3_name_len] = 0
+
+    property center:
+        def __get__(GenomeHandle self):
+            return (self._genome.center[0], self._genome.center[1])
+
+        def __set__(GenomeHandle self, value):
+            self._genome.center[0], self._genome.center[1] = value
+
+    property background:
+        def __get__(GenomeHandle self):
+            return (self._genome.background[0], self._genome.background[1],
+                    self._genome.background[2])
+
+        def __set__(GenomeHandle self, value):
+            (self._genome.background[0], self._genome.background[1],
+             self._genome.background[2]) = value
+
+    property palette:
+        """A (256, 4) float64 rgba view of the palette, 0 to 1"""
+        def __get__(GenomeHandle self):
+            return _double_array(self, &self._genome.palette[0].color[0],
+                                 2, 256, 4, sizeof(flam3_palette_entry))
+
+    property num_xforms:
+        """The number of xforms, including the final xform if any"""
+        def __get__(GenomeHandle self):
+            return self._genome.num_xforms
+
+    property xforms:
+        """XformHandles of the xforms, not counting the final xform"""
+        def __get__(GenomeHandle self):
+            return [self.xform(i) for i in range(self._genome.num_xforms)
+                    if i != self._genome.final_xform_index]
+
+    property final_xform:
+        """The XformHandle of the enabled final xform, or None"""
+        def __get__(GenomeHandle self):
+            if self._genome.final_xform_index < 0 or not self._genome.final_xform_enable:
+                return None
+            return self.xform(self._genome.final_xform_index)
+
+    def xform(GenomeHandle self, int index):
+        cdef XformHandle handle
+
+        if not 0 <= index < self._genome.num_xforms:
+            raise IndexError('xform index out of range')
+
+        handle = XformHandle()
+        handle._owner = self
+        handle._index = index
+        return handle
+
+
+cdef class XformHandle:
+    """One xform of a GenomeHandle, read and written in place
+
+    The coefs, post and var arrays share memory with the genome and are
+    only valid until xforms are added to or removed from it.
+    """
+    cdef GenomeHandle _owner
+    cdef int _index
+
+    cdef flam3_xform *_xform(XformHandle self) except NULL:
+        if self._owner is None:
+            raise ValueError('get XformHandles from GenomeHandle.xform')
+        if self._index >= self._owner._genome.num_xforms:
+            raise IndexError('the xform no longer exists')
+        return &self._owner._genome.xform[self._index]
+
+    property index:
+        def __get__(XformHandle self):
+            return self._index
+
+    property weight:
+        def __get__(XformHandle self):
+            return self._xform().density
+
+        def __set__(XformHandle self, double value):
+            self._xform().density = value
+
+    property color:
+        def __get__(XformHandle self):
+            return self._xform().color[0]
+
+        def __set__(XformHandle self, double value):
+            self._xform().color[0] = value
+
+    property symmetry:
+        def __get__(XformHandle self):
+            return self._xform().symmetry
+
+        def __set__(XformHandle self, double value):
+            self._xform().symmetry = value
+
+    property coefs:
+        """A (3, 2) view of the affine transform: x, y and offset rows"""
+        def __get__(XformHandle self):
+            return _double_array(self._owner, &self._xform().c[0][0],
+                                 2, 3, 2, 2 * sizeof(double))
+
+    property post:
+        """A (3, 2) view of the post transform"""
+        def __get__(XformHandle self):
+            return _double_array(self._owner, &self._xform().post[0][0],
+                                 2, 3, 2, 2 * sizeof(double))
+
+    property var:
+        """A view of the variation weights, indexed like get_variation_list"""
+        def __get__(XformHandle self):
+            return _double_array(self._owner, &self._xform().var[0],
+                                 1, flam3_nvariations, 0, sizeof(double))
+
+    property variations:
+        """{name: weight} of the variations in use"""
+        def __get__(XformHandle self):
+            cdef flam3_xform *xf = self._xform()
+            cdef int j
+
+            return dict((flam3_variation_names[j], xf.var[j])
+                        for j in range(flam3_nvariations) if xf.var[j] != 0.0)
+
+    property variables:
+        """{variation: {variable: value}} of the parametric variations
+        in use"""
+        def __get__(XformHandle self):
+            cdef flam3_xform *xf = self._xform()
+            cdef dict weights = self.variations
+
+            return dict((name, dict(zip(_xform_variable_names[name], params)))
+                        for name, params in _xform_variables(xf)
+                        if weights.get(name, 0.0) != 0.0)
+
 
 def get_variation_list():
     cdef list var_list = list()
@@ -423,7 +1513,7 @@ def from_xml(str xml_source, str filename='', object defaults=True):
 
     result = flam3_parse_xml2(c_buffer_copy, filename, flam3_defaults_on if defaults else flam3_defaults_off, &ncps)
 
-    for 0 <= idx <= ncps:
+    for 0 <= idx < ncps:
         handle = GenomeHandle()
         handle.copy_genome(&result[idx])
         result_list.append(handle)
@@ -442,3 +1532,60 @@ def to_xml(GenomeHandle genome):
     return py_string
 
 
+def flatten(GenomeHandle genome):
+    """Serialize a genome and its xforms into a flat string"""
+    cdef size_t size = flam3_size_flattened_genome(genome._genome)
+    cdef object blob = PyString_FromStringAndSize(NULL, size)
+
+    flam3_flatten_genome(genome._genome, PyString_AS_STRING(blob))
+
+    return blob
+
+
+def render_digest(GenomeHandle genome):
+    """A sha1 hex digest of the genome state a render reads
+
+    Hashes the genome struct and its xforms as flatten lays them out,
+    with the output size, the batch counts render sets and the pointers
+    cleared.  Much cheaper than hashing to_xml, but only comparable
+    between genomes from the same build of libflam3.
+    """
+    cdef flam3_genome header
+    cdef object digest
+
+    memmove(&header, genome._genome, sizeof(flam3_genome))
+    header.width = header.height = 0
+    header.nbatches = header.ntemporal_samples = 0
+    header.xform = NULL
+    header.input_image = NULL
+    header.edits = NULL
+
+    digest = hashlib.sha1(PyString_FromStringAndSize(<char*>&header, sizeof(flam3_genome)))
+    if genome._genome.num_xforms > 0:
+        digest.update(PyString_FromStringAndSize(<char*>genome._genome.xform,
+                genome._genome.num_xforms * sizeof(flam3_xform)))
+
+    return digest.hexdigest()
+
+
+def unflatten(str blob):
+    """Rebuild a GenomeHandle from the output of flatten"""
+    cdef GenomeHandle handle = GenomeHandle()
+    cdef flam3_genome header
+    cdef Py_ssize_t size = len(blob)
+
+    if size < sizeof(flam3_genome):
+        raise ValueError('flattened genome is truncated')
+
+    # the string data need not be aligned for a direct struct read
+    memmove(&header, PyString_AS_STRING(blob), sizeof(flam3_genome))
+
+    if header.num_xforms < 0 or \
+            (size - sizeof(flam3_genome)) // sizeof(flam3_xform) < header.num_xforms:
+        raise ValueError('flattened genome is truncated')
+
+    # unflattening allocates a new xform array
+    handle._free_xforms()
+    flam3_unflatten_genome(PyString_AS_STRING(blob), handle._genome)
+
+    return handle
@@ -1,5 +1,8 @@
 from math import *
 import colorsys
+import hashlib
+
+import numpy
 
 __all__ = [
     'polar',
@@ -7,6 +10,8 @@ __all__ = [
     'clip',
     'rgb2hls',
     'hls2rgb',
+    'quantized_digest',
+    'frame_bounds',
 ]
 
 
@@ -41,3 +46,30 @@ def hls2rgb(h, l, s):
     s = clip(s, 0, 1)
     return map(lambda x: x*256, colorsys.hls_to_rgb(h, l, s))
 
+def quantized_digest(values, names, tolerance):
+    """sha1 hex digest of values rounded to multiples of tolerance,
+    followed by the strings in names"""
+    quantized = numpy.round(numpy.asarray(values, numpy.float64) / tolerance)
+    digest = hashlib.sha1(quantized.astype(numpy.int64).tostring())
+    digest.update('\0'.join(names))
+    return digest.hexdigest()
+
+def frame_bounds(bmin, bmax, width, height, margin=0.05, rotate=0.0):
+    """The (center x, center y, pixels per unit) that fit the box from
+    bmin to bmax into width x height pixels, leaving margin of each side
+    empty, with the image rotated by rotate degrees"""
+    w = bmax[0] - bmin[0]
+    h = bmax[1] - bmin[1]
+
+    if not (w > 0.0 and h > 0.0) or w == float('inf') or h == float('inf'):
+        raise ValueError('cannot frame bounds %r - %r' % (tuple(bmin), tuple(bmax)))
+
+    if rotate:
+        c = abs(cos(rotate * pi / 180.0))
+        s = abs(sin(rotate * pi / 180.0))
+        w, h = w * c + h * s, w * s + h * c
+
+    usable = 1.0 - 2.0 * margin
+    ppu = min(width * usable / w, height * usable / h)
+
+    return (bmin[0] + bmax[0]) / 2.0, (bmin[1] + bmax[1]) / 2.0, ppu
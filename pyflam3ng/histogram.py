@@ -0,0 +1,422 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Retained render histograms
+
+A Histogram keeps the float (r, g, b, density) buckets the chaos game
+accumulates, so the brightness, gamma, vibrancy, highlight_power,
+background, density estimation and filter settings of a genome can be
+applied again with tonemap() without iterating.  Histograms pickle like
+any other python object.
+"""
+import math
+import time
+
+import numpy
+
+
+__all__ = [ 'Histogram'
+          , 'render_histogram'
+          , 'tonemap'
+          ]
+
+
+EPS = 1e-10
+WHITE_LEVEL = 255.0
+PREFILTER_WHITE = 255.0
+
+# flam3's gaussian spatial filter is exp(-2x^2) cut off at x = 1.5
+FILTER_CUTOFF = 1.5
+
+
+def genome_palette(genome):
+    """The genome palette as a (256, 3) float array in 0..1"""
+    palette = numpy.asarray(genome.palette.array, numpy.float64) / 255.0
+
+    if not palette.any():
+        # Genomes that name a flam3 builtin palette by index carry no
+        # colors without libflam3; fall back to a grey ramp
+        palette = numpy.repeat(numpy.linspace(0.0, 1.0, 256)[:, None], 3, axis=1)
+
+    return palette
+
+
+class Histogram(object):
+    """Accumulated chaos game samples of one genome
+
+    buckets is a (height * oversample, width * oversample, 4) float64
+    array of palette weighted (r, g, b) sums and sample densities.
+    nsamples counts every sample added, including those that fell
+    outside the frame, as the tone curve is normalized by it.
+
+    tonemap caches the density estimated buckets, so change buckets
+    through accumulate, merge and clear only.
+    """
+
+    # bumped whenever the buckets change, invalidating _estimated
+    _generation = 0
+    _estimated = None
+
+    def __init__(self, width, height, oversample=1):
+        self.width = width
+        self.height = height
+        self.oversample = oversample
+        self.buckets = numpy.zeros((height * oversample, width * oversample, 4),
+                                   numpy.float64)
+        self.nsamples = 0
+        self.badvals = 0
+
+    def accumulate(self, samples, genome, palette=None):
+        """Bin (n, 4) rows of (x, y, color, alpha) samples through the
+        genome's camera.  Returns the number of samples that landed."""
+        rows, cols = self.buckets.shape[:2]
+        ppu = genome.pixels_per_unit * 2.0 ** genome.zoom * self.oversample
+        cx, cy = [float(v) for v in genome.center[0]]
+
+        if palette is None:
+            palette = genome_palette(genome)
+
+        x = samples[:, 0]
+        y = samples[:, 1]
+
+        if genome.rotate != 0.0:
+            angle = -genome.rotate * math.pi / 180.0
+            ca, sa = math.cos(angle), math.sin(angle)
+            x, y = (ca * (x - cx) - sa * (y - cy) + cx,
+                    sa * (x - cx) + ca * (y - cy) + cy)
+
+        col = numpy.floor((x - cx) * ppu + cols / 2.0)
+        row = numpy.floor((y - cy) * ppu + rows / 2.0)
+
+        mask = (col >= 0) & (col < cols) & (row >= 0) & (row < rows) & (samples[:, 3] > 0.0)
+        bins = (row[mask] * cols + col[mask]).astype(numpy.intp)
+        alpha = samples[mask, 3]
+        colors = palette[numpy.clip((samples[mask, 2] * 256.0).astype(numpy.intp), 0, 255)]
+
+        flat = self.buckets.reshape(-1, 4)
+        size = rows * cols
+
+        for ch in xrange(3):
+            flat[:, ch] += numpy.bincount(bins, weights=colors[:, ch] * alpha, minlength=size)[:size]
+
+        flat[:, 3] += numpy.bincount(bins, weights=alpha, minlength=size)[:size]
+        self.nsamples += len(samples)
+        self._generation += 1
+
+        return mask.sum()
+
+    def add_samples(self, genome, nsamples, **kwargs):
+        """Iterate genome for nsamples more samples
+
+        Samples come from GenomeHandle.iterate when the genome has a
+        flam3 handle and from pyflam3ng.npengine otherwise; pass
+        engine='flam3' or engine='numpy' to choose.  Also accepts seed,
+        batch and a flam3 style progress(progress, stage, eta) callback
+        that stops early by returning a true value.  Returns the number
+        of samples added.
+        """
+        progress = kwargs.get('progress', None)
+        seed = kwargs.get('seed', None)
+        batch = kwargs.get('batch', 1<<16)
+        engine = kwargs.get('engine', None)
+        stats = {'badvals': 0}
+
+        if engine is None:
+            engine = 'flam3' if getattr(genome, 'genome_handle', None) is not None else 'numpy'
+
+        if engine == 'flam3':
+            source = genome.genome_handle.iterate(nsamples, chunk=batch, seed=seed)
+        elif engine == 'numpy':
+            from . import npengine
+            source = npengine.iterate(genome, nsamples, batch=batch, seed=seed, stats=stats)
+        else:
+            raise ValueError('unknown engine %r' % engine)
+
+        palette = genome_palette(genome)
+        start = time.time()
+        done = 0
+
+        for samples in source:
+            self.accumulate(samples, genome, palette)
+            done += len(samples)
+
+            if progress is not None:
+                eta = (time.time() - start) * (nsamples - done) / done
+                if progress(100.0 * done / nsamples, 0, eta):
+                    break
+
+        self.badvals += stats['badvals']
+
+        return done
+
+    def merge(self, other):
+        """Add the samples of another histogram of the same geometry"""
+        if (other.width, other.height, other.oversample) != \
+                (self.width, self.height, self.oversample):
+            raise ValueError('cannot merge a %dx%d/%d histogram into a %dx%d/%d one' % (
+                    other.width, other.height, other.oversample,
+                    self.width, self.height, self.oversample))
+
+        self.buckets += other.buckets
+        self.nsamples += other.nsamples
+        self.badvals += other.badvals
+        self._generation += 1
+
+        return self
+
+    __iadd__ = merge
+
+    def clear(self):
+        self.buckets[:] = 0.0
+        self.nsamples = 0
+        self.badvals = 0
+        self._generation += 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_estimated', None)
+        return state
+
+
+def render_histogram(genome, width=None, height=None, **kwargs):
+    """Iterate genome into a new Histogram
+
+    Accepts quality (samples per output pixel, defaulting to the genome's
+    sample_density), oversample and the keyword arguments of
+    Histogram.add_samples.
+    """
+    width = width or genome.width
+    height = height or genome.height
+    quality = float(kwargs.pop('quality', genome.sample_density))
+    oversample = int(kwargs.pop('oversample', genome.spatial_oversample))
+
+    histogram = Histogram(width, height, oversample)
+    histogram.add_samples(genome, int(quality * width * height), **kwargs)
+
+    return histogram
+
+
+def _gaussian_kernel(sigma):
+    if sigma <= 0.0:
+        return numpy.ones(1)
+
+    radius = int(math.ceil(3.0 * sigma))
+    x = numpy.arange(-radius, radius + 1, dtype=numpy.float64)
+    kernel = numpy.exp(-0.5 * (x / sigma) ** 2)
+
+    return kernel / kernel.sum()
+
+
+def _convolve(image, kernel):
+    """Separable convolution of the first two axes, zero padded"""
+    radius = len(kernel) // 2
+    if radius == 0:
+        return image * kernel[0]
+
+    rows, cols = image.shape[:2]
+    padded = numpy.zeros((rows + 2 * radius, cols) + image.shape[2:])
+    padded[radius:radius + rows] = image
+    tmp = numpy.zeros_like(image)
+    for i, w in enumerate(kernel):
+        tmp += w * padded[i:i + rows]
+
+    padded = numpy.zeros((rows, cols + 2 * radius) + image.shape[2:])
+    padded[:, radius:radius + cols] = tmp
+    out = numpy.zeros_like(image)
+    for i, w in enumerate(kernel):
+        out += w * padded[:, i:i + cols]
+
+    return out
+
+
+def _log_density(histogram, genome):
+    """flam3's per bucket log scaling of the accumulators
+
+    The scaling is linear in brightness, which is left for the caller
+    to apply.
+    """
+    oversample = histogram.oversample
+    samples_per_pixel = max(float(histogram.nsamples) /
+                            (histogram.width * histogram.height), EPS)
+
+    k1 = genome.contrast * PREFILTER_WHITE * 268.0 / 256.0
+    k2 = oversample * oversample / (genome.contrast * WHITE_LEVEL * samples_per_pixel)
+
+    density = histogram.buckets[:, :, 3]
+    ls = numpy.zeros_like(density)
+    hit = density > 0.0
+    ls[hit] = k1 * numpy.log(1.0 + density[hit] * k2) / density[hit]
+
+    return histogram.buckets * ls[:, :, None]
+
+
+def _estimate_density(accum, density, genome, oversample):
+    """Blur sparse buckets more than dense ones
+
+    Each bucket gets a radius of estimator / (density + 1) ^ curve,
+    clamped to estimator_minimum, and is replaced by a gaussian blur of
+    that width.  flam3 scatters each bucket through its kernel; here the
+    image is blurred once per integral radius and each bucket gathers
+    from the blur of its own radius.  Only the bounding box of the
+    buckets at a radius, plus the kernel's reach, is blurred.
+    """
+    max_rad = genome.estimator * oversample
+    min_rad = genome.estimator_minimum * oversample
+
+    if max_rad <= 0.0:
+        return accum
+
+    radius = numpy.maximum(max_rad / numpy.power(density + 1.0, genome.estimator_curve), min_rad)
+    level = numpy.ceil(radius).astype(numpy.intp)
+    rows, cols = level.shape
+    out = accum.copy()
+
+    for k in numpy.unique(level[density > 0.0]):
+        if k <= 0:
+            continue
+
+        mask = level == k
+        kernel = _gaussian_kernel(k / 2.0)
+        reach = len(kernel) // 2
+
+        hit_rows = numpy.flatnonzero(mask.any(axis=1))
+        hit_cols = numpy.flatnonzero(mask.any(axis=0))
+        r0, r1 = hit_rows[0], hit_rows[-1] + 1
+        c0, c1 = hit_cols[0], hit_cols[-1] + 1
+        pr0, pr1 = max(r0 - reach, 0), min(r1 + reach, rows)
+        pc0, pc1 = max(c0 - reach, 0), min(c1 + reach, cols)
+
+        blurred = _convolve(accum[pr0:pr1, pc0:pc1], kernel)
+        box = mask[r0:r1, c0:c1]
+        out[r0:r1, c0:c1][box] = blurred[r0 - pr0:r1 - pr0, c0 - pc0:c1 - pc0][box]
+
+    return out
+
+
+def _filter(accum, genome, oversample):
+    """Apply the spatial filter and reduce to output resolution"""
+    sigma = 0.5 * genome.spatial_filter_radius * oversample
+    accum = _convolve(accum, _gaussian_kernel(sigma))
+
+    if oversample == 1:
+        return accum
+
+    rows = accum.shape[0] // oversample
+    cols = accum.shape[1] // oversample
+
+    return accum[:rows * oversample, :cols * oversample].reshape(
+            rows, oversample, cols, oversample, 4).mean(axis=3).mean(axis=1)
+
+
+def _estimated_accum(histogram, genome):
+    """The log scaled, density estimated and filtered accumulators at
+    unit brightness
+
+    Cached on the histogram, so changing only brightness, gamma,
+    vibrancy, highlight_power or background skips the blurs.
+    """
+    key = (histogram._generation, histogram.nsamples, genome.contrast,
+           genome.estimator, genome.estimator_minimum, genome.estimator_curve,
+           genome.spatial_filter_radius)
+
+    if histogram._estimated is None or histogram._estimated[0] != key:
+        density = histogram.buckets[:, :, 3]
+        accum = _log_density(histogram, genome)
+        accum = _estimate_density(accum, density, genome, histogram.oversample)
+        accum = _filter(accum, genome, histogram.oversample)
+        histogram._estimated = (key, accum)
+
+    return histogram._estimated[1]
+
+
+def _tonemap_array(histogram, genome, channels=3, transparent=False):
+    """The (height, width, channels) uint8 image for histogram"""
+    accum = _estimated_accum(histogram, genome) * genome.brightness
+
+    gamma = 1.0 / genome.gamma
+    vibrancy = genome.vibrancy
+
+    alpha = accum[:, :, 3] / PREFILTER_WHITE
+    hit = alpha > 0.0
+    tmp = numpy.zeros_like(alpha)
+    tmp[hit] = numpy.power(alpha[hit], gamma)
+    ls = numpy.zeros_like(alpha)
+    ls[hit] = vibrancy * tmp[hit] / alpha[hit]
+
+    rgb = ls[:, :, None] * accum[:, :, :3] + (1.0 - vibrancy) * 255.0 * \
+            numpy.power(numpy.maximum(accum[:, :, :3] / PREFILTER_WHITE, 0.0), gamma)
+
+    if genome.highlight_power >= 0.0:
+        # Scale overexposed pixels back to full brightness and bleach
+        # them towards white instead of clipping each channel
+        maxc = rgb.max(axis=2)
+        over = (maxc > 255.0) & (ls > 0.0)
+        if over.any():
+            newls = 255.0 / maxc[over]
+            ratio = numpy.power(newls, genome.highlight_power)
+            scaled = rgb[over] * newls[:, None]
+            rgb[over] = 255.0 - (255.0 - scaled) * ratio[:, None]
+
+    alpha = numpy.clip(tmp, 0.0, 1.0)
+    out = numpy.empty(rgb.shape[:2] + (channels,), numpy.uint8)
+
+    if transparent and channels == 4:
+        out[:, :, :3] = numpy.clip(rgb, 0.0, 255.0)
+        out[:, :, 3] = numpy.clip(alpha * 255.0, 0.0, 255.0)
+    else:
+        background = numpy.array([float(v) for v in genome.background[0]])
+        out[:, :, :3] = numpy.clip(rgb + (1.0 - alpha[:, :, None]) * background, 0.0, 255.0)
+        if channels == 4:
+            out[:, :, 3] = 255
+
+    return out
+
+
+def tonemap(histogram, genome, buffer=None, **kwargs):
+    """Apply genome's color and filter settings to histogram
+
+    Writes into buffer, a RenderBuffer or a (height, width, channels)
+    uint8 array, allocating a RenderBuffer (or an array without
+    libflam3) when none is given, and returns it.  Accepts channels
+    (when allocating) and transparent.
+    """
+    transparent = kwargs.get('transparent', False)
+
+    if buffer is None:
+        channels = kwargs.get('channels', 3)
+        try:
+            from . import flam3
+        except ImportError:
+            buffer = numpy.zeros((histogram.height, histogram.width, channels),
+                                 numpy.uint8)
+        else:
+            buffer = flam3.RenderBuffer(histogram.width, histogram.height, channels)
+
+    target = buffer.as_array() if hasattr(buffer, 'as_array') else buffer
+
+    if target.shape[:2] != (histogram.height, histogram.width):
+        raise ValueError('buffer is %dx%d, histogram is %dx%d' % (
+                target.shape[1], target.shape[0], histogram.width, histogram.height))
+
+    target[:] = _tonemap_array(histogram, genome, target.shape[2], transparent)
+
+    return buffer
@@ -0,0 +1,465 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Render telemetry
+
+RenderMetrics times the stages of one render: queue wait, genome
+conversion, iteration, filtering and output copy.  A record only holds
+the stages that did work; an in-process render has no conversion, and
+only cache hits and ProcessRenderQueue copy output.  A Registry folds
+finished records into counters and histograms and hands each record to
+its sinks: JsonLinesSink appends them to a file, MemorySink keeps the
+latest in process, and PrometheusServer serves the registry as
+Prometheus text on localhost.
+
+flam3_render iterates and filters in one call; the split between the
+two is taken from the first progress report of the filter stage.
+"""
+from __future__ import with_statement
+
+import BaseHTTPServer
+import SocketServer
+import bisect
+import contextlib
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+try:
+    from . import flam3
+except ImportError:
+    flam3 = None
+
+
+__all__ = [ 'STAGES'
+          , 'RenderMetrics'
+          , 'Counter'
+          , 'Histogram'
+          , 'Registry'
+          , 'MemorySink'
+          , 'JsonLinesSink'
+          , 'PrometheusServer'
+          , 'metered_render'
+          , 'metering'
+          , 'registry'
+          ]
+
+
+STAGES = ('queue', 'convert', 'iterate', 'filter', 'output')
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                   10, 30, 60, 300, 900)
+RATE_BUCKETS = tuple(10 ** n for n in xrange(4, 10))
+BYTES_BUCKETS = tuple(1 << n for n in xrange(20, 36, 2))
+
+
+class RenderMetrics(object):
+    """Timings and counts of one render"""
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.outcome = 'completed'
+        self.stages = {}
+        self.memory_bytes = 0
+        self.num_iters = 0
+        self.badvals = 0
+        self.render_seconds = 0.0
+        self._filter_started = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the body of a with block as stage name"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + max(seconds, 0.0)
+
+    def mark_filter(self, stage):
+        """Note the flam3 progress stage; the first report past the
+        iteration stage starts the filter timing"""
+        if stage > 0 and self._filter_started is None:
+            self._filter_started = time.time()
+
+    def wrap_progress(self, progress):
+        """A progress callback that marks the filter stage before calling
+        progress.  A flam3.RenderProgress is returned as is; whoever polls
+        it should call mark_filter."""
+        if flam3 is not None and isinstance(progress, flam3.RenderProgress):
+            return progress
+
+        def progress_proc(value, stage, eta):
+            self.mark_filter(stage)
+            if progress is not None:
+                return progress(value, stage, eta)
+            return 0
+
+        return progress_proc
+
+    def time_render(self, render, buffer, **kwargs):
+        """Call render(buffer, **kwargs), recording it as a render with
+        the iterate and filter stages split at the filter progress"""
+        kwargs['progress'] = self.wrap_progress(kwargs.get('progress'))
+
+        start = time.time()
+        try:
+            stats = render(buffer, **kwargs)
+        except Exception:
+            self.record_render(start, time.time(), None)
+            raise
+
+        self.record_render(start, time.time(), stats)
+        return stats
+
+    def record_render(self, start, end, stats):
+        """Account for a flam3_render call that ran from start to end"""
+        split = self._filter_started
+        if split is None or not start <= split <= end:
+            split = end
+
+        self.add_time('iterate', split - start)
+        self.add_time('filter', end - split)
+        self._filter_started = None
+
+        self.render_seconds += end - start
+        if stats:
+            self.num_iters += stats.get('num_iters', 0)
+            self.badvals += stats.get('badvals', 0)
+
+    def _get_iters_per_second(self):
+        if not self.stages.get('iterate'):
+            return 0.0
+        return self.num_iters / self.stages['iterate']
+
+    iters_per_second = property(_get_iters_per_second)
+
+    def _get_badval_rate(self):
+        if not self.num_iters:
+            return 0.0
+        return float(self.badvals) / self.num_iters
+
+    badval_rate = property(_get_badval_rate)
+
+    def as_dict(self):
+        return { 'labels': dict(self.labels)
+               , 'outcome': self.outcome
+               , 'stages': dict(self.stages)
+               , 'memory_bytes': self.memory_bytes
+               , 'num_iters': self.num_iters
+               , 'badvals': self.badvals
+               , 'render_seconds': self.render_seconds
+               , 'iters_per_second': self.iters_per_second
+               , 'badval_rate': self.badval_rate
+               }
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.iteritems()))
+
+
+def _format_labels(key):
+    if not key:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                                   .replace('"', '\\"'))
+                             for k, v in key)
+
+
+class Counter(object):
+    """A monotonically increasing value per label set"""
+    kind = 'counter'
+
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        """(name, label key, value) tuples in Prometheus terms"""
+        with self._lock:
+            return [(self.name, key, value)
+                    for key, value in sorted(self._values.iteritems())]
+
+
+class Histogram(object):
+    """Observations counted into cumulative buckets per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name, help='', buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            entry = self._values.get(_label_key(labels))
+            return entry[2] if entry else 0
+
+    def sum(self, **labels):
+        with self._lock:
+            entry = self._values.get(_label_key(labels))
+            return entry[1] if entry else 0.0
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.iteritems()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    result.append((self.name + '_bucket',
+                                   key + (('le', repr(float(bound))),), cumulative))
+                result.append((self.name + '_bucket', key + (('le', '+Inf'),), count))
+                result.append((self.name + '_sum', key, total))
+                result.append((self.name + '_count', key, count))
+        return result
+
+
+class Registry(object):
+    """Named counters and histograms, plus the sinks that receive each
+    recorded RenderMetrics"""
+
+    def __init__(self, prefix='pyflam3ng_'):
+        self.prefix = prefix
+        self._metrics = OrderedDict()
+        self._sinks = []
+        self._lock = threading.Lock()
+
+        self.renders = self.counter('renders_total', 'Renders by outcome')
+        self.iterations = self.counter('iterations_total', 'Points iterated')
+        self.badvals = self.counter('badvals_total', 'Points that escaped while iterating')
+        self.stage_seconds = self.histogram('stage_seconds',
+                'Seconds spent per render stage')
+        self.render_seconds = self.histogram('render_seconds',
+                'Seconds spent in flam3_render')
+        self.iters_per_second = self.histogram('iterations_per_second',
+                'Iteration throughput per render', RATE_BUCKETS)
+        self.memory_bytes = self.histogram('memory_bytes',
+                'Estimated peak flam3 memory per render', BYTES_BUCKETS)
+
+    def _get(self, cls, name, *args):
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            elif not isinstance(metric, cls):
+                raise TypeError('%s is a %s' % (name, metric.kind))
+            return metric
+
+    def counter(self, name, help=''):
+        """The counter called name, created on first use"""
+        return self._get(Counter, name, help)
+
+    def histogram(self, name, help='', buckets=SECONDS_BUCKETS):
+        """The histogram called name, created on first use"""
+        return self._get(Histogram, name, help, buckets)
+
+    def add_sink(self, sink):
+        with self._lock:
+            self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        with self._lock:
+            self._sinks.remove(sink)
+
+    def record(self, metrics):
+        """Fold a finished RenderMetrics into the registry and pass it
+        to every sink"""
+        labels = metrics.labels
+
+        self.renders.inc(outcome=metrics.outcome, **labels)
+        self.iterations.inc(metrics.num_iters, **labels)
+        self.badvals.inc(metrics.badvals, **labels)
+
+        for name, seconds in metrics.stages.iteritems():
+            self.stage_seconds.observe(seconds, stage=name, **labels)
+
+        if metrics.render_seconds:
+            self.render_seconds.observe(metrics.render_seconds, **labels)
+            self.iters_per_second.observe(metrics.iters_per_second, **labels)
+
+        if metrics.memory_bytes:
+            self.memory_bytes.observe(metrics.memory_bytes, **labels)
+
+        with self._lock:
+            sinks = list(self._sinks)
+
+        record = metrics.as_dict()
+        record['time'] = time.time()
+        for sink in sinks:
+            sink.write(record)
+
+    def snapshot(self):
+        """{sample name: {label key: value}} of every metric"""
+        result = {}
+        with self._lock:
+            metrics = self._metrics.values()
+
+        for metric in metrics:
+            for name, key, value in metric.samples():
+                result.setdefault(name, {})[key] = value
+        return result
+
+    def to_prometheus(self):
+        """The registry in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            metrics = self._metrics.values()
+
+        for metric in metrics:
+            if metric.help:
+                lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, key, value in metric.samples():
+                lines.append('%s%s %r' % (name, _format_labels(key), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+class MemorySink(object):
+    """Keeps the latest maxlen records in records"""
+
+    def __init__(self, maxlen=1000):
+        self.records = deque(maxlen=maxlen)
+
+    def write(self, record):
+        self.records.append(record)
+
+
+class JsonLinesSink(object):
+    """Appends each record to path as one line of json"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+class _PrometheusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.to_prometheus()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PrometheusServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves registry as Prometheus text at /metrics.  Binds to
+    localhost unless told otherwise; port 0 picks a free port."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, registry, host='127.0.0.1', port=9464):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _PrometheusHandler)
+        self.registry = registry
+
+    def start(self):
+        """Serve from a daemon thread and return it"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+
+
+@contextlib.contextmanager
+def metering(metrics):
+    """Yield the RenderMetrics to fill in for metrics: a RenderMetrics,
+    a Registry, or True for the module registry.  A fresh record made
+    for a registry is recorded into it when the block ends; an exception
+    sets the outcome to 'error'."""
+    sink = None
+    if metrics is True:
+        metrics = registry
+    if isinstance(metrics, Registry):
+        sink, metrics = metrics, RenderMetrics()
+
+    try:
+        yield metrics
+    except Exception:
+        metrics.outcome = 'error'
+        if sink is not None:
+            sink.record(metrics)
+        raise
+
+    if sink is not None:
+        sink.record(metrics)
+
+
+def metered_render(genome, buffer, metrics, **kwargs):
+    """Render genome, a Genome or GenomeHandle, into buffer and record
+    the render into metrics, see metering.  Returns the render stats."""
+    handle = getattr(genome, 'genome_handle', genome)
+
+    with metering(metrics) as record:
+        record.memory_bytes = max(record.memory_bytes, int(handle.memory_required(
+                buffer.width, buffer.height, kwargs.get('bits', 33))))
+
+        return record.time_render(handle.render, buffer, **kwargs)
+
+
+# The registry renders record into when given metrics=True
+registry = Registry()
@@ -0,0 +1,611 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Pure NumPy chaos game renderer
+
+A fallback for hosts where libflam3 cannot be loaded.  Instead of one
+orbit iterated point by point, a batch of independent orbits is advanced
+together: every step picks an xform per orbit and applies each xform's
+affine transform and variations to its whole subset at once.  The
+samples are binned into a pyflam3ng.histogram.Histogram and tone mapped from
+there.
+
+Only the variations in supported_variations() are implemented; rendering
+a genome that uses any other variation raises ValueError.
+"""
+import math
+import time
+
+import numpy
+
+from .histogram import render_histogram, tonemap
+
+
+__all__ = [ 'render'
+          , 'iterate'
+          , 'supported_variations'
+          ]
+
+
+EPS = 1e-10
+
+_kernels = {}
+
+
+def supported_variations():
+    return sorted(_kernels.keys())
+
+
+def _kernel(name):
+    def register(func):
+        _kernels[name] = func
+        return func
+    return register
+
+
+class _Precalc(object):
+    """The transformed point plus the polar terms variations share,
+    computed on first use like flam3's precalc flags"""
+
+    def __init__(self, tx, ty, coefs, rng):
+        self.tx = tx
+        self.ty = ty
+        self.coefs = coefs
+        self.rng = rng
+        self.n = len(tx)
+        self._cache = {}
+
+    def _cached(self, name, func):
+        if name not in self._cache:
+            self._cache[name] = func()
+        return self._cache[name]
+
+    r2 = property(lambda self: self._cached('r2', lambda: self.tx * self.tx + self.ty * self.ty))
+    r = property(lambda self: self._cached('r', lambda: numpy.sqrt(self.r2)))
+    sina = property(lambda self: self._cached('sina', lambda: self.tx / (self.r + EPS)))
+    cosa = property(lambda self: self._cached('cosa', lambda: self.ty / (self.r + EPS)))
+    atan = property(lambda self: self._cached('atan', lambda: numpy.arctan2(self.tx, self.ty)))
+    atanyx = property(lambda self: self._cached('atanyx', lambda: numpy.arctan2(self.ty, self.tx)))
+
+    def random01(self):
+        return self.rng.random_sample(self.n)
+
+
+@_kernel('linear')
+def _linear(p, w, v):
+    return w * p.tx, w * p.ty
+
+
+@_kernel('sinusoidal')
+def _sinusoidal(p, w, v):
+    return w * numpy.sin(p.tx), w * numpy.sin(p.ty)
+
+
+@_kernel('spherical')
+def _spherical(p, w, v):
+    r = w / (p.r2 + EPS)
+    return r * p.tx, r * p.ty
+
+
+@_kernel('swirl')
+def _swirl(p, w, v):
+    s = numpy.sin(p.r2)
+    c = numpy.cos(p.r2)
+    return w * (s * p.tx - c * p.ty), w * (c * p.tx + s * p.ty)
+
+
+@_kernel('horseshoe')
+def _horseshoe(p, w, v):
+    r = w / (p.r + EPS)
+    return r * (p.tx - p.ty) * (p.tx + p.ty), r * 2.0 * p.tx * p.ty
+
+
+@_kernel('polar')
+def _polar(p, w, v):
+    return w * p.atan / math.pi, w * (p.r - 1.0)
+
+
+@_kernel('handkerchief')
+def _handkerchief(p, w, v):
+    return (w * p.r * numpy.sin(p.atan + p.r),
+            w * p.r * numpy.cos(p.atan - p.r))
+
+
+@_kernel('heart')
+def _heart(p, w, v):
+    a = p.r * p.atan
+    return w * p.r * numpy.sin(a), -w * p.r * numpy.cos(a)
+
+
+@_kernel('disc')
+def _disc(p, w, v):
+    a = p.atan / math.pi
+    r = math.pi * p.r
+    return w * numpy.sin(r) * a, w * numpy.cos(r) * a
+
+
+@_kernel('spiral')
+def _spiral(p, w, v):
+    r = p.r + EPS
+    r1 = w / r
+    return r1 * (p.cosa + numpy.sin(r)), r1 * (p.sina - numpy.cos(r))
+
+
+@_kernel('hyperbolic')
+def _hyperbolic(p, w, v):
+    r = p.r + EPS
+    return w * p.sina / r, w * p.cosa * r
+
+
+@_kernel('diamond')
+def _diamond(p, w, v):
+    return w * p.sina * numpy.cos(p.r), w * p.cosa * numpy.sin(p.r)
+
+
+@_kernel('ex')
+def _ex(p, w, v):
+    n0 = numpy.sin(p.atan + p.r)
+    n1 = numpy.cos(p.atan - p.r)
+    m0 = n0 * n0 * n0 * p.r
+    m1 = n1 * n1 * n1 * p.r
+    return w * (m0 + m1), w * (m0 - m1)
+
+
+@_kernel('julia')
+def _julia(p, w, v):
+    a = 0.5 * p.atanyx + math.pi * (p.random01() < 0.5)
+    r = w * numpy.sqrt(p.r)
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+
+@_kernel('bent')
+def _bent(p, w, v):
+    nx = numpy.where(p.tx < 0.0, p.tx * 2.0, p.tx)
+    ny = numpy.where(p.ty < 0.0, p.ty / 2.0, p.ty)
+    return w * nx, w * ny
+
+
+@_kernel('waves')
+def _waves(p, w, v):
+    c = p.coefs
+    return (w * (p.tx + c[2] * numpy.sin(p.ty / (c[4] * c[4] + EPS))),
+            w * (p.ty + c[3] * numpy.sin(p.tx / (c[5] * c[5] + EPS))))
+
+
+@_kernel('fisheye')
+def _fisheye(p, w, v):
+    r = 2.0 * w / (p.r + 1.0)
+    return r * p.ty, r * p.tx
+
+
+@_kernel('popcorn')
+def _popcorn(p, w, v):
+    c = p.coefs
+    return (w * (p.tx + c[4] * numpy.sin(numpy.tan(3.0 * p.ty))),
+            w * (p.ty + c[5] * numpy.sin(numpy.tan(3.0 * p.tx))))
+
+
+@_kernel('exponential')
+def _exponential(p, w, v):
+    dx = w * numpy.exp(p.tx - 1.0)
+    dy = math.pi * p.ty
+    return dx * numpy.cos(dy), dx * numpy.sin(dy)
+
+
+@_kernel('power')
+def _power(p, w, v):
+    r = w * p.r ** p.sina
+    return r * p.cosa, r * p.sina
+
+
+@_kernel('cosine')
+def _cosine(p, w, v):
+    a = p.tx * math.pi
+    return (w * numpy.cos(a) * numpy.cosh(p.ty),
+            -w * numpy.sin(a) * numpy.sinh(p.ty))
+
+
+@_kernel('rings')
+def _rings(p, w, v):
+    dx = p.coefs[4] ** 2 + EPS
+    r = w * (numpy.fmod(p.r + dx, 2.0 * dx) - dx + p.r * (1.0 - dx))
+    return r * p.cosa, r * p.sina
+
+
+@_kernel('fan')
+def _fan(p, w, v):
+    dx = math.pi * (p.coefs[4] ** 2 + EPS)
+    dx2 = 0.5 * dx
+    a = p.atan
+    a = a + numpy.where(numpy.fmod(a + p.coefs[5], dx) > dx2, -dx2, dx2)
+    r = w * p.r
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+
+@_kernel('blob')
+def _blob(p, w, v):
+    low, high, waves = v['low'], v['high'], v['waves']
+    r = p.r * (low + (high - low) * (0.5 + 0.5 * numpy.sin(waves * p.atan)))
+    return w * p.sina * r, w * p.cosa * r
+
+
+@_kernel('pdj')
+def _pdj(p, w, v):
+    return (w * (numpy.sin(v['a'] * p.ty) - numpy.cos(v['b'] * p.tx)),
+            w * (numpy.sin(v['c'] * p.tx) - numpy.cos(v['d'] * p.ty)))
+
+
+@_kernel('fan2')
+def _fan2(p, w, v):
+    dy = v['y']
+    dx = math.pi * (v['x'] ** 2 + EPS)
+    dx2 = 0.5 * dx
+    a = p.atan
+    t = a + dy - dx * numpy.trunc((a + dy) / dx)
+    a = numpy.where(t > dx2, a - dx2, a + dx2)
+    r = w * p.r
+    return r * numpy.sin(a), r * numpy.cos(a)
+
+
+@_kernel('rings2')
+def _rings2(p, w, v):
+    dx = v['val'] ** 2 + EPS
+    r = p.r
+    r = w * (r - 2.0 * dx * numpy.floor((r + dx) / (2.0 * dx)) + r * (1.0 - dx))
+    return r * p.sina, r * p.cosa
+
+
+@_kernel('eyefish')
+def _eyefish(p, w, v):
+    r = 2.0 * w / (p.r + 1.0)
+    return r * p.tx, r * p.ty
+
+
+@_kernel('bubble')
+def _bubble(p, w, v):
+    r = w / (0.25 * p.r2 + 1.0)
+    return r * p.tx, r * p.ty
+
+
+@_kernel('cylinder')
+def _cylinder(p, w, v):
+    return w * numpy.sin(p.tx), w * p.ty
+
+
+@_kernel('perspective')
+def _perspective(p, w, v):
+    angle = v['angle'] * math.pi / 2.0
+    dist = v['dist']
+    t = 1.0 / (dist - p.ty * math.sin(angle) + EPS)
+    return w * dist * p.tx * t, w * dist * math.cos(angle) * p.ty * t
+
+
+@_kernel('noise')
+def _noise(p, w, v):
+    a = p.random01() * 2.0 * math.pi
+    r = w * p.random01()
+    return p.tx * r * numpy.cos(a), p.ty * r * numpy.sin(a)
+
+
+@_kernel('julian')
+def _julian(p, w, v):
+    power, dist = v['power'], v['dist']
+    t_rnd = numpy.floor(abs(power) * p.random01())
+    a = (p.atanyx + 2.0 * math.pi * t_rnd) / power
+    r = w * p.r2 ** (dist / power / 2.0)
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+
+@_kernel('juliascope')
+def _juliascope(p, w, v):
+    power, dist = v['power'], v['dist']
+    t_rnd = numpy.floor(abs(power) * p.random01())
+    sign = numpy.where(numpy.fmod(t_rnd, 2.0) == 0.0, 1.0, -1.0)
+    a = (2.0 * math.pi * t_rnd + sign * p.atanyx) / power
+    r = w * p.r2 ** (dist / power / 2.0)
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+
+@_kernel('blur')
+def _blur(p, w, v):
+    a = p.random01() * 2.0 * math.pi
+    r = w * p.random01()
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+
+@_kernel('gaussian_blur')
+def _gaussian_blur(p, w, v):
+    a = p.random01() * 2.0 * math.pi
+    r = w * (p.random01() + p.random01() + p.random01() + p.random01() - 2.0)
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+
+@_kernel('curl')
+def _curl(p, w, v):
+    c1, c2 = v['c1'], v['c2']
+    re = 1.0 + c1 * p.tx + c2 * (p.tx * p.tx - p.ty * p.ty)
+    im = c1 * p.ty + 2.0 * c2 * p.tx * p.ty
+    r = w / (re * re + im * im + EPS)
+    return (p.tx * re + p.ty * im) * r, (p.ty * re - p.tx * im) * r
+
+
+@_kernel('rectangles')
+def _rectangles(p, w, v):
+    def fold(t, size):
+        if size == 0.0:
+            return t
+        return (2.0 * numpy.floor(t / size) + 1.0) * size - t
+
+    return w * fold(p.tx, v['x']), w * fold(p.ty, v['y'])
+
+
+@_kernel('arch')
+def _arch(p, w, v):
+    a = p.random01() * w * math.pi
+    s = numpy.sin(a)
+    return w * s, w * s * s / numpy.cos(a)
+
+
+@_kernel('tangent')
+def _tangent(p, w, v):
+    return w * numpy.sin(p.tx) / numpy.cos(p.ty), w * numpy.tan(p.ty)
+
+
+@_kernel('square')
+def _square(p, w, v):
+    return w * (p.random01() - 0.5), w * (p.random01() - 0.5)
+
+
+@_kernel('rays')
+def _rays(p, w, v):
+    a = w * p.random01() * math.pi
+    r = w / (p.r2 + EPS)
+    t = w * numpy.tan(a) * r
+    return t * numpy.cos(p.tx), t * numpy.sin(p.ty)
+
+
+@_kernel('blade')
+def _blade(p, w, v):
+    r = p.random01() * w * p.r
+    s = numpy.sin(r)
+    c = numpy.cos(r)
+    return w * p.tx * (c + s), w * p.tx * (c - s)
+
+
+@_kernel('secant2')
+def _secant2(p, w, v):
+    c = numpy.cos(w * p.r)
+    ic = 1.0 / c
+    return w * p.tx, w * numpy.where(c < 0.0, ic + 1.0, ic - 1.0)
+
+
+@_kernel('twintrian')
+def _twintrian(p, w, v):
+    r = p.random01() * w * p.r
+    s = numpy.sin(r)
+    diff = numpy.log10(s * s + EPS) + numpy.cos(r)
+    diff = numpy.where(numpy.isfinite(diff), diff, -30.0)
+    return w * p.tx * diff, w * p.tx * (diff - s * math.pi)
+
+
+@_kernel('cross')
+def _cross(p, w, v):
+    s = p.tx * p.tx - p.ty * p.ty
+    r = w * numpy.sqrt(1.0 / (s * s + EPS))
+    return p.tx * r, p.ty * r
+
+
+@_kernel('pie')
+def _pie(p, w, v):
+    slices, rotation, thickness = v['slices'], v['rotation'], v['thickness']
+    sl = numpy.floor(slices * p.random01() + 0.5)
+    a = rotation + 2.0 * math.pi * (sl + p.random01() * thickness) / slices
+    r = w * p.random01()
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+
+@_kernel('ngon')
+def _ngon(p, w, v):
+    sides, power, circle, corners = v['sides'], v['power'], v['circle'], v['corners']
+    b = 2.0 * math.pi / sides
+    r_factor = numpy.where(p.r2 == 0.0, 0.0, (p.r2 + EPS) ** (power / 2.0))
+    phi = p.atanyx - b * numpy.floor(p.atanyx / b)
+    phi = numpy.where(phi > b / 2.0, phi - b, phi)
+    amp = (corners * (1.0 / (numpy.cos(phi) + EPS) - 1.0) + circle) / (r_factor + EPS)
+    return w * p.tx * amp, w * p.ty * amp
+
+
+@_kernel('flower')
+def _flower(p, w, v):
+    theta = p.atanyx
+    r = w * (p.random01() - v['holes']) * numpy.cos(v['petals'] * theta) / (p.r + EPS)
+    return r * p.tx, r * p.ty
+
+
+@_kernel('conic')
+def _conic(p, w, v):
+    ct = p.tx / (p.r + EPS)
+    r = w * (p.random01() - v['holes']) * v['eccentricity'] / \
+            (1.0 + v['eccentricity'] * ct) / (p.r + EPS)
+    return r * p.tx, r * p.ty
+
+
+@_kernel('parabola')
+def _parabola(p, w, v):
+    s = numpy.sin(p.r)
+    c = numpy.cos(p.r)
+    return (v['height'] * w * s * s * p.random01(),
+            v['width'] * w * c * p.random01())
+
+
+class _CompiledXform(object):
+    """An Xform flattened into the arrays and kernels the engine needs"""
+
+    def __init__(self, xform):
+        self.coefs = [float(c) for c in xform.coefs]
+        self.post = [float(c) for c in xform.post]
+        # Xforms loaded without a post attribute carry all zeros, and the
+        # Xform default is the [0, 1, 1, 0, 0, 0] to_xml treats as unset
+        self.has_post = self.post not in ([0.0] * 6,
+                                          [1.0, 0.0, 0.0, 1.0, 0.0, 0.0],
+                                          [0.0, 1.0, 1.0, 0.0, 0.0, 0.0])
+        self.color = float(xform.color)
+        self.color_speed = 0.5 - 0.5 * float(xform.symmetry)
+        self.opacity = float(xform.opacity)
+        self.variations = []
+
+        for name, weight in xform.vars.values.items():
+            if weight == 0.0:
+                continue
+
+            if name not in _kernels:
+                raise ValueError('variation %r is not supported by the numpy engine' % name)
+
+            variables = dict((k, float(val)) for k, val in
+                             (xform.vars.variation_vars(name) or {}).items())
+            self.variations.append((_kernels[name], float(weight), variables))
+
+    def apply(self, x, y, rng):
+        c = self.coefs
+        p = _Precalc(c[0] * x + c[2] * y + c[4],
+                     c[1] * x + c[3] * y + c[5], c, rng)
+
+        nx = numpy.zeros(p.n)
+        ny = numpy.zeros(p.n)
+
+        for kernel, weight, variables in self.variations:
+            dx, dy = kernel(p, weight, variables)
+            nx += dx
+            ny += dy
+
+        if self.has_post:
+            c = self.post
+            nx, ny = c[0] * nx + c[2] * ny + c[4], c[1] * nx + c[3] * ny + c[5]
+
+        return nx, ny
+
+
+def iterate(genome, nsamples, fuse=20, batch=1<<16, seed=None, stats=None):
+    """Generate chaos game samples for genome
+
+    Yields (n, 4) float64 arrays of (x, y, color, alpha) rows, the same
+    layout as GenomeHandle.iterate, from batch orbits advanced in
+    lockstep.  The yielded array is reused between steps.  Orbits that
+    escape to inf/nan are restarted and counted in stats['badvals'] if a
+    stats dict is passed.
+    """
+    rng = numpy.random.RandomState(seed)
+
+    xforms = [xf for xf in genome.xforms if xf.weight > 0.0]
+    if not xforms:
+        raise ValueError('genome has no xforms with a positive weight')
+
+    compiled = [_CompiledXform(xf) for xf in xforms]
+    weights = numpy.cumsum([float(xf.weight) for xf in xforms])
+    weights /= weights[-1]
+
+    final = _CompiledXform(genome.final) if genome.final is not None else None
+
+    n = int(min(batch, max(nsamples, 1)))
+    x = rng.uniform(-1.0, 1.0, n)
+    y = rng.uniform(-1.0, 1.0, n)
+    c = rng.random_sample(n)
+    alpha = numpy.ones(n)
+    samples = numpy.empty((n, 4), numpy.float64)
+    badvals = 0
+
+    def step(x, y, c):
+        idx = numpy.searchsorted(weights, rng.random_sample(n), side='right')
+        idx = numpy.minimum(idx, len(compiled) - 1)
+
+        nx = numpy.empty(n)
+        ny = numpy.empty(n)
+        nc = numpy.empty(n)
+
+        for k, xf in enumerate(compiled):
+            sel = numpy.nonzero(idx == k)[0]
+            if not len(sel):
+                continue
+
+            nx[sel], ny[sel] = xf.apply(x[sel], y[sel], rng)
+            nc[sel] = c[sel] * (1.0 - xf.color_speed) + xf.color * xf.color_speed
+            alpha[sel] = xf.opacity
+
+        bad = ~(numpy.isfinite(nx) & numpy.isfinite(ny))
+        nbad = bad.sum()
+
+        if nbad:
+            nx[bad] = rng.uniform(-1.0, 1.0, nbad)
+            ny[bad] = rng.uniform(-1.0, 1.0, nbad)
+            alpha[bad] = 0.0
+
+        return nx, ny, nc, nbad
+
+    for i in xrange(fuse):
+        x, y, c, nbad = step(x, y, c)
+
+    remaining = nsamples
+    while remaining > 0:
+        x, y, c, nbad = step(x, y, c)
+        badvals += nbad
+
+        if final is not None:
+            fx, fy = final.apply(x, y, rng)
+            samples[:, 2] = c * (1.0 - final.color_speed) + final.color * final.color_speed
+        else:
+            fx, fy = x, y
+            samples[:, 2] = c
+
+        samples[:, 0] = fx
+        samples[:, 1] = fy
+        samples[:, 3] = alpha
+
+        if stats is not None:
+            stats['badvals'] = badvals
+
+        m = min(n, remaining)
+        remaining -= m
+        yield samples[:m]
+
+
+def render(genome, buffer, **kwargs):
+    """Render genome into buffer without libflam3
+
+    buffer is a RenderBuffer or a (height, width, channels) uint8 array.
+    Accepts quality (samples per output pixel, defaulting to the
+    genome's sample_density), oversample, transparent, seed, batch and a
+    flam3 style progress(progress, stage, eta) callback that cancels the
+    render by returning a true value.  Returns the same stats dict as
+    GenomeHandle.render.
+    """
+    target = buffer.as_array() if hasattr(buffer, 'as_array') else buffer
+    height, width = target.shape[:2]
+
+    kwargs = dict(kwargs, engine='numpy')
+    start = time.time()
+
+    histogram = render_histogram(genome, width, height, **kwargs)
+    tonemap(histogram, genome, target, transparent=kwargs.get('transparent', False))
+
+    return {'badvals': histogram.badvals,
+            'num_iters': histogram.nsamples,
+            'render_seconds': int(time.time() - start)}
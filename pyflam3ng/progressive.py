@@ -0,0 +1,241 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Resumable progressive renders
+
+A ProgressiveRender accumulates chaos game samples into one retained
+Histogram over any number of passes, so a preview can be refined into
+the final image instead of being thrown away.  Sessions checkpoint to a
+pickle holding the genome xml and the histogram and resume from it in
+another process or on another machine.
+
+render_adaptive uses a session to iterate until the image stops
+changing instead of for a fixed quality.
+"""
+from __future__ import with_statement
+
+import os
+import time
+import cPickle
+
+import numpy
+from lxml import etree
+
+from .histogram import Histogram, tonemap
+
+
+__all__ = [ 'ProgressiveRender'
+          , 'image_noise'
+          , 'render_adaptive'
+          ]
+
+
+CHECKPOINT_VERSION = 1
+
+
+class ProgressiveRender(object):
+    """A render session whose quality grows with every add_samples call
+
+    seed, when given, makes each pass reproducible: pass n iterates with
+    seed + n, so a resumed session draws the same samples it would have
+    drawn had it never stopped.
+    """
+
+    def __init__(self, genome, width=None, height=None, oversample=None,
+                 engine=None, seed=None):
+        self.genome = genome
+        self.engine = engine
+        self.seed = seed
+        self.passes = 0
+        self.histogram = Histogram(width or genome.width,
+                                   height or genome.height,
+                                   oversample or genome.spatial_oversample)
+
+    def _get_quality(self):
+        h = self.histogram
+        return float(h.nsamples) / (h.width * h.height)
+
+    quality = property(_get_quality,
+            doc='Samples accumulated per output pixel so far')
+
+    def add_samples(self, quality, **kwargs):
+        """Iterate quality more samples per output pixel into the session
+
+        Accepts the progress and batch keywords of Histogram.add_samples.
+        Returns the number of samples added.
+        """
+        h = self.histogram
+        nsamples = int(quality * h.width * h.height)
+        seed = self.seed + self.passes if self.seed is not None else None
+
+        added = h.add_samples(self.genome, nsamples, engine=self.engine,
+                              seed=seed, **kwargs)
+        self.passes += 1
+
+        return added
+
+    def refine_to(self, quality, **kwargs):
+        """Add samples until the session reaches quality"""
+        if quality <= self.quality:
+            return 0
+
+        return self.add_samples(quality - self.quality, **kwargs)
+
+    def tonemap(self, buffer=None, **kwargs):
+        """An image of the samples so far, see pyflam3ng.histogram.tonemap"""
+        return tonemap(self.histogram, self.genome, buffer, **kwargs)
+
+    def checkpoint(self, path):
+        """Save the session to path
+
+        The file is written beside path and renamed over it, so an
+        interrupted checkpoint leaves the previous one intact.
+        """
+        state = { 'version': CHECKPOINT_VERSION
+                , 'genome': etree.tostring(self.genome.to_xml())
+                , 'histogram': self.histogram
+                , 'engine': self.engine
+                , 'seed': self.seed
+                , 'passes': self.passes
+                }
+
+        tmp_path = path + '.tmp'
+
+        with open(tmp_path, 'wb') as fd:
+            cPickle.dump(state, fd, cPickle.HIGHEST_PROTOCOL)
+
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def resume(cls, path, genome=None):
+        """Load a session saved by checkpoint
+
+        genome replaces the checkpointed one, e.g. to keep a Genome that
+        is already open in an editor; it must iterate the same way for
+        the samples to stay consistent.
+        """
+        from . import load_flame
+
+        with open(path, 'rb') as fd:
+            state = cPickle.load(fd)
+
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError('unsupported checkpoint version %r' % state.get('version'))
+
+        if genome is None:
+            genome = load_flame(state['genome'])[0]
+
+        histogram = state['histogram']
+        session = cls(genome, histogram.width, histogram.height,
+                      histogram.oversample, state['engine'], state['seed'])
+        session.histogram = histogram
+        session.passes = state['passes']
+
+        return session
+
+
+def image_noise(previous, current, background=(0, 0, 0)):
+    """Relative L1 change between two renders of the same genome
+
+    The sum of absolute channel differences divided by the sum of
+    current's difference from the background, so empty regions neither
+    hide nor inflate the noise of the attractor.
+    """
+    a = numpy.asarray(previous, numpy.float64)[:, :, :3]
+    b = numpy.asarray(current, numpy.float64)[:, :, :3]
+    signal = numpy.abs(b - numpy.asarray(background, numpy.float64)).sum()
+
+    return numpy.abs(b - a).sum() / max(signal, 1.0)
+
+
+def render_adaptive(genome, buffer, **kwargs):
+    """Render genome into buffer until it converges
+
+    Iterates in rounds, doubling the samples each round, and tone maps
+    after every round.  Stops once image_noise between consecutive
+    rounds falls to target_noise (default 0.01), after max_seconds, at
+    max_quality samples per pixel (default 10000), or when
+    progress(progress, stage, eta) returns a true value.
+    initial_quality (default 1) sizes the first round.  Also accepts
+    oversample, engine, seed, batch and transparent.
+
+    Returns the stats dict of GenomeHandle.render plus quality, rounds,
+    noise, converged and convergence, a list of (num_iters, seconds,
+    noise) per round.
+    """
+    target = buffer.as_array() if hasattr(buffer, 'as_array') else buffer
+    height, width = target.shape[:2]
+
+    target_noise = kwargs.get('target_noise', 0.01)
+    max_seconds = kwargs.get('max_seconds', None)
+    max_quality = kwargs.get('max_quality', 10000.0)
+    quality = kwargs.get('initial_quality', 1.0)
+    progress = kwargs.get('progress', None)
+    transparent = kwargs.get('transparent', False)
+    background = [float(v) for v in genome.background[0]]
+
+    session = ProgressiveRender(genome, width, height, kwargs.get('oversample', None),
+                                kwargs.get('engine', None), kwargs.get('seed', None))
+
+    start = time.time()
+    previous = None
+    noise = None
+    convergence = []
+
+    while 1:
+        session.add_samples(min(quality, max_quality - session.quality),
+                            batch=kwargs.get('batch', 1<<16))
+        tonemap(session.histogram, genome, target, transparent=transparent)
+        elapsed = time.time() - start
+
+        if previous is not None:
+            noise = image_noise(previous, target, background)
+            convergence.append((session.histogram.nsamples, elapsed, noise))
+
+            if noise <= target_noise:
+                break
+
+        if session.quality >= max_quality:
+            break
+
+        if max_seconds is not None and elapsed >= max_seconds:
+            break
+
+        if progress is not None and noise is not None:
+            done = min(1.0, target_noise / max(noise, 1e-12))
+            if progress(100.0 * done, 0, elapsed / max(done, 1e-3) - elapsed):
+                break
+
+        previous = target.copy()
+        quality = session.quality
+
+    return {'badvals': session.histogram.badvals,
+            'num_iters': session.histogram.nsamples,
+            'render_seconds': int(time.time() - start),
+            'quality': session.quality,
+            'rounds': session.passes,
+            'noise': noise,
+            'converged': noise is not None and noise <= target_noise,
+            'convergence': convergence}
@@ -0,0 +1,376 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Content addressed cache of rendered images
+
+RenderCache keys a render on a sha1 of the genome's flam3 struct, or of
+its xml without libflam3, plus the output size and every render keyword
+that changes pixels.  Hits are served from an in-memory LRU tier, then
+from an optional on-disk tier, each with its own byte cap.
+"""
+from __future__ import with_statement
+
+import cPickle
+import functools
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy
+from lxml import etree
+
+from .metrics import metering
+
+try:
+    from . import flam3
+except ImportError:
+    flam3 = None
+
+
+__all__ = [ 'RenderCache'
+          , 'render_key'
+          ]
+
+
+# Keywords that only affect how a render runs, not what it produces
+_IGNORED_KWARGS = frozenset(['progress', 'nthreads', 'cache', 'metrics'])
+_size_attrib = re.compile(r' size="[^"]*"')
+
+
+def _genome_digest(genome):
+    if flam3 is not None and isinstance(genome, flam3.GenomeHandle):
+        return flam3.render_digest(genome)
+
+    if getattr(genome, 'genome_handle', None) is not None:
+        return flam3.render_digest(genome.genome_handle)
+
+    # render() overwrites the genome size with the buffer's, so the size
+    # in the xml is whatever the last render used
+    xml = _size_attrib.sub('', etree.tostring(genome.to_xml()), 1)
+    return hashlib.sha1(xml).hexdigest()
+
+
+def render_key(genome, width, height, channels, **kwargs):
+    """The cache key of rendering genome (a Genome or GenomeHandle) at
+    width x height x channels with the given render keywords"""
+    args = sorted((k, v) for k, v in kwargs.iteritems() if k not in _IGNORED_KWARGS)
+
+    digest = hashlib.sha1(_genome_digest(genome))
+    digest.update(repr((width, height, channels, args)))
+
+    return digest.hexdigest()
+
+
+def _pixels(buffer):
+    if hasattr(buffer, 'to_string'):
+        return buffer.to_string()
+
+    return buffer.tostring()
+
+
+def _load_pixels(buffer, pixels):
+    if hasattr(buffer, 'read_from_legacy_buffer'):
+        buffer.read_from_legacy_buffer(pixels)
+    else:
+        buffer.flat[:] = numpy.frombuffer(pixels, numpy.uint8)
+
+
+def _dimensions(buffer):
+    if hasattr(buffer, 'channels'):
+        return buffer.width, buffer.height, buffer.channels
+
+    height, width, channels = buffer.shape
+    return width, height, channels
+
+
+class RenderCache(object):
+    """Two tier LRU cache of rendered pixels
+
+    max_bytes caps the memory tier.  If directory is given, entries
+    evicted from memory are written there, up to max_disk_bytes; call
+    flush() to also write the entries still in memory.  Disk reads and
+    writes happen outside the cache's lock.  Counters: hits (memory_hits
+    + disk_hits), misses, evictions and disk_evictions.
+    """
+
+    def __init__(self, max_bytes=64<<20, directory=None, max_disk_bytes=1<<30):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if directory is not None:
+            self._scan_directory()
+
+    def _scan_directory(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.render'):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, name[:-len('.render')], st.st_size))
+
+        for mtime, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.render')
+
+    def _get_hits(self):
+        return self.memory_hits + self.disk_hits
+
+    hits = property(_get_hits)
+
+    def _get_hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    hit_rate = property(_get_hit_rate, doc='Fraction of lookups served from either tier')
+
+    def _get_size_in_bytes(self):
+        with self._lock:
+            return self._memory_bytes
+
+    size_in_bytes = property(_get_size_in_bytes, doc='Pixel bytes held in memory')
+
+    def _get_disk_size_in_bytes(self):
+        with self._lock:
+            return self._disk_bytes
+
+    disk_size_in_bytes = property(_get_disk_size_in_bytes, doc='Bytes held on disk')
+
+    def get(self, key):
+        """The (stats, pixels) stored under key, or None"""
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory[key] = entry
+                self.memory_hits += 1
+                return entry
+
+            on_disk = key in self._disk
+
+        if on_disk:
+            entry = self._load_disk(key)
+
+        with self._lock:
+            if entry is not None:
+                if key in self._disk:
+                    self._disk[key] = self._disk.pop(key)
+                self.disk_hits += 1
+                evicted = self._store_memory(key, entry)
+            else:
+                self.misses += 1
+                unreadable = on_disk and key in self._disk
+                if unreadable:
+                    self._disk_bytes -= self._disk.pop(key)
+
+        if entry is None:
+            if unreadable:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            return None
+
+        self._write_disk(evicted)
+        return entry
+
+    def put(self, key, stats, pixels):
+        with self._lock:
+            evicted = self._store_memory(key, (stats, pixels))
+
+        self._write_disk(evicted)
+
+    def flush(self):
+        """Write the memory entries not yet on disk to the disk tier"""
+        if self.directory is None:
+            return
+
+        with self._lock:
+            pending = [(key, entry) for key, entry in self._memory.iteritems()
+                       if key not in self._disk]
+
+        self._write_disk(pending)
+
+    def _store_memory(self, key, entry):
+        """Store entry in memory; returns the evicted entries the disk
+        tier still needs"""
+        evicted = []
+
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key)[1])
+
+        if len(entry[1]) > self.max_bytes:
+            evicted.append((key, entry))
+        else:
+            self._memory[key] = entry
+            self._memory_bytes += len(entry[1])
+
+        while self._memory_bytes > self.max_bytes:
+            old_key, old_entry = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_entry[1])
+            self.evictions += 1
+            evicted.append((old_key, old_entry))
+
+        if self.directory is None:
+            return []
+
+        return [(k, e) for k, e in evicted if k not in self._disk]
+
+    def _load_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fd:
+                entry = cPickle.load(fd)
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            return None
+
+        return entry
+
+    def _write_disk(self, entries):
+        for key, entry in entries:
+            path = self._path(key)
+            tmp_path = '%s.%d.tmp' % (path, threading.current_thread().ident)
+
+            with open(tmp_path, 'wb') as fd:
+                cPickle.dump(entry, fd, cPickle.HIGHEST_PROTOCOL)
+
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+            size = os.path.getsize(path)
+
+            removed = []
+            with self._lock:
+                if key in self._disk:
+                    self._disk_bytes -= self._disk.pop(key)
+
+                self._disk[key] = size
+                self._disk_bytes += size
+
+                while self._disk_bytes > self.max_disk_bytes and self._disk:
+                    old_key, old_size = self._disk.popitem(last=False)
+                    self._disk_bytes -= old_size
+                    self.disk_evictions += 1
+                    removed.append(old_key)
+
+            for old_key in removed:
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def clear(self, disk=False):
+        """Drop the memory tier, writing it to the disk tier first, or
+        drop the disk tier too if disk is true"""
+        if not disk:
+            self.flush()
+
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+            removed = []
+            if disk and self.directory is not None:
+                removed = list(self._disk)
+                self._disk.clear()
+                self._disk_bytes = 0
+
+        for key in removed:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def render(self, genome, buffer, **kwargs):
+        """Render genome into buffer unless the result is cached
+
+        genome is a Genome or GenomeHandle and buffer a RenderBuffer or
+        uint8 array.  Returns the render stats; on a hit they are the
+        stats of the original render with 'cached' set to True.
+
+        metrics, see pyflam3ng.metrics.metering, records a miss as a
+        render and a hit with the 'cached' outcome; copying pixels from
+        or into the cache is the output stage.
+        """
+        width, height, channels = _dimensions(buffer)
+        kwargs.pop('cache', None)
+        metrics = kwargs.pop('metrics', None)
+        key = render_key(genome, width, height, channels, **kwargs)
+
+        if metrics is None:
+            return self._render(genome, buffer, key, None, kwargs)
+
+        with metering(metrics) as record:
+            return self._render(genome, buffer, key, record, kwargs)
+
+    def _render(self, genome, buffer, key, record, kwargs):
+        start = time.time()
+        entry = self.get(key)
+        if entry is not None:
+            _load_pixels(buffer, entry[1])
+            if record is not None:
+                record.outcome = 'cached'
+                record.add_time('output', time.time() - start)
+
+            stats = dict(entry[0])
+            stats['cached'] = True
+            return stats
+
+        if flam3 is not None and isinstance(genome, flam3.GenomeHandle):
+            render = genome.render
+        elif getattr(genome, 'genome_handle', None) is not None:
+            render = genome.genome_handle.render
+        else:
+            from . import npengine
+            render = functools.partial(npengine.render, genome)
+
+        if record is None:
+            stats = render(buffer, **kwargs)
+        else:
+            stats = record.time_render(render, buffer, **kwargs)
+
+        start = time.time()
+        self.put(key, dict(stats), _pixels(buffer))
+        if record is not None:
+            record.add_time('output', time.time() - start)
+
+        stats['cached'] = False
+
+        return stats
@@ -20,21 +20,352 @@
 #  Boston, MA 02111-1307, USA.
 ##############################################################################
 from __future__ import with_statement
+import cPickle
+import heapq
+import itertools
 import threading
+import multiprocessing
 import Queue
-import traceback
+import time
+
+from . import flam3
+from .metrics import RenderMetrics, metered_render, registry as _registry
 
 __all__ = [ 'RenderJob'
           , 'RenderQueue'
+          , 'ProcessRenderQueue'
+          , 'RenderBufferPool'
+          , 'RenderWorkerError'
+          , 'RenderMemoryError'
+          , 'MemoryBudget'
+          , 'JobQueue'
+          , 'SchedulerStats'
+          , 'PRIORITY_INTERACTIVE'
+          , 'PRIORITY_NORMAL'
+          , 'PRIORITY_BATCH'
           ]
 
-def synchronized(lock):
-    def wrap(func):
-        def _impl(*args, **kwargs):
-            with lock:
-                return func(*args, **kwargs)
-        return _impl
-    return wrap
+
+# Priority classes, most urgent first.  A running job is preempted when
+# a job of a more urgent class is waiting.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+
+
+class RenderWorkerError(RuntimeError):
+    """Raised through a job's error_cb when its worker process dies"""
+
+
+class RenderMemoryError(RuntimeError):
+    """Raised through a job's error_cb when the job needs more memory
+    than its queue's whole budget"""
+
+
+class RenderBufferPool(object):
+    """Recycles RenderBuffers of the same dimensions between jobs
+
+    Idle buffers are keyed by (width, height, channels).  At most
+    max_buffers idle buffers (and max_bytes of pixels, if given) are kept;
+    the least recently released ones are dropped first.
+    """
+
+    def __init__(self, max_buffers=8, max_bytes=None):
+        self.max_buffers = max_buffers
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._idle = []
+        self._idle_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, width, height, channels):
+        key = (width, height, channels)
+
+        with self._lock:
+            for idx in xrange(len(self._idle) - 1, -1, -1):
+                if self._idle[idx][0] == key:
+                    buffer = self._idle.pop(idx)[1]
+                    self._idle_bytes -= buffer.size_in_bytes
+                    self.hits += 1
+                    return buffer
+
+            self.misses += 1
+
+        return flam3.RenderBuffer(width, height, channels)
+
+    def release(self, buffer):
+        key = (buffer.width, buffer.height, buffer.channels)
+
+        with self._lock:
+            self._idle.append((key, buffer))
+            self._idle_bytes += buffer.size_in_bytes
+
+            while self._idle and (len(self._idle) > self.max_buffers or
+                    (self.max_bytes is not None and self._idle_bytes > self.max_bytes)):
+                self._idle_bytes -= self._idle.pop(0)[1].size_in_bytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._idle = []
+            self._idle_bytes = 0
+
+    def _get_size(self):
+        with self._lock:
+            return len(self._idle)
+
+    size = property(_get_size, doc='Number of idle buffers held')
+
+    def _get_size_in_bytes(self):
+        with self._lock:
+            return self._idle_bytes
+
+    size_in_bytes = property(_get_size_in_bytes, doc='Pixel bytes held by idle buffers')
+
+
+class MemoryBudget(object):
+    """Render memory that queued jobs may hold at once
+
+    Queues reserve what flam3_render_memory_required reports before a
+    job starts and release it when the job ends.  One budget can be
+    shared by every queue on a node.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._reserved = 0
+        self._cond = threading.Condition()
+
+    def try_reserve(self, nbytes):
+        with self._cond:
+            if self._reserved + nbytes > self.max_bytes:
+                return False
+
+            self._reserved += nbytes
+            return True
+
+    def reserve(self, nbytes, timeout=None):
+        """Wait up to timeout seconds (forever if None) for nbytes to
+        become available.  Returns whether they were reserved."""
+        deadline = time.time() + timeout if timeout is not None else None
+
+        with self._cond:
+            while self._reserved + nbytes > self.max_bytes:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+            self._reserved += nbytes
+            return True
+
+    def release(self, nbytes):
+        with self._cond:
+            self._reserved -= nbytes
+            self._cond.notifyAll()
+
+    def _get_reserved(self):
+        with self._cond:
+            return self._reserved
+
+    reserved = property(_get_reserved, doc='Bytes currently reserved')
+
+    def _get_available(self):
+        with self._cond:
+            return self.max_bytes - self._reserved
+
+    available = property(_get_available, doc='Bytes that can still be reserved')
+
+
+def _memory_budget(budget):
+    if budget is None or isinstance(budget, MemoryBudget):
+        return budget
+
+    return MemoryBudget(budget)
+
+
+def _admission_size(job, budget):
+    """The bytes job must reserve from budget, or None after failing the
+    job because it can never fit"""
+    try:
+        required = job.memory_required()
+    except Exception, e:
+        job.queued = False
+        job.process_error(e)
+        return None
+
+    if required > budget.max_bytes:
+        job.queued = False
+        job.process_error(RenderMemoryError(
+            'render needs %d bytes but the memory budget is %d bytes' %
+            (required, budget.max_bytes)))
+        return None
+
+    return required
+
+
+class JobQueue(object):
+    """A Queue.Queue work-alike that orders RenderJobs
+
+    Jobs leave by priority class, then earliest deadline (jobs without
+    one last), then in the order they were put.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._unfinished = 0
+
+    def put(self, job):
+        with self._cond:
+            self._unfinished += 1
+            self._push(job)
+
+    def requeue(self, job):
+        """Put back a job taken with get whose task_done is still due"""
+        with self._cond:
+            self._push(job)
+
+    def _push(self, job):
+        deadline = job.deadline if job.deadline is not None else float('inf')
+        heapq.heappush(self._heap, (job.priority, deadline, self._counter.next(), job))
+        self._cond.notifyAll()
+
+    def get(self, block=True, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+
+        with self._cond:
+            while not self._heap:
+                if not block:
+                    raise Queue.Empty
+
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Queue.Empty
+                self._cond.wait(remaining)
+
+            return heapq.heappop(self._heap)[-1]
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def peek(self):
+        """The job get would return next, or None"""
+        with self._cond:
+            return self._heap[0][-1] if self._heap else None
+
+    def task_done(self):
+        with self._cond:
+            self._unfinished -= 1
+            self._cond.notifyAll()
+
+    def join(self):
+        with self._cond:
+            while self._unfinished:
+                self._cond.wait()
+
+    def qsize(self):
+        with self._cond:
+            return len(self._heap)
+
+
+class SchedulerStats(object):
+    """Queue wait and service time per priority class
+
+    A job waits from being queued (or requeued after preemption) until
+    it starts, and is in service until it completes, fails or is
+    preempted, so a preempted job contributes several of each.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._classes = {}
+
+    def _entry(self, priority):
+        return self._classes.setdefault(priority, {
+                'started': 0, 'finished': 0, 'preempted': 0,
+                'wait_total': 0.0, 'wait_max': 0.0,
+                'service_total': 0.0, 'service_max': 0.0})
+
+    def record_start(self, job):
+        wait = time.time() - job._queued_at
+        job._started_at = time.time()
+
+        with self._lock:
+            entry = self._entry(job.priority)
+            entry['started'] += 1
+            entry['wait_total'] += wait
+            entry['wait_max'] = max(entry['wait_max'], wait)
+
+    def record_end(self, job, preempted=False):
+        service = time.time() - job._started_at
+
+        with self._lock:
+            entry = self._entry(job.priority)
+            entry['preempted' if preempted else 'finished'] += 1
+            entry['service_total'] += service
+            entry['service_max'] = max(entry['service_max'], service)
+
+    def snapshot(self):
+        """{priority: counters} with wait_mean and service_mean added"""
+        with self._lock:
+            result = {}
+            for priority, entry in self._classes.iteritems():
+                entry = dict(entry)
+                runs = entry['finished'] + entry['preempted']
+                entry['wait_mean'] = entry['wait_total'] / entry['started'] if entry['started'] else 0.0
+                entry['service_mean'] = entry['service_total'] / runs if runs else 0.0
+                result[priority] = entry
+            return result
+
+
+def _metrics_registry(metrics):
+    if metrics is True:
+        return _registry
+    return metrics
+
+
+def _start_metrics(registry, job):
+    """Give job a fresh RenderMetrics when the queue records metrics"""
+    if registry is None:
+        job.metrics = None
+        return
+
+    job.metrics = RenderMetrics(priority=job.priority)
+    job.metrics.add_time('queue', time.time() - job._queued_at)
+
+
+def _finish_metrics(registry, job, outcome):
+    if registry is None or job.metrics is None:
+        return
+
+    job.metrics.outcome = outcome
+    registry.record(job.metrics)
+
+
+def _requeue_preempted(job, queue):
+    job._preempted = False
+    job.preemptions += 1
+    job.progress = 0
+    job.stage = 0
+
+    with job._lock:
+        job._running = False
+        job._queued = True
+
+    job._queued_at = time.time()
+    queue.requeue(job)
 
 
 class RenderJob(object):
@@ -42,31 +373,93 @@ class RenderJob(object):
     _queued = False
     _running = False
     _completed = False
-    _lock = threading.Lock()
     buffer = None
     stats = None
     progress = 0
     stage = 0
     args = {}
+    metrics = None
+    _progress_state = None
+    _aborted = False
 
     def __init__(self, genome, buffer, cancel_cb=None, completed_cb=None,
-            error_cb=None, **kwargs):
+            error_cb=None, buffer_size=None, priority=PRIORITY_NORMAL,
+            deadline=None, **kwargs):
+        """buffer may be None, in which case the queue lends the job a
+        pooled buffer of buffer_size (width, height, channels), defaulting
+        to the genome's size with 4 channels, for the duration of the
+        render and its callbacks.
+
+        priority is one of the PRIORITY_ classes and deadline an optional
+        time.time() value; both only order the queue, a missed deadline
+        does not cancel the job."""
         self.genome = genome
+        self._lock = threading.Lock()
+        self.priority = priority
+        self.deadline = deadline
+        self.preemptions = 0
+        self._preempted = False
+        self._queued_at = self._started_at = time.time()
         self.buffer = buffer
+        self.buffer_size = buffer_size
         self.cancel_cb = cancel_cb
         self.completed_cb = completed_cb
         self.error_cb = error_cb
         self.args = kwargs
+        self._pooled = False
+        self._reserved = 0
+
+    def _get_size(self):
+        if self.buffer is not None:
+            return self.buffer.width, self.buffer.height, self.buffer.channels
 
-    def _execute(self, **kwargs):
-        self.args.update(kwargs)
+        if self.buffer_size is not None:
+            return self.buffer_size
+
+        return self.genome.width, self.genome.height, 4
+
+    def memory_required(self):
+        """Bytes flam3_render will allocate for this job"""
+        width, height, channels = self._get_size()
+        return int(_genome_handle(self.genome).memory_required(
+                width, height, self.args.get('bits', 33)))
+
+    def _release_memory(self, budget):
+        if self._reserved:
+            budget.release(self._reserved)
+            self._reserved = 0
+
+    def _acquire_buffer(self, pool):
+        if self.buffer is not None:
+            return
+
+        width, height, channels = self._get_size()
+        self.buffer = pool.acquire(width, height, channels)
+        self._pooled = True
+
+    def _release_buffer(self, pool):
+        if self._pooled:
+            pool.release(self.buffer)
+            self.buffer = None
+            self._pooled = False
+
+    def _execute(self, progress, **defaults):
+        """Render with the job's args over the queue's defaults; progress
+        is always the queue's"""
+        args = dict(defaults)
+        args.update(self.args)
+        args['progress'] = progress
 
         with self._lock:
             self._queued = False
             self._running = True
 
         try:
-            self.stats = self.genome.render(self.buffer, **self.args)
+            if self.metrics is not None:
+                self.stats = metered_render(self.genome, self.buffer,
+                                            self.metrics, **args)
+            else:
+                self.stats = self.genome.render(self.buffer, **args)
         except Exception, e:
             self.process_error(e)
             return False
@@ -101,37 +494,37 @@ class RenderJob(object):
         if callable(self.completed_cb):
             self.completed_cb(self)
 
-    @synchronized(_lock)
     def _get_cancel(self):
-        return self._cancel
+        with self._lock:
+            return self._cancel
 
-    @synchronized(_lock)
     def _set_cancel(self, value):
-        self._cancel = value
+        with self._lock:
+            self._cancel = value
 
-    @synchronized(_lock)
     def _get_running(self):
-        return self._running
+        with self._lock:
+            return self._running
 
-    @synchronized(_lock)
     def _set_running(self, value):
-        self._running = value
+        with self._lock:
+            self._running = value
 
-    @synchronized(_lock)
     def _get_completed(self):
-        return self._completed
+        with self._lock:
+            return self._completed
 
-    @synchronized(_lock)
     def _set_completed(self, value):
-        self._completed = value
+        with self._lock:
+            self._completed = value
 
-    @synchronized(_lock)
     def _get_queued(self):
-        return self._queued
+        with self._lock:
+            return self._queued
 
-    @synchronized(_lock)
     def _set_queued(self, value):
-        self._queued = value
+        with self._lock:
+            self._queued = value
 
     cancel = property(fget=_get_cancel,
             fset=_set_cancel)
@@ -147,60 +540,312 @@ class RenderJob(object):
 
 
 class RenderQueue(threading.Thread):
-    _queue = Queue.Queue()
-    _lock = threading.Lock()
-    _quit = False
+    """Renders queued RenderJobs on worker threads
 
-    def __init__(self):
+    Each queue owns its jobs, so separate queues can serve e.g. previews
+    and final renders side by side.  The queue runs workers render
+    threads; each passes nthreads to GenomeHandle.render, so a queue
+    uses at most workers * nthreads cores.  nthreads None lets flam3
+    use every core.
+
+    With progress_interval set, flam3 reports progress into a
+    flam3.RenderProgress without taking the GIL or the job lock, and a
+    monitor thread passes it on to the jobs and checks for cancellation
+    at most once every progress_interval seconds.
+    """
+
+    def __init__(self, pool=None, memory_budget=None, workers=1, nthreads=None,
+            progress_interval=None, metrics=None):
+        """memory_budget, a MemoryBudget or a byte count, holds each job
+        until the memory flam3 needs to render it is available.
+
+        metrics, a metrics.Registry or True for the default one, records
+        a metrics.RenderMetrics per run of each job, also left on
+        job.metrics for its callbacks."""
         threading.Thread.__init__(self)
         self.setDaemon(True)
+        self.pool = pool if pool is not None else RenderBufferPool()
+        self.memory_budget = _memory_budget(memory_budget)
+        self.stats = SchedulerStats()
+        self.workers = workers
+        self.nthreads = nthreads
+        self.progress_interval = progress_interval
+        self.metrics = _metrics_registry(metrics)
+        self._queue = JobQueue()
+        self._lock = threading.Lock()
+        self._quit = False
+        self._running = []
+        self._admitting = []
 
-    @synchronized(_lock)
     def _get_quit(self):
-        return self._quit
+        with self._lock:
+            return self._quit
 
-    @synchronized(_lock)
     def _set_quit(self, val):
-        self._quit = val
+        with self._lock:
+            self._quit = val
 
     quit = property(fget=_get_quit, fset=_set_quit)
 
+    def _get_reserved_memory(self):
+        if self.memory_budget is None:
+            return 0
+        return self.memory_budget.reserved
+
+    reserved_memory = property(_get_reserved_memory,
+            doc='Bytes reserved from the memory budget by running jobs')
+
     def queue(self, job):
-        job.queued = True
-        self._queue.put(job)
+        """Queue job, or cancel it if the queue has quit"""
+        with self._lock:
+            if not self._quit:
+                job.queued = True
+                job._queued_at = time.time()
+                self._queue.put(job)
+                return
+
+        job.process_cancelled()
+
+    def _admit(self, job):
+        """Block until job's memory is reserved, after any more urgent
+        job's.  Returns False if the job was rejected or cancelled, or the
+        queue quit meanwhile."""
+        budget = self.memory_budget
+        if budget is None:
+            return True
+
+        required = _admission_size(job, budget)
+        if required is None:
+            return False
+
+        with self._lock:
+            self._admitting.append(job)
+
+        try:
+            while 1:
+                if self.quit:
+                    job.queued = False
+                    job.process_cancelled()
+                    return False
+
+                if job.cancel:
+                    job.queued = False
+                    job.process_cancelled()
+                    return False
+
+                if self._outranked(job):
+                    # Leave the memory to the more urgent job, or a
+                    # preempted job would take it straight back
+                    time.sleep(0.1)
+                elif budget.reserve(required, timeout=0.1):
+                    break
+        finally:
+            with self._lock:
+                self._admitting.remove(job)
+
+        job._reserved = required
+        return True
+
+    def _outranked(self, job):
+        """Whether a more urgent job is waiting for memory"""
+        with self._lock:
+            return bool([j for j in self._admitting if j.priority < job.priority])
+
+    def _should_preempt(self, job):
+        """Whether job should yield to a more urgent waiting job: one
+        waiting for memory, or a queued one when every worker is busy.
+        Only the least urgent job yields, one at a time."""
+        queued = self._queue.peek()
+
+        with self._lock:
+            waiting = list(self._admitting)
+            if queued is not None and \
+                    len(self._running) + len(self._admitting) >= self.workers:
+                waiting.append(queued)
+
+            if not waiting or min(j.priority for j in waiting) >= job.priority:
+                return False
+
+            if [j for j in self._running if j._preempted]:
+                return False
+
+            victim = max(self._running, key=lambda j: (j.priority, j._started_at))
+            if victim is not job:
+                return False
+
+            job._preempted = True
+            return True
 
     def run(self):
+        helpers = []
+        for i in xrange(self.workers - 1):
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            helpers.append(thread)
+
+        if self.progress_interval is not None:
+            thread = threading.Thread(target=self._monitor)
+            thread.setDaemon(True)
+            thread.start()
+            helpers.append(thread)
+
+        self._work()
+
+        for thread in helpers:
+            thread.join()
+
+    def _progress_proc(self, job):
+        job._aborted = False
+
+        if self.progress_interval is not None:
+            job._progress_seen = 0
+            job._progress_state = flam3.RenderProgress()
+            return job._progress_state
+
+        job._progress_state = None
+
+        def progress_proc(progress, stage, eta):
+            if self.quit:
+                job.cancel = True
+                job._aborted = True
+                return 1
+
+            with job._lock:
+                if job._cancel:
+                    job._aborted = True
+                    return 1
+
+                job.process_progress(progress, stage)
+
+            # Cancel through flam3 and requeue when a more urgent
+            # class is waiting
+            if self._should_preempt(job):
+                job._aborted = True
+                return 1
+
+            return 0
+
+        return progress_proc
+
+    def _drain(self):
+        """Cancel the jobs still queued when the queue quits"""
+        while 1:
+            try:
+                job = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            job.queued = False
+            job.process_cancelled()
+            self._queue.task_done()
+
+    def _poll_progress(self, job):
+        """Pass a job's RenderProgress on to it and cancel it through
+        flam3 when it was cancelled, the queue quit or it should yield"""
+        state = job._progress_state
+        if state is None:
+            return
+
+        if self.quit:
+            job.cancel = True
+
+        with job._lock:
+            if job._cancel:
+                state.cancel = True
+                return
+
+            if job.metrics is not None:
+                job.metrics.mark_filter(state.stage)
+
+            updates = state.updates
+            if updates != job._progress_seen:
+                job._progress_seen = updates
+                job.process_progress(state.progress, state.stage)
+
+        if self._should_preempt(job):
+            state.cancel = True
+
+    def _monitor(self):
         while 1:
+            time.sleep(self.progress_interval)
+
+            with self._lock:
+                running = list(self._running)
+
+            for job in running:
+                self._poll_progress(job)
+
             if self.quit:
                 return
 
+    def _work(self):
+        args = {}
+        if self.nthreads is not None:
+            args['nthreads'] = self.nthreads
+
+        while 1:
+            if self.quit:
+                self._drain()
+                return
+
             try:
                 job = self._queue.get(block=True, timeout=0.1)
             except Queue.Empty:
                 continue
 
-            def progress_proc(progress, stage, eta):
-                if self.quit:
-                    job.cancel = True
-                    return 1
+            try:
+                if not self._admit(job):
+                    self._queue.task_done()
+                    continue
+
+                progress_proc = self._progress_proc(job)
+                job._acquire_buffer(self.pool)
+            except Exception, e:
+                # Fail the job rather than the render thread, which
+                # would leave its reservation and every waiter behind
+                job.queued = False
+                job._release_buffer(self.pool)
+                job._release_memory(self.memory_budget)
+                job.process_error(e)
+                self._queue.task_done()
+                continue
 
-                with job._lock:
-                    if job._cancel:
-                        return 1
+            _start_metrics(self.metrics, job)
+            self.stats.record_start(job)
 
-                    job.process_progress(progress, stage)
-                    return 0
+            with self._lock:
+                self._running.append(job)
 
-            if not job._execute(progress=progress_proc):
-                print 'ERROR: execute failed'
-                #traceback.print_exc()
+            try:
+                executed = job._execute(progress=progress_proc, **args)
+            finally:
+                with self._lock:
+                    self._running.remove(job)
 
+            if not executed:
+                # _execute passed the error to the job's error_cb
+                self.stats.record_end(job)
+                _finish_metrics(self.metrics, job, 'error')
+                job._release_buffer(self.pool)
+                job._release_memory(self.memory_budget)
                 self._queue.task_done()
                 continue
 
+            if not _render_aborted(job):
+                # The render finished before flam3 saw the cancel
+                job._preempted = False
 
-            if self.quit:
-                return
+            preempted = job._preempted and not job.cancel
+            job._preempted = False
+            self.stats.record_end(job, preempted)
+
+            if preempted and not self.quit:
+                _finish_metrics(self.metrics, job, 'preempted')
+                job._release_buffer(self.pool)
+                job._release_memory(self.memory_budget)
+                _requeue_preempted(job, self._queue)
+                continue
 
             with job._lock:
                 if job._cancel:
@@ -211,13 +856,402 @@ class RenderQueue(threading.Thread):
                     job.process_completed()
 
                 job._running = False
+
+            _finish_metrics(self.metrics, job, 'cancelled' if job.cancel else 'completed')
+
+            job._release_buffer(self.pool)
+            job._release_memory(self.memory_budget)
+            self._queue.task_done()
+
+
+def _render_aborted(job):
+    """Whether flam3 was told to cancel job's last render"""
+    state = job._progress_state
+    if state is not None:
+        return bool(state.cancelled)
+    return job._aborted
+
+
+def _genome_handle(genome):
+    return getattr(genome, 'genome_handle', genome)
+
+
+def _process_args(job):
+    """The render arguments sent to a worker process; progress is
+    reported through the pipe instead"""
+    return dict((k, v) for k, v in job.args.iteritems() if k != 'progress')
+
+
+def _render_process_main(conn, cancel_flag, nthreads):
+    """Entry point of a ProcessRenderQueue worker process
+
+    Receives (flattened genome, width, height, channels, args) tuples and
+    answers with progress, completed, cancelled or error messages.  A
+    render only counts as cancelled if flam3 saw the cancel flag.  None
+    shuts the worker down.
+    """
+    buffer = flam3.RenderBuffer()
+
+    while 1:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+
+        if request is None:
+            return
+
+        blob, width, height, channels, args = request
+        args.setdefault('nthreads', nthreads)
+        cancelled = []
+
+        def progress_proc(progress, stage, eta):
+            if cancel_flag.value:
+                cancelled.append(stage)
+                return 1
+
+            conn.send(('progress', progress, stage))
+            return 0
+
+        try:
+            genome = flam3.unflatten(blob)
+            buffer.resize(width, height, channels)
+            stats = genome.render(buffer, progress=progress_proc, **args)
+        except Exception, e:
+            conn.send(('error', '%s: %s' % (e.__class__.__name__, e)))
+            continue
+
+        if cancelled:
+            conn.send(('cancelled', stats))
+        else:
+            conn.send(('completed', stats, buffer.to_string()))
+
+
+class _RenderProcess(object):
+    def __init__(self, nthreads):
+        self.nthreads = nthreads
+        self.job = None
+        self.conn = None
+        self.process = None
+        self.cancel_flag = multiprocessing.Value('i', 0)
+        self.spawn()
+
+    def spawn(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.cancel_flag.value = 0
+        self.process = multiprocessing.Process(target=_render_process_main,
+                args=(child_conn, self.cancel_flag, self.nthreads))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def submit(self, job):
+        buffer = job.buffer
+        args = _process_args(job)
+
+        self.job = job
+        self.cancel_flag.value = 0
+
+        start = time.time()
+        blob = flam3.flatten(_genome_handle(job.genome))
+        if job.metrics is not None:
+            job.metrics.add_time('convert', time.time() - start)
+            job.metrics.memory_bytes = job.memory_required()
+
+        self.conn.send((blob, buffer.width, buffer.height, buffer.channels, args))
+        job._submitted_at = time.time()
+
+    def shutdown(self):
+        try:
+            self.conn.send(None)
+        except (IOError, EOFError):
+            pass
+
+        self.process.join(1.0)
+
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class ProcessRenderQueue(threading.Thread):
+    """A RenderQueue that renders each job in one of several processes
+
+    Genomes are shipped to the workers flattened and the rendered pixels
+    are copied back into the job's buffer.  If a worker dies mid-render
+    only its current job fails, with a RenderWorkerError, and the worker
+    is replaced.
+    """
+    _poll_interval = 0.01
+
+    def __init__(self, processes=None, nthreads=1, pool=None, memory_budget=None,
+            metrics=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.pool = pool if pool is not None else RenderBufferPool()
+        self.memory_budget = _memory_budget(memory_budget)
+        self.metrics = _metrics_registry(metrics)
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self._queue = JobQueue()
+        self._lock = threading.Lock()
+        self._quit = False
+        self._workers = [_RenderProcess(nthreads) for i in xrange(processes)]
+        self.stats = SchedulerStats()
+        self._held = None
+
+    def _get_quit(self):
+        with self._lock:
+            return self._quit
+
+    def _set_quit(self, val):
+        with self._lock:
+            self._quit = val
+
+    quit = property(fget=_get_quit, fset=_set_quit)
+
+    def _get_reserved_memory(self):
+        if self.memory_budget is None:
+            return 0
+        return self.memory_budget.reserved
+
+    reserved_memory = property(_get_reserved_memory,
+            doc='Bytes reserved from the memory budget by running jobs')
+
+    def queue(self, job):
+        """Queue job, raising TypeError if one of its render arguments
+        cannot be sent to a worker process"""
+        for name, value in _process_args(job).iteritems():
+            try:
+                cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+            except Exception, e:
+                raise TypeError('render argument %r cannot be sent to a '
+                                'render process: %s' % (name, e))
+
+        job.queued = True
+        job._queued_at = time.time()
+        self._queue.put(job)
+
+    def _next_job(self):
+        """The next job whose memory could be reserved, or None
+
+        A job that does not fit yet is held at the head of the queue so
+        that big jobs are not starved by smaller ones behind them.
+        """
+        budget = self.memory_budget
+
+        while 1:
+            if self._held is None:
+                try:
+                    job = self._queue.get_nowait()
+                except Queue.Empty:
+                    return None
+
+                if budget is None:
+                    return job
+
+                required = _admission_size(job, budget)
+                if required is None:
+                    self._queue.task_done()
+                    continue
+
+                self._held = job, required
+
+            job, required = self._held
+
+            if job.cancel:
+                self._held = None
+                job.queued = False
+                job.process_cancelled()
                 self._queue.task_done()
+                continue
 
+            if not budget.try_reserve(required):
+                return None
 
+            job._reserved = required
+            self._held = None
+            return job
 
+    def run(self):
+        try:
+            while not self.quit:
+                idle = [w for w in self._workers if w.job is None]
+                busy = [w for w in self._workers if w.job is not None]
 
+                for worker in idle:
+                    job = self._next_job()
+                    if job is None:
+                        break
 
+                    self._start_job(worker, job)
 
+                self._preempt()
+
+                if not self._poll_workers(busy):
+                    time.sleep(self._poll_interval)
+        finally:
+            for worker in self._workers:
+                worker.shutdown()
+
+    def _preempt(self):
+        """Cancel the least urgent running job if a more urgent class is
+        held waiting for memory, or queued while no worker is idle.  Only
+        one job is preempted at a time."""
+        busy = [w for w in self._workers if w.job is not None]
+        waiting = []
+
+        if self._held is not None:
+            waiting.append(self._held[0])
+
+        if len(busy) == len(self._workers):
+            queued = self._queue.peek()
+            if queued is not None:
+                waiting.append(queued)
+
+        if not waiting or [w for w in busy if w.job._preempted]:
+            return
+
+        urgent = min(job.priority for job in waiting)
+        candidates = [w for w in busy if w.job.priority > urgent]
+        if not candidates:
+            return
+
+        worker = max(candidates, key=lambda w: (w.job.priority, w.job._started_at))
+        worker.job._preempted = True
+        worker.cancel_flag.value = 1
+
+    def _start_job(self, worker, job):
+        with job._lock:
+            job._queued = False
+            job._running = True
+
+        _start_metrics(self.metrics, job)
+        self.stats.record_start(job)
+
+        try:
+            job._acquire_buffer(self.pool)
+            worker.submit(job)
+        except Exception, e:
+            worker.job = job
+            self._finish_job(worker)
+
+            if isinstance(e, (IOError, EOFError)) or not worker.process.is_alive():
+                # The worker died while idle; replace it so later jobs
+                # are not sent to it as well
+                worker.spawn()
+                e = RenderWorkerError('render process died before the job '
+                                      'started: %s' % e)
+
+            _finish_metrics(self.metrics, job, 'error')
+            job.process_error(e)
+            job._release_buffer(self.pool)
+
+    def _finish_job(self, worker):
+        job = worker.job
+        worker.job = None
+
+        with job._lock:
+            job._running = False
+
+        self.stats.record_end(job)
+        job._release_memory(self.memory_budget)
+        self._queue.task_done()
+        return job
+
+    def _requeue_job(self, worker):
+        job = worker.job
+        worker.job = None
+
+        self.stats.record_end(job, True)
+        _finish_metrics(self.metrics, job, 'preempted')
+        job._release_buffer(self.pool)
+        job._release_memory(self.memory_budget)
+        _requeue_preempted(job, self._queue)
+
+    def _poll_workers(self, workers):
+        handled = False
+
+        for worker in workers:
+            job = worker.job
+
+            if job.cancel:
+                worker.cancel_flag.value = 1
+
+            try:
+                while worker.conn.poll():
+                    handled = True
+                    message = worker.conn.recv()
+
+                    if message[0] == 'progress':
+                        if job.metrics is not None:
+                            job.metrics.mark_filter(message[2])
+                        with job._lock:
+                            job.process_progress(message[1], message[2])
+                        continue
+
+                    if message[0] == 'cancelled' and job._preempted and not job.cancel:
+                        self._requeue_job(worker)
+                        break
+
+                    # A render that finished before the worker saw the
+                    # cancel flag is kept even if it was preempted
+                    job._preempted = False
+
+                    self._finish_job(worker)
+
+                    if message[0] == 'error':
+                        _finish_metrics(self.metrics, job, 'error')
+                        job.process_error(RuntimeError(message[1]))
+                    elif message[0] == 'cancelled':
+                        with job._lock:
+                            job._completed = False
+                            job.process_cancelled()
+                        _finish_metrics(self.metrics, job, 'cancelled')
+                    else:
+                        self._complete_job(job, message[1], message[2])
+
+                    job._release_buffer(self.pool)
+                    break
+            except (IOError, EOFError):
+                pass
+
+            if worker.job is not None and not worker.process.is_alive():
+                handled = True
+                exitcode = worker.process.exitcode
+                self._finish_job(worker)
+                worker.spawn()
+                _finish_metrics(self.metrics, job, 'error')
+                job.process_error(RenderWorkerError(
+                    'render process died (exit code %s)' % exitcode))
+                job._release_buffer(self.pool)
+
+        return handled
+
+    def _complete_job(self, job, stats, pixels):
+        job.stats = stats
+
+        if job.metrics is not None:
+            job.metrics.record_render(job._submitted_at, time.time(), stats)
+
+        with job._lock:
+            if job._cancel:
+                job._completed = False
+                job.process_cancelled()
+                _finish_metrics(self.metrics, job, 'cancelled')
+                return
 
+        start = time.time()
+        job.buffer.read_from_legacy_buffer(pixels)
+        if job.metrics is not None:
+            job.metrics.add_time('output', time.time() - start)
 
+        with job._lock:
+            job._completed = True
+            job.process_completed()
 
+        _finish_metrics(self.metrics, job, 'completed')
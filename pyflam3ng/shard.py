@@ -0,0 +1,346 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Sharded rendering across processes and hosts
+
+The sample budget of a render is split into independent shards, each
+iterated with its own seed into a partial Histogram.  The partial
+histograms are summed and tone mapped once, so density estimation and
+filtering see the whole image and the result matches a single process
+render statistically.
+
+Shards run on a local multiprocessing pool or on other hosts running a
+ShardServer.  The wire protocol is a length prefixed pickle in each
+direction, which trusts the peer completely: only expose servers on
+networks you control.  LocalShardHost stands in for a remote host in
+tests and on a single machine.
+"""
+from __future__ import with_statement
+
+import cPickle
+import multiprocessing
+import socket
+import SocketServer
+import struct
+import threading
+import time
+import Queue
+
+from lxml import etree
+
+from .histogram import Histogram, tonemap
+
+
+__all__ = [ 'ShardTask'
+          , 'ShardError'
+          , 'ShardServer'
+          , 'LocalShardHost'
+          , 'RemoteShardHost'
+          , 'plan_shards'
+          , 'render_shard'
+          , 'shard_histogram'
+          , 'render_sharded'
+          ]
+
+
+DEFAULT_PORT = 8413
+DEFAULT_TIMEOUT = 600.0
+_header = struct.Struct('!Q')
+
+
+class ShardError(RuntimeError):
+    """Raised when a shard fails on its worker or host"""
+
+
+class ShardTask(object):
+    """Everything a worker needs to iterate one shard
+
+    The genome travels as flame xml so that hosts with or without
+    libflam3 can load it.
+    """
+
+    def __init__(self, genome_xml, width, height, oversample, nsamples,
+                 seed, engine=None, batch=1<<16):
+        self.genome_xml = genome_xml
+        self.width = width
+        self.height = height
+        self.oversample = oversample
+        self.nsamples = nsamples
+        self.seed = seed
+        self.engine = engine
+        self.batch = batch
+
+
+def plan_shards(genome, nsamples, nshards, width=None, height=None,
+                oversample=None, seed=0, engine=None, batch=1<<16):
+    """Split nsamples of genome into nshards ShardTasks seeded seed,
+    seed + 1, ..."""
+    genome_xml = etree.tostring(genome.to_xml())
+    width = width or genome.width
+    height = height or genome.height
+    oversample = oversample or genome.spatial_oversample
+    nshards = max(1, min(nshards, nsamples))
+
+    tasks = []
+    for i in xrange(nshards):
+        count = nsamples // nshards + (1 if i < nsamples % nshards else 0)
+        tasks.append(ShardTask(genome_xml, width, height, oversample,
+                               count, seed + i, engine, batch))
+
+    return tasks
+
+
+def render_shard(task):
+    """Iterate one ShardTask into a new Histogram"""
+    from . import load_flame
+
+    genome = load_flame(task.genome_xml)[0]
+    histogram = Histogram(task.width, task.height, task.oversample)
+    histogram.add_samples(genome, task.nsamples, engine=task.engine,
+                          seed=task.seed, batch=task.batch)
+
+    return histogram
+
+
+def _send_message(sock, obj):
+    data = cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+    sock.sendall(_header.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1<<20))
+        if not chunk:
+            raise EOFError('connection closed mid message')
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return ''.join(chunks)
+
+
+def _recv_message(sock):
+    size, = _header.unpack(_recv_exactly(sock, _header.size))
+    return cPickle.loads(_recv_exactly(sock, size))
+
+
+class _ShardRequestHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        try:
+            task = _recv_message(self.request)
+        except EOFError:
+            return
+
+        try:
+            reply = ('ok', render_shard(task))
+        except Exception, e:
+            reply = ('error', '%s: %s' % (e.__class__.__name__, e))
+
+        _send_message(self.request, reply)
+
+
+class ShardServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Renders ShardTasks sent by RemoteShardHost, one thread per
+    connection.  Use port 0 to pick a free port; server_address holds
+    the bound address."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        SocketServer.TCPServer.__init__(self, (host, port), _ShardRequestHandler)
+
+    def start(self):
+        """Serve from a daemon thread and return it"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+
+
+class RemoteShardHost(object):
+    """A ShardServer at address, rendering up to slots shards at once
+
+    timeout is in seconds and bounds connecting and waiting for each
+    reply, so a hung host fails its shard instead of blocking the
+    render; None waits forever.
+    """
+
+    def __init__(self, address, slots=1, timeout=DEFAULT_TIMEOUT):
+        self.address = address
+        self.slots = slots
+        self.timeout = timeout
+
+    def render(self, task):
+        sock = socket.create_connection(self.address, self.timeout)
+        try:
+            _send_message(sock, task)
+            status, payload = _recv_message(sock)
+        finally:
+            sock.close()
+
+        if status != 'ok':
+            raise ShardError('%s:%d: %s' % (self.address[0], self.address[1], payload))
+
+        return payload
+
+
+class LocalShardHost(object):
+    """Renders shards in the calling process with the same interface as
+    RemoteShardHost"""
+
+    def __init__(self, slots=1):
+        self.slots = slots
+
+    def render(self, task):
+        return render_shard(task)
+
+
+def _run_on_hosts(hosts, tasks):
+    """Yield histograms as the hosts finish them, slots threads per host
+
+    A task that fails on a host is retried on the hosts that have not
+    failed it yet; ShardError is raised once every host has failed it.
+    """
+    pending = list(enumerate(tasks))
+    failed = dict((i, set()) for i in xrange(len(tasks)))
+    results = Queue.Queue()
+    condition = threading.Condition()
+    state = {'done': False}
+
+    def next_task(index):
+        with condition:
+            while not state['done']:
+                for n, (i, task) in enumerate(pending):
+                    if index not in failed[i]:
+                        del pending[n]
+                        return i, task
+                condition.wait()
+
+        return None, None
+
+    def worker(index, host):
+        while 1:
+            i, task = next_task(index)
+            if task is None:
+                return
+
+            try:
+                results.put(('ok', host.render(task)))
+            except Exception, e:
+                with condition:
+                    failed[i].add(index)
+                    if len(failed[i]) == len(hosts):
+                        results.put(('error', e))
+                    else:
+                        pending.append((i, task))
+                        condition.notify_all()
+
+    for index, host in enumerate(hosts):
+        for i in xrange(host.slots):
+            thread = threading.Thread(target=worker, args=(index, host))
+            thread.setDaemon(True)
+            thread.start()
+
+    try:
+        for i in xrange(len(tasks)):
+            status, payload = results.get()
+            if status != 'ok':
+                raise ShardError(str(payload))
+            yield payload
+    finally:
+        with condition:
+            state['done'] = True
+            condition.notify_all()
+
+
+def shard_histogram(genome, **kwargs):
+    """Render genome into one Histogram summed from independent shards
+
+    Accepts width, height, quality (samples per output pixel, defaulting
+    to the genome's sample_density), oversample, engine, batch, seed
+    (the first shard's seed, default 0), shards (default four per
+    worker), and either processes (size of a local multiprocessing pool,
+    default the cpu count) or hosts (RemoteShardHost/LocalShardHost
+    instances).  A shard that fails on a host is retried on the others.
+    progress(progress, stage, eta) is called as shards complete.
+    """
+    width = kwargs.get('width', None) or genome.width
+    height = kwargs.get('height', None) or genome.height
+    oversample = int(kwargs.get('oversample', None) or genome.spatial_oversample)
+    quality = float(kwargs.get('quality', None) or genome.sample_density)
+    hosts = kwargs.get('hosts', None)
+    processes = kwargs.get('processes', None) or multiprocessing.cpu_count()
+    progress = kwargs.get('progress', None)
+
+    if hosts:
+        workers = sum(host.slots for host in hosts)
+    else:
+        workers = processes
+
+    nsamples = int(quality * width * height)
+    tasks = plan_shards(genome, nsamples, kwargs.get('shards', 4 * workers),
+                        width, height, oversample, kwargs.get('seed', 0),
+                        kwargs.get('engine', None), kwargs.get('batch', 1<<16))
+
+    pool = None
+    if hosts:
+        results = _run_on_hosts(hosts, tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(render_shard, tasks)
+
+    histogram = Histogram(width, height, oversample)
+    start = time.time()
+
+    try:
+        for done, partial in enumerate(results):
+            histogram.merge(partial)
+
+            if progress is not None:
+                eta = (time.time() - start) * (len(tasks) - done - 1) / (done + 1)
+                progress(100.0 * (done + 1) / len(tasks), 0, eta)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return histogram
+
+
+def render_sharded(genome, buffer, **kwargs):
+    """Render genome into buffer with shard_histogram and one tonemap
+
+    buffer is a RenderBuffer or (height, width, channels) uint8 array
+    and sets the render size.  Returns the stats dict of
+    GenomeHandle.render.
+    """
+    target = buffer.as_array() if hasattr(buffer, 'as_array') else buffer
+    height, width = target.shape[:2]
+
+    start = time.time()
+    histogram = shard_histogram(genome, **dict(kwargs, width=width, height=height))
+    tonemap(histogram, genome, target, transparent=kwargs.get('transparent', False))
+
+    return {'badvals': histogram.badvals,
+            'num_iters': histogram.nsamples,
+            'render_seconds': int(time.time() - start)}
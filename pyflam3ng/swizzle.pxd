@@ -0,0 +1,50 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+ctypedef unsigned long size_t
+
+
+cdef extern from "string.h":
+    void *memcpy(void *dest, void *src, size_t n) nogil
+
+
+# Destination pixel layouts, named by byte order in memory
+cdef enum:
+    FORMAT_RGB = 0
+    FORMAT_RGBA = 1
+    FORMAT_RGBA_PREMULTIPLIED = 2
+    FORMAT_RGBX = 3
+    FORMAT_BGRA = 4
+    FORMAT_BGRA_PREMULTIPLIED = 5
+    FORMAT_BGRX = 6
+    FORMAT_ARGB = 7
+    FORMAT_ARGB_PREMULTIPLIED = 8
+    FORMAT_XRGB = 9
+    FORMAT_COUNT = 10
+
+
+cdef int format_bytes_per_pixel(int format) nogil
+
+cdef int convert(unsigned char *src, int src_channels, Py_ssize_t src_stride,
+                 unsigned char *dest, int dest_format, Py_ssize_t dest_stride,
+                 unsigned int width, unsigned int height) nogil
@@ -0,0 +1,216 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+"""Channel swizzling between flam3's RGB/RGBA output and display formats
+
+Every conversion works a row at a time.  Layouts that match the source
+are copied with memcpy, the common display layouts have unrolled loops
+and everything else goes through a table driven loop.
+"""
+
+RGB = FORMAT_RGB
+RGBA = FORMAT_RGBA
+RGBA_PREMULTIPLIED = FORMAT_RGBA_PREMULTIPLIED
+RGBX = FORMAT_RGBX
+BGRA = FORMAT_BGRA
+BGRA_PREMULTIPLIED = FORMAT_BGRA_PREMULTIPLIED
+BGRX = FORMAT_BGRX
+ARGB = FORMAT_ARGB
+ARGB_PREMULTIPLIED = FORMAT_ARGB_PREMULTIPLIED
+XRGB = FORMAT_XRGB
+
+
+# Index 3 is the source alpha (0xFF for RGB sources), index 4 is always 0xFF
+cdef struct _layout:
+    int bpp
+    int premultiply
+    int order[4]
+
+
+cdef _layout _layouts[FORMAT_COUNT]
+
+
+cdef void _set_layout(int format, int bpp, int premultiply, int c0, int c1, int c2, int c3):
+    _layouts[format].bpp = bpp
+    _layouts[format].premultiply = premultiply
+    _layouts[format].order[0] = c0
+    _layouts[format].order[1] = c1
+    _layouts[format].order[2] = c2
+    _layouts[format].order[3] = c3
+
+
+_set_layout(FORMAT_RGB, 3, 0, 0, 1, 2, 0)
+_set_layout(FORMAT_RGBA, 4, 0, 0, 1, 2, 3)
+_set_layout(FORMAT_RGBA_PREMULTIPLIED, 4, 1, 0, 1, 2, 3)
+_set_layout(FORMAT_RGBX, 4, 0, 0, 1, 2, 4)
+_set_layout(FORMAT_BGRA, 4, 0, 2, 1, 0, 3)
+_set_layout(FORMAT_BGRA_PREMULTIPLIED, 4, 1, 2, 1, 0, 3)
+_set_layout(FORMAT_BGRX, 4, 0, 2, 1, 0, 4)
+_set_layout(FORMAT_ARGB, 4, 0, 3, 0, 1, 2)
+_set_layout(FORMAT_ARGB_PREMULTIPLIED, 4, 1, 3, 0, 1, 2)
+_set_layout(FORMAT_XRGB, 4, 0, 4, 0, 1, 2)
+
+
+def bytes_per_pixel(int format):
+    cdef int bpp = format_bytes_per_pixel(format)
+
+    if bpp < 0:
+        raise ValueError('unknown pixel format %d' % format)
+
+    return bpp
+
+
+cdef int format_bytes_per_pixel(int format) nogil:
+    if format < 0 or format >= FORMAT_COUNT:
+        return -1
+
+    return _layouts[format].bpp
+
+
+cdef inline unsigned char _premultiply(unsigned int c, unsigned int a) nogil:
+    # Exact round(c * a / 255) without a division
+    cdef unsigned int t = c * a + 128
+    return <unsigned char>((t + (t >> 8)) >> 8)
+
+
+cdef void _row_rgba_to_bgra(unsigned char *s, unsigned char *d, unsigned int width) nogil:
+    cdef unsigned int x
+
+    for x in range(width):
+        d[0] = s[2]
+        d[1] = s[1]
+        d[2] = s[0]
+        d[3] = s[3]
+        s += 4
+        d += 4
+
+
+cdef void _row_rgb_to_bgrx(unsigned char *s, unsigned char *d, unsigned int width) nogil:
+    cdef unsigned int x
+
+    for x in range(width):
+        d[0] = s[2]
+        d[1] = s[1]
+        d[2] = s[0]
+        d[3] = 0xFF
+        s += 3
+        d += 4
+
+
+cdef void _row_rgba_to_rgb(unsigned char *s, unsigned char *d, unsigned int width) nogil:
+    cdef unsigned int x
+
+    for x in range(width):
+        d[0] = s[0]
+        d[1] = s[1]
+        d[2] = s[2]
+        s += 4
+        d += 3
+
+
+cdef void _row_generic(unsigned char *s, int src_channels, unsigned char *d,
+                       _layout *layout, unsigned int width) nogil:
+    cdef unsigned int x
+    cdef int i
+    cdef int bpp = layout.bpp
+    cdef unsigned char px[5]
+
+    px[3] = 0xFF
+    px[4] = 0xFF
+
+    for x in range(width):
+        px[0] = s[0]
+        px[1] = s[1]
+        px[2] = s[2]
+
+        if src_channels == 4:
+            px[3] = s[3]
+
+            if layout.premultiply:
+                px[0] = _premultiply(px[0], px[3])
+                px[1] = _premultiply(px[1], px[3])
+                px[2] = _premultiply(px[2], px[3])
+
+        for i in range(bpp):
+            d[i] = px[layout.order[i]]
+
+        s += src_channels
+        d += bpp
+
+
+cdef int convert(unsigned char *src, int src_channels, Py_ssize_t src_stride,
+                 unsigned char *dest, int dest_format, Py_ssize_t dest_stride,
+                 unsigned int width, unsigned int height) nogil:
+    """Convert width x height pixels of RGB/RGBA into dest_format
+
+    A stride of 0 means tightly packed rows.  Returns -1 for an
+    unsupported source or destination format.
+    """
+    cdef _layout *layout
+    cdef unsigned int y
+    cdef Py_ssize_t row_bytes
+    cdef bint identity
+
+    if src_channels != 3 and src_channels != 4:
+        return -1
+
+    if dest_format < 0 or dest_format >= FORMAT_COUNT:
+        return -1
+
+    layout = &_layouts[dest_format]
+    row_bytes = width * src_channels
+
+    if src_stride == 0:
+        src_stride = row_bytes
+
+    if dest_stride == 0:
+        dest_stride = width * layout.bpp
+
+    identity = (layout.bpp == src_channels and layout.order[0] == 0
+                and layout.order[1] == 1 and layout.order[2] == 2
+                and (src_channels == 3 or (layout.order[3] == 3 and not layout.premultiply)))
+
+    if identity:
+        if src_stride == row_bytes and dest_stride == row_bytes:
+            memcpy(dest, src, row_bytes * height)
+        else:
+            for y in range(height):
+                memcpy(dest + y * dest_stride, src + y * src_stride, row_bytes)
+
+        return 0
+
+    for y in range(height):
+        if src_channels == 4 and dest_format == FORMAT_BGRA:
+            _row_rgba_to_bgra(src, dest, width)
+        elif src_channels == 3 and (dest_format == FORMAT_BGRX or dest_format == FORMAT_BGRA
+                                    or dest_format == FORMAT_BGRA_PREMULTIPLIED):
+            _row_rgb_to_bgrx(src, dest, width)
+        elif src_channels == 4 and dest_format == FORMAT_RGB:
+            _row_rgba_to_rgb(src, dest, width)
+        else:
+            _row_generic(src, src_channels, dest, layout, width)
+
+        src += src_stride
+        dest += dest_stride
+
+    return 0
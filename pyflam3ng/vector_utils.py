@@ -7,7 +7,11 @@ for animation and interpolation.
 """
 
 import numpy, math, copy
-from util import spline
+try:
+    from util import spline
+except ImportError:
+    # Compiled extension; only the TCB spline path needs it
+    spline = None
 
 valid_curves = ['lin', 'par', 'npar', 'sin', 'cos', 'hcos', 'sinh', 'tanh',
                 'exp', 'plin', 'ppar']
@@ -206,6 +210,8 @@ class Spline():
             for j in xrange(4):
                 vals[j] = tcps[j].val
                 times[j] = tcps[j].time
+            if spline is None:
+                raise RuntimeError('TCB splines need the pyflam3ng.util extension')
             for j in xrange(self._count):
                 tmp[j][i0:i1] = spline(vals[:,j], times, ti, ci, bi, to, co, bo
                                       ,curve, amp, freq, slope, peak, mode)
@@ -75,17 +75,27 @@ def _Extension(name, sources, options_dict, *additional_options):
     return Extension(name, sources, **options_dict)
 
 
-setup(
-    name = "pyflam3ng",
-    ext_modules=[
+ext_modules = [
+    _Extension("pyflam3ng.swizzle", ["pyflam3ng/swizzle.pyx"], None),
+    _Extension("pyflam3ng.util", ["pyflam3ng/util.pyx"],
+        numpy_compiler_options()
+    ),
+]
+
+try:
+    ext_modules.insert(0,
         _Extension("pyflam3ng.flam3", ["pyflam3ng/flam3.pyx"],
             numpy_compiler_options(),
             flam3_compiler_options()
-        ),
-        _Extension("pyflam3ng.util", ["pyflam3ng/util.pyx"],
-            numpy_compiler_options()
-        ),
-    ],
+        ))
+except Exception, e:
+    # Without libflam3 the package still works through pyflam3ng.npengine
+    print 'warning: %s; building without pyflam3ng.flam3' % e
+
+
+setup(
+    name = "pyflam3ng",
+    ext_modules=ext_modules,
     cmdclass = {'build_ext': build_ext}
 
 )
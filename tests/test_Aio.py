@@ -0,0 +1,115 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import time
+import trollius
+from trollius import From, Return
+from pyflam3ng import aio
+from testing_util import print_test_name
+
+
+class _Genome(object):
+    """Stands in for a Genome; reports steps progress updates"""
+    width = height = 8
+
+    def __init__(self, steps=4, delay=0.0):
+        self.steps = steps
+        self.delay = delay
+
+    def render(self, buffer, progress=None, **kwargs):
+        for n in xrange(self.steps):
+            if progress(float(n) / self.steps, 0, 0):
+                return None
+            time.sleep(self.delay)
+        return dict(steps=self.steps)
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = trollius.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    @print_test_name
+    def testRender(self):
+        seen = []
+        coro = aio.render(_Genome(), None, loop=self.loop,
+                          progress=lambda value, stage: seen.append(value))
+        stats = self.loop.run_until_complete(coro)
+
+        self.assertEqual(stats, dict(steps=4))
+        self.assertEqual(len(seen), 4)
+
+    @print_test_name
+    def testQueue(self):
+        queue = aio.AsyncRenderQueue(max_in_flight=1, loop=self.loop)
+
+        @trollius.coroutine
+        def run():
+            task = yield From(queue.submit(_Genome(), None))
+            updates = []
+            while 1:
+                update = yield From(task.next_progress())
+                if update is None:
+                    break
+                updates.append(update)
+            stats = yield From(task.wait())
+            raise Return((updates, stats))
+
+        try:
+            updates, stats = self.loop.run_until_complete(run())
+        finally:
+            queue.close()
+
+        self.assertEqual(len(updates), 4)
+        self.assertEqual(stats, dict(steps=4))
+
+    @print_test_name
+    def testQuitInFlight(self):
+        queue = aio.AsyncRenderQueue(max_in_flight=1, loop=self.loop)
+
+        @trollius.coroutine
+        def run():
+            task = yield From(queue.submit(_Genome(10000, 0.001), None))
+            yield From(task.next_progress())
+            queue.close()
+
+            try:
+                yield From(trollius.wait_for(task.wait(), 5, loop=self.loop))
+            except trollius.CancelledError:
+                pass
+            else:
+                self.fail('the render was not cancelled')
+
+            # the slot came back, and later tasks are cancelled at once
+            late = yield From(trollius.wait_for(
+                    queue.submit(_Genome(), None), 5, loop=self.loop))
+            yield From(trollius.wait([late.future], timeout=5, loop=self.loop))
+            raise Return(late)
+
+        late = self.loop.run_until_complete(run())
+
+        self.assertTrue(late.future.cancelled())
+        self.assertFalse(queue._slots.locked())
@@ -0,0 +1,63 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+from testing_util import print_test_name, load_test_flames
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.genomes = load_test_flames()
+
+    @print_test_name
+    def testGenome(self):
+        genome = self.genomes[0]
+        other = load_test_flames()[0]
+
+        self.assertEqual(genome.fingerprint(), other.fingerprint())
+        self.assertNotEqual(genome, other)
+        self.assertEqual(len(set(g.fingerprint() for g in
+                                 [genome, other, self.genomes[1]])), 2)
+
+        # identity semantics, so editing a key doesn't corrupt the dict
+        keyed = {other: 1}
+        coefs = other.xforms[0].coefs
+        coefs[4] += 1e-9
+        other.xforms[0].coefs = coefs
+        self.assertEqual(keyed[other], 1)
+        self.assertEqual(genome.fingerprint(), other.fingerprint())
+        self.assertNotEqual(genome.fingerprint(1e-12), other.fingerprint(1e-12))
+
+        other.xforms[0].vars.set_variation('linear', 0.5)
+        self.assertNotEqual(genome.fingerprint(), other.fingerprint())
+
+    @print_test_name
+    def testHandle(self):
+        handle = self.genomes[0].genome_handle
+        clone = handle.clone()
+
+        self.assertEqual(handle.fingerprint(), clone.fingerprint())
+        self.assertNotEqual(handle, clone)
+        self.assertNotEqual(handle.fingerprint(),
+                            self.genomes[1].genome_handle.fingerprint())
+        self.assertEqual(len(dict.fromkeys([handle, clone])), 2)
@@ -0,0 +1,84 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+from pyflam3ng import flam3
+from pyflam3ng.func import frame_bounds
+from testing_util import print_test_name, load_test_flames
+
+
+class TestCase(unittest.TestCase):
+    @print_test_name
+    def testFrameBounds(self):
+        self.assertEqual(frame_bounds((-1, -2), (3, 2), 200, 100, 0.0), (1.0, 0.0, 25.0))
+        self.assertEqual(frame_bounds((-1, -1), (1, 1), 100, 100, 0.1)[2], 40.0)
+        self.assertRaises(ValueError, frame_bounds, (0, 0), (0, 1), 100, 100)
+
+    @print_test_name
+    def testAutoframe(self):
+        genome = load_test_flames()[0]
+        (xmin, ymin), (xmax, ymax) = genome.estimate_bounds(0.01, 5000, seed=1)
+        self.assertTrue(xmin < xmax and ymin < ymax)
+
+        genome.autoframe(64, 48, 0.1, nsamples=5000, seed=1)
+
+        self.assertEqual((genome.width, genome.height), (64, 48))
+        self.assertEqual(genome.zoom, 0.0)
+        self.assertAlmostEqual(genome.center[0][0], (xmin + xmax) / 2.0, 4)
+        self.assertTrue(genome.pixels_per_unit * (xmax - xmin) <= 64 * 0.8 + 1e-6)
+
+    @print_test_name
+    def testBoundsMatchFallback(self):
+        genome = load_test_flames()[0]
+        handle = genome.genome_handle
+        blob = flam3.flatten(handle)
+
+        (xmin, ymin), (xmax, ymax) = genome.estimate_bounds(0.05, 50000, seed=1)
+        self.assertEqual(flam3.flatten(handle), blob)
+
+        # eps trims each side on both paths
+        genome.genome_handle = None
+        (fxmin, fymin), (fxmax, fymax) = genome.estimate_bounds(0.05, 50000, seed=1)
+        tolerance = 0.05 * max(xmax - xmin, ymax - ymin)
+        for a, b in [(xmin, fxmin), (ymin, fymin), (xmax, fxmax), (ymax, fymax)]:
+            self.assertTrue(abs(a - b) < tolerance)
+
+    @print_test_name
+    def testSeeds(self):
+        handle = load_test_flames()[0].genome_handle
+
+        def samples(seed):
+            return iter(handle.iterate(1000, seed=seed)).next()[:, :2].copy()
+
+        self.assertTrue((samples(1) == samples(1)).all())
+        self.assertFalse((samples(1) == samples(2)).any())
+        self.assertFalse((samples(1) == samples(-1)).any())
+        self.assertFalse((samples(2 ** 40) == samples(2 ** 40 + 2 ** 72)).any())
+        self.assertTrue((samples('abc') == samples(u'abc')).all())
+
+    @print_test_name
+    def testUnhashableSeed(self):
+        handle = load_test_flames()[0].genome_handle
+
+        self.assertRaises(TypeError, handle.estimate_bounds, 0.01, 100, [1])
+        self.assertRaises(TypeError, list, handle.iterate(100, seed={}))
@@ -0,0 +1,122 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import cPickle
+import numpy
+from pyflam3ng import histogram as histogram_module
+from pyflam3ng.histogram import Histogram, render_histogram, tonemap
+from testing_util import print_test_name, load_test_flames
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.genome = load_test_flames()[0]
+
+    @print_test_name
+    def testAccumulate(self):
+        histogram = Histogram(4, 2)
+        samples = numpy.array([[0.0, 0.0, 0.5, 1.0],
+                               [0.0, 0.0, 0.5, 1.0],
+                               [1e6, 0.0, 0.5, 1.0]])
+
+        self.genome.center[0] = (0.0, 0.0)
+        self.genome.rotate = 0.0
+        self.assertEqual(histogram.accumulate(samples, self.genome), 2)
+        self.assertEqual(histogram.nsamples, 3)
+        self.assertEqual(histogram.buckets[1, 2, 3], 2.0)
+
+    @print_test_name
+    def testRetonemap(self):
+        histogram = render_histogram(self.genome, 32, 24, quality=5,
+                                     engine='numpy', seed=1)
+        copy = cPickle.loads(cPickle.dumps(histogram, 2))
+        self.assertEqual(copy.nsamples, histogram.nsamples)
+
+        first = numpy.zeros((24, 32, 3), numpy.uint8)
+        second = numpy.zeros((24, 32, 3), numpy.uint8)
+        tonemap(histogram, self.genome, first)
+        tonemap(copy, self.genome, second)
+        self.assertTrue((first == second).all())
+
+        self.genome.brightness *= 4
+        tonemap(copy, self.genome, second)
+        self.assertTrue(second.sum() > first.sum())
+
+        self.assertRaises(ValueError, tonemap, histogram, self.genome,
+                          numpy.zeros((8, 8, 3), numpy.uint8))
+
+    @print_test_name
+    def testEstimateDensityRegions(self):
+        random = numpy.random.RandomState(1)
+        density = numpy.zeros((40, 50))
+        density[10:20, 5:15] = random.uniform(1.0, 50.0, (10, 10))
+        density[30:35, 40:48] = random.uniform(0.0, 2.0, (5, 8))
+        accum = random.uniform(0.0, 1.0, (40, 50, 4)) * (density > 0.0)[:, :, None]
+        self.genome.estimator = 9.0
+        self.genome.estimator_minimum = 0.0
+        self.genome.estimator_curve = 0.4
+
+        # blurring the whole frame at every radius, as flam3's gather would
+        radius = numpy.maximum(9.0 / numpy.power(density + 1.0, 0.4), 0.0)
+        level = numpy.ceil(radius).astype(numpy.intp)
+        expected = accum.copy()
+        for k in numpy.unique(level[density > 0.0]):
+            mask = level == k
+            blurred = histogram_module._convolve(
+                    accum, histogram_module._gaussian_kernel(k / 2.0))
+            expected[mask] = blurred[mask]
+
+        result = histogram_module._estimate_density(accum, density, self.genome, 1)
+        self.assertTrue(numpy.allclose(result, expected))
+
+    @print_test_name
+    def testRetonemapCached(self):
+        histogram = render_histogram(self.genome, 32, 24, quality=5,
+                                     engine='numpy', seed=1)
+        image = numpy.zeros((24, 32, 3), numpy.uint8)
+        tonemap(histogram, self.genome, image)
+
+        calls = []
+        estimate = histogram_module._estimate_density
+        def counting(*args):
+            calls.append(args)
+            return estimate(*args)
+
+        histogram_module._estimate_density = counting
+        try:
+            self.genome.gamma *= 2
+            self.genome.brightness *= 2
+            tonemap(histogram, self.genome, image)
+            self.assertEqual(calls, [])
+
+            uncached = numpy.zeros((24, 32, 3), numpy.uint8)
+            tonemap(cPickle.loads(cPickle.dumps(histogram, 2)), self.genome, uncached)
+            self.assertEqual(len(calls), 1)
+            self.assertTrue((image == uncached).all())
+
+            histogram.add_samples(self.genome, 100, engine='numpy', seed=2)
+            tonemap(histogram, self.genome, image)
+            self.assertEqual(len(calls), 2)
+        finally:
+            histogram_module._estimate_density = estimate
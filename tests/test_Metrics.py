@@ -0,0 +1,144 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import json
+import os
+import tempfile
+import urllib2
+from pyflam3ng import metrics
+from testing_util import print_test_name
+
+
+def _record(outcome='completed'):
+    record = metrics.RenderMetrics(priority=1)
+    record.add_time('queue', 0.5)
+    record.record_render(10.0, 12.0, dict(num_iters=4000, badvals=4))
+    record.memory_bytes = 1 << 22
+    record.outcome = outcome
+    return record
+
+
+class _Buffer(object):
+    width = 16
+    height = 16
+
+
+class _Handle(object):
+    def memory_required(self, width, height, bits):
+        return width * height * 4
+
+    def render(self, buffer, progress=None):
+        progress(0.5, 0, 0)
+        progress(1.0, 1, 0)
+        return dict(num_iters=100, badvals=0)
+
+
+class _BrokenHandle(_Handle):
+    def render(self, buffer, progress=None):
+        raise RuntimeError('render failed')
+
+
+class TestCase(unittest.TestCase):
+    @print_test_name
+    def testRenderMetrics(self):
+        record = _record()
+
+        self.assertEqual(record.stages['iterate'], 2.0)
+        self.assertEqual(record.stages['filter'], 0.0)
+        self.assertEqual(record.iters_per_second, 2000.0)
+        self.assertEqual(record.badval_rate, 0.001)
+
+        record = metrics.RenderMetrics()
+        progress = record.wrap_progress(None)
+        progress(0.5, 0, 0)
+        self.assertTrue(record._filter_started is None)
+        progress(0.5, 1, 0)
+        self.assertFalse(record._filter_started is None)
+
+    @print_test_name
+    def testRegistry(self):
+        registry = metrics.Registry()
+        sink = metrics.MemorySink()
+        registry.add_sink(sink)
+
+        registry.record(_record())
+        registry.record(_record('cancelled'))
+
+        self.assertEqual(registry.renders.value(outcome='completed', priority=1), 1)
+        self.assertEqual(registry.iterations.value(priority=1), 8000)
+        self.assertEqual(registry.stage_seconds.count(stage='queue', priority=1), 2)
+        self.assertEqual(registry.stage_seconds.sum(stage='queue', priority=1), 1.0)
+        self.assertEqual(len(sink.records), 2)
+        self.assertEqual(sink.records[1]['outcome'], 'cancelled')
+
+        self.assertRaises(TypeError, registry.histogram, 'renders_total')
+
+        text = registry.to_prometheus()
+        self.assertTrue('# TYPE pyflam3ng_renders_total counter' in text)
+        self.assertTrue('pyflam3ng_renders_total{outcome="completed",priority="1"} 1' in text)
+        self.assertTrue('pyflam3ng_stage_seconds_bucket{priority="1",stage="queue",le="+Inf"} 2' in text)
+
+    @print_test_name
+    def testMeteredRender(self):
+        registry = metrics.Registry()
+        sink = metrics.MemorySink()
+        registry.add_sink(sink)
+
+        stats = metrics.metered_render(_Handle(), _Buffer(), registry)
+        self.assertEqual(stats['num_iters'], 100)
+        self.assertEqual(sorted(sink.records[0]['stages']), ['filter', 'iterate'])
+        self.assertEqual(sink.records[0]['memory_bytes'], 16 * 16 * 4)
+
+        self.assertRaises(RuntimeError, metrics.metered_render,
+                          _BrokenHandle(), _Buffer(), registry)
+        self.assertEqual(sink.records[1]['outcome'], 'error')
+
+    @print_test_name
+    def testJsonLines(self):
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        try:
+            registry = metrics.Registry()
+            registry.add_sink(metrics.JsonLinesSink(path))
+            registry.record(_record())
+            registry.record(_record())
+
+            lines = open(path).read().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertEqual(json.loads(lines[0])['num_iters'], 4000)
+        finally:
+            os.remove(path)
+
+    @print_test_name
+    def testPrometheusServer(self):
+        registry = metrics.Registry()
+        registry.record(_record())
+
+        server = metrics.PrometheusServer(registry, port=0)
+        server.start()
+        try:
+            url = 'http://%s:%d/metrics' % server.server_address
+            self.assertEqual(urllib2.urlopen(url).read(), registry.to_prometheus())
+        finally:
+            server.shutdown()
@@ -0,0 +1,63 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import os
+import sys
+import subprocess
+from testing_util import print_test_name, TEST_FLAME
+
+
+# Run in a child so the blocked extensions don't leak into other tests;
+# a None entry in sys.modules makes the import raise ImportError
+NO_FLAM3_SCRIPT = '''
+import sys
+sys.modules['pyflam3ng.flam3'] = None
+sys.modules['pyflam3ng.util'] = None
+
+import numpy
+import pyflam3ng
+from pyflam3ng import npengine
+from pyflam3ng.histogram import render_histogram, tonemap
+
+assert pyflam3ng.flam3 is None
+genome = pyflam3ng.load_flame(filename=sys.argv[1])[0]
+image = numpy.zeros((24, 32, 3), numpy.uint8)
+npengine.render(genome, image, quality=5, seed=1)
+assert image.any()
+
+histogram = render_histogram(genome, 16, 12, quality=2, engine='numpy', seed=1)
+assert isinstance(tonemap(histogram, genome), numpy.ndarray)
+'''
+
+
+class TestCase(unittest.TestCase):
+    @print_test_name
+    def testRenderWithoutFlam3(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        child = subprocess.Popen([sys.executable, '-c', NO_FLAM3_SCRIPT,
+                                  TEST_FLAME],
+                                 env=env, stderr=subprocess.PIPE)
+        errors = child.communicate()[1]
+
+        self.assertEqual(child.returncode, 0, errors)
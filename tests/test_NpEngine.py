@@ -0,0 +1,56 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import numpy
+from pyflam3ng import npengine
+from testing_util import print_test_name, load_test_flames
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.genome = load_test_flames()[0]
+
+    @print_test_name
+    def testIterate(self):
+        chunks = list(s.copy() for s in
+                      npengine.iterate(self.genome, 5000, batch=2048, seed=1))
+
+        self.assertEqual([len(c) for c in chunks], [2048, 2048, 904])
+        self.assertEqual(chunks[0].shape[1], 4)
+        self.assertTrue(numpy.isfinite(chunks[-1]).all())
+
+    @print_test_name
+    def testRender(self):
+        image = numpy.zeros((24, 32, 4), numpy.uint8)
+        stats = npengine.render(self.genome, image, quality=5, seed=1)
+
+        self.assertEqual(stats['num_iters'], 24 * 32 * 5)
+        self.assertTrue(image[:, :, :3].any())
+        self.assertTrue((image[:, :, 3] == 255).all())
+
+    @print_test_name
+    def testUnsupported(self):
+        self.genome.xforms[0].vars.set_variation('super_shape', 1.0)
+        self.assertRaises(ValueError, npengine.render, self.genome,
+                          numpy.zeros((8, 8, 3), numpy.uint8))
@@ -0,0 +1,77 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import os
+import tempfile
+import numpy
+import pyflam3ng
+from pyflam3ng.progressive import ProgressiveRender
+from testing_util import print_test_name, load_test_flames
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.genome = load_test_flames()[0]
+
+    @print_test_name
+    def testResume(self):
+        straight = ProgressiveRender(self.genome, 32, 24, 1, engine='numpy', seed=7)
+        straight.add_samples(2)
+        straight.add_samples(3)
+
+        session = ProgressiveRender(self.genome, 32, 24, 1, engine='numpy', seed=7)
+        session.add_samples(2)
+        preview = session.tonemap(numpy.zeros((24, 32, 3), numpy.uint8))
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            session.checkpoint(path)
+            resumed = ProgressiveRender.resume(path, self.genome)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(resumed.quality, 2.0)
+        resumed.refine_to(5)
+
+        self.assertEqual(resumed.quality, 5.0)
+        self.assertEqual(resumed.passes, 2)
+        self.assertTrue((resumed.histogram.buckets == straight.histogram.buckets).all())
+        self.assertEqual(preview.shape, (24, 32, 3))
+
+    @print_test_name
+    def testAdaptive(self):
+        image = numpy.zeros((24, 32, 3), numpy.uint8)
+
+        stats = pyflam3ng.progressive.render_adaptive(self.genome, image,
+                engine='numpy', seed=1, target_noise=0.0, max_quality=8)
+        self.assertEqual(stats['quality'], 8.0)
+        self.assertEqual(stats['rounds'], 4)
+        self.assertEqual(len(stats['convergence']), 3)
+        self.assertFalse(stats['converged'])
+
+        stats = pyflam3ng.progressive.render_adaptive(self.genome, image,
+                engine='numpy', seed=1, target_noise=10.0)
+        self.assertTrue(stats['converged'])
+        self.assertEqual(stats['rounds'], 2)
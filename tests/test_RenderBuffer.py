@@ -0,0 +1,119 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import os
+import tempfile
+import numpy
+import pyflam3ng
+import pyflam3ng.swizzle
+from testing_util import print_test_name
+
+
+class TestCase(unittest.TestCase):
+    @print_test_name
+    def testAsArray(self):
+        buffer = pyflam3ng.flam3.RenderBuffer(8, 4, 4)
+        array = buffer.as_array()
+
+        self.assertEqual(array.shape, (4, 8, 4))
+        self.assertEqual(array.dtype, numpy.uint8)
+
+        array[:] = 7
+        self.assertEqual(buffer.to_string(), '\x07' * buffer.size_in_bytes)
+
+        self.assertRaises(BufferError, buffer.resize, 16, 16, 4)
+        del array
+        buffer.resize(16, 16, 4)
+
+    @print_test_name
+    def testFromArray(self):
+        array = numpy.zeros((4, 8, 3), numpy.uint8)
+        buffer = pyflam3ng.flam3.RenderBuffer.from_array(array)
+
+        self.assertEqual((buffer.width, buffer.height, buffer.channels),
+                         (8, 4, 3))
+
+        buffer.read_from_legacy_buffer('\xff' * buffer.size_in_bytes)
+        self.assertTrue((array == 255).all())
+
+        self.assertRaises(ValueError, buffer.resize, 16, 16, 3)
+        self.assertRaises(ValueError, pyflam3ng.flam3.RenderBuffer.from_array,
+                          numpy.zeros((4, 8, 3), numpy.float32))
+
+    @print_test_name
+    def testSwizzle(self):
+        swizzle = pyflam3ng.swizzle
+        buffer = pyflam3ng.flam3.RenderBuffer(3, 2, 4)
+        buffer.as_array()[:] = (10, 20, 30, 128)
+
+        dest = bytearray(3 * 2 * 4)
+        buffer.write_to_legacy_buffer(dest, swizzle.BGRA)
+        self.assertEqual(list(dest[:4]), [30, 20, 10, 128])
+
+        buffer.write_to_legacy_buffer(dest, swizzle.ARGB_PREMULTIPLIED)
+        self.assertEqual(list(dest[:4]), [128, 5, 10, 15])
+
+        dest = bytearray(3 * 2 * 3)
+        buffer.write_to_legacy_buffer(dest, swizzle.RGB)
+        self.assertEqual(list(dest[-3:]), [10, 20, 30])
+
+        buffer = pyflam3ng.flam3.RenderBuffer(3, 2, 3)
+        buffer.as_array()[:] = (10, 20, 30)
+
+        dest = bytearray(3 * 2 * 4)
+        buffer.write_to_legacy_buffer(dest, swizzle.BGRX)
+        self.assertEqual(list(dest[-4:]), [30, 20, 10, 255])
+
+        self.assertRaises(RuntimeError, buffer.write_to_legacy_buffer,
+                          bytearray(4), swizzle.BGRX)
+
+    @print_test_name
+    def testMapped(self):
+        fd, path = tempfile.mkstemp(suffix='.ppm')
+        os.close(fd)
+
+        try:
+            buffer = pyflam3ng.flam3.RenderBuffer.mapped(path, 4, 2, 3)
+            buffer.as_array()[:] = (1, 2, 3)
+            buffer.close()
+
+            self.assertEqual(buffer.size_in_bytes, 0)
+            self.assertEqual(open(path, 'rb').read(),
+                             'P6\n4 2\n255\n' + '\x01\x02\x03' * 8)
+        finally:
+            os.remove(path)
+
+    @print_test_name
+    def testOversized(self):
+        RenderBuffer = pyflam3ng.flam3.RenderBuffer
+        huge = 0xffffffff
+
+        self.assertRaises(OverflowError, RenderBuffer, huge, huge, 4)
+        self.assertRaises(OverflowError, RenderBuffer.mapped,
+                          os.devnull, huge, huge, 4)
+
+        buffer = RenderBuffer(8, 4, 3)
+        self.assertRaises(OverflowError, buffer.resize, huge, huge, 4)
+        self.assertEqual((buffer.width, buffer.height, buffer.size_in_bytes),
+                         (8, 4, 96))
@@ -0,0 +1,126 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import shutil
+import tempfile
+import pyflam3ng
+from pyflam3ng import metrics
+from pyflam3ng.rendercache import RenderCache, render_key
+from testing_util import print_test_name, load_test_flames
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.genome = load_test_flames()[0]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @print_test_name
+    def testKey(self):
+        key = render_key(self.genome, 16, 16, 3, bits=33)
+
+        self.assertEqual(key, render_key(self.genome, 16, 16, 3, bits=33, nthreads=4))
+        self.assertNotEqual(key, render_key(self.genome, 16, 16, 3, bits=64))
+        self.assertNotEqual(key, render_key(self.genome, 16, 16, 4, bits=33))
+
+        # rendering writes the size into the genome, which the key ignores
+        self.genome.render(pyflam3ng.flam3.RenderBuffer(8, 8, 3))
+        self.assertEqual(key, render_key(self.genome, 16, 16, 3, bits=33))
+
+        handle = self.genome.genome_handle
+        self.assertEqual(key, render_key(handle.clone(), 16, 16, 3, bits=33))
+        handle.xform(0).coefs[0, 0] += 0.25
+        self.assertNotEqual(key, render_key(handle, 16, 16, 3, bits=33))
+
+    @print_test_name
+    def testTiers(self):
+        cache = RenderCache(directory=self.directory)
+        buffer = pyflam3ng.flam3.RenderBuffer(16, 16, 3)
+
+        stats = self.genome.render(buffer, cache=cache)
+        pixels = buffer.to_string()
+        self.assertFalse(stats['cached'])
+
+        buffer.read_from_legacy_buffer('\0' * buffer.size_in_bytes)
+        self.assertTrue(self.genome.render(buffer, cache=cache)['cached'])
+        self.assertEqual(buffer.to_string(), pixels)
+        self.assertEqual(cache.memory_hits, 1)
+
+        cache.clear()
+        self.assertTrue(self.genome.render(buffer, cache=cache)['cached'])
+        self.assertEqual(cache.disk_hits, 1)
+
+        reopened = RenderCache(directory=self.directory)
+        self.assertTrue(reopened.render(self.genome, buffer)['cached'])
+        self.assertEqual(reopened.hit_rate, 1.0)
+
+    @print_test_name
+    def testWriteBack(self):
+        cache = RenderCache(max_bytes=16 * 16 * 3, directory=self.directory)
+        buffer = pyflam3ng.flam3.RenderBuffer(16, 16, 3)
+
+        cache.render(self.genome, buffer)
+        self.assertEqual(cache.disk_size_in_bytes, 0)
+        cache.flush()
+        self.assertEqual(len(cache._disk), 1)
+
+        # the second render is written when reading back the first evicts it
+        cache.render(self.genome, buffer, transparent=1)
+        self.assertEqual(len(cache._disk), 1)
+        self.assertTrue(cache.render(self.genome, buffer)['cached'])
+        self.assertEqual(cache.disk_hits, 1)
+        self.assertEqual(len(cache._disk), 2)
+
+    @print_test_name
+    def testEviction(self):
+        cache = RenderCache(max_bytes=16 * 16 * 3)
+        buffer = pyflam3ng.flam3.RenderBuffer(16, 16, 3)
+
+        cache.render(self.genome, buffer)
+        cache.render(self.genome, buffer, transparent=1)
+
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.size_in_bytes, 16 * 16 * 3)
+        self.assertEqual(cache.misses, 2)
+
+    @print_test_name
+    def testMetrics(self):
+        cache = RenderCache()
+        buffer = pyflam3ng.flam3.RenderBuffer(16, 16, 3)
+        registry = metrics.Registry()
+        sink = metrics.MemorySink()
+        registry.add_sink(sink)
+
+        self.genome.render(buffer, cache=cache, metrics=registry)
+        self.genome.render(buffer, cache=cache, metrics=registry)
+
+        miss, hit = sink.records
+        self.assertEqual(miss['outcome'], 'completed')
+        self.assertTrue(miss['num_iters'] > 0)
+        self.assertTrue('iterate' in miss['stages'])
+        self.assertEqual(hit['outcome'], 'cached')
+        self.assertEqual(hit['num_iters'], 0)
+        self.assertEqual(sorted(hit['stages']), ['output'])
@@ -0,0 +1,591 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import threading
+import time
+from pyflam3ng.flam3 import RenderBuffer, RenderProgress
+from pyflam3ng.renderqueue import RenderBufferPool, RenderJob, RenderQueue, \
+        ProcessRenderQueue, MemoryBudget, RenderMemoryError, RenderWorkerError, \
+        JobQueue, SchedulerStats, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, \
+        PRIORITY_BATCH, _render_aborted
+from testing_util import print_test_name, load_test_flames
+
+
+class SlowGenome(object):
+    """Renders for steps milliseconds, stopping early when progress
+    asks it to"""
+    width = height = 8
+
+    def __init__(self, steps, listen=True, memory=100):
+        self.steps = steps
+        self.listen = listen
+        self.memory = memory
+        self.started = threading.Event()
+
+    def memory_required(self, width, height, bits=33):
+        return self.memory
+
+    def render(self, buffer, progress=None, **kwargs):
+        self.started.set()
+        for n in xrange(self.steps):
+            if self.listen and progress(100.0 * n / self.steps, 0, 0):
+                break
+            time.sleep(0.001)
+        return {}
+
+
+class TestCase(unittest.TestCase):
+    @print_test_name
+    def testPoolReuse(self):
+        pool = RenderBufferPool(max_buffers=2)
+
+        buffer = pool.acquire(16, 8, 4)
+        self.assertEqual((buffer.width, buffer.height, buffer.channels), (16, 8, 4))
+        self.assertEqual((pool.hits, pool.misses), (0, 1))
+
+        pool.release(buffer)
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(pool.size_in_bytes, 16 * 8 * 4)
+
+        self.assertTrue(pool.acquire(16, 8, 4) is buffer)
+        self.assertEqual((pool.hits, pool.misses), (1, 1))
+        self.assertEqual(pool.size, 0)
+
+        self.assertFalse(pool.acquire(16, 8, 3) is buffer)
+        self.assertEqual(pool.misses, 2)
+
+    @print_test_name
+    def testPoolEviction(self):
+        pool = RenderBufferPool(max_buffers=2)
+        a, b, c = [pool.acquire(8, 8, n) for n in (3, 4, 4)]
+
+        pool.release(a)
+        pool.release(b)
+        pool.release(c)
+
+        self.assertEqual(pool.size, 2)
+        self.assertEqual(pool.evictions, 1)
+        self.assertFalse(pool.acquire(8, 8, 3) is a)
+
+        pool = RenderBufferPool(max_buffers=8, max_bytes=8 * 8 * 4)
+        pool.release(a)
+        pool.release(b)
+
+        self.assertEqual(pool.size, 1)
+        self.assertTrue(pool.acquire(8, 8, 4) is b)
+
+    @print_test_name
+    def testMemoryBudget(self):
+        budget = MemoryBudget(100)
+
+        self.assertTrue(budget.try_reserve(60))
+        self.assertFalse(budget.try_reserve(60))
+        self.assertFalse(budget.reserve(60, timeout=0.01))
+        self.assertEqual((budget.reserved, budget.available), (60, 40))
+
+        threading.Timer(0.05, budget.release, (60,)).start()
+        self.assertTrue(budget.reserve(60, timeout=5))
+        self.assertEqual(budget.reserved, 60)
+
+    @print_test_name
+    def testRejectOversized(self):
+        genome = load_test_flames()[0]
+        errors = []
+        done = threading.Event()
+
+        def error_cb(job, error):
+            errors.append(error)
+            done.set()
+
+        queue = RenderQueue(memory_budget=1024)
+        queue.start()
+        try:
+            queue.queue(RenderJob(genome, None, error_cb=error_cb,
+                                  buffer_size=(64, 64, 4)))
+            done.wait(5)
+        finally:
+            queue.quit = True
+
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(isinstance(errors[0], RenderMemoryError))
+        self.assertEqual(queue.reserved_memory, 0)
+
+    @print_test_name
+    def testPooledBuffer(self):
+        class Genome(object):
+            width, height = 16, 8
+
+            def render(self, buffer, **kwargs):
+                return {}
+
+        pool = RenderBufferPool()
+        seen = []
+        done = threading.Event()
+
+        def completed_cb(job):
+            seen.append(job.buffer)
+            done.set()
+
+        queue = RenderQueue(pool=pool)
+        queue.start()
+        try:
+            queue.queue(RenderJob(Genome(), None, completed_cb=completed_cb))
+            done.wait(5)
+            queue._queue.join()
+        finally:
+            queue.quit = True
+
+        self.assertEqual(len(seen), 1)
+        buffer = seen[0]
+        self.assertEqual((buffer.width, buffer.height, buffer.channels), (16, 8, 4))
+        self.assertEqual(pool.size, 1)
+        self.assertTrue(pool.acquire(16, 8, 4) is buffer)
+
+    @print_test_name
+    def testBufferFailure(self):
+        class Genome(object):
+            width = height = 8
+
+            def render(self, buffer, **kwargs):
+                return {}
+
+        class BrokenPool(RenderBufferPool):
+            def acquire(self, width, height, channels):
+                raise MemoryError('no buffer')
+
+        errors = []
+        done = threading.Event()
+
+        queue = RenderQueue(pool=BrokenPool())
+        queue.start()
+        try:
+            queue.queue(RenderJob(Genome(), None,
+                                  error_cb=lambda job, error: errors.append(error)))
+            queue.queue(RenderJob(Genome(), RenderBuffer(8, 8, 4),
+                                  completed_cb=lambda job: done.set()))
+            done.wait(5)
+        finally:
+            queue.quit = True
+
+        # the render thread survives the first job and runs the second
+        self.assertTrue(done.isSet())
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(isinstance(errors[0], MemoryError))
+
+    @print_test_name
+    def testHeldUntilReleased(self):
+        order = []
+        first = RenderJob(SlowGenome(200), None, completed_cb=order.append)
+        second = RenderJob(SlowGenome(1), None, completed_cb=order.append)
+
+        queue = RenderQueue(workers=2, memory_budget=150)
+        queue.start()
+        try:
+            queue.queue(first)
+            self.assertTrue(first.genome.started.wait(5))
+            queue.queue(second)
+            time.sleep(0.05)
+            self.assertFalse(second.genome.started.isSet())
+            queue._queue.join()
+        finally:
+            queue.quit = True
+
+        self.assertEqual(order, [first, second])
+        self.assertEqual(queue.reserved_memory, 0)
+
+    @print_test_name
+    def testProcessHeadOfLineHold(self):
+        budget = MemoryBudget(150)
+        queue = ProcessRenderQueue(processes=1, memory_budget=budget)
+        try:
+            first = RenderJob(SlowGenome(1), None)
+            big = RenderJob(SlowGenome(1), None)
+            small = RenderJob(SlowGenome(1, memory=20), None)
+            for job in (first, big, small):
+                queue.queue(job)
+
+            self.assertTrue(queue._next_job() is first)
+
+            # big does not fit yet, and small may not overtake it
+            self.assertTrue(queue._next_job() is None)
+            self.assertTrue(queue._held[0] is big)
+            self.assertEqual(budget.reserved, 100)
+
+            first._release_memory(budget)
+            self.assertTrue(queue._next_job() is big)
+            self.assertTrue(queue._next_job() is small)
+            self.assertEqual(budget.reserved, 120)
+        finally:
+            for worker in queue._workers:
+                worker.shutdown()
+
+    @print_test_name
+    def testJobQueueOrder(self):
+        queue = JobQueue()
+        batch = RenderJob(None, None, priority=PRIORITY_BATCH)
+        late = RenderJob(None, None, deadline=200.0)
+        early = RenderJob(None, None, deadline=100.0)
+        normal = RenderJob(None, None)
+        preview = RenderJob(None, None, priority=PRIORITY_INTERACTIVE)
+
+        for job in (batch, late, early, normal, preview):
+            queue.put(job)
+
+        self.assertTrue(queue.peek() is preview)
+        order = [queue.get_nowait() for i in xrange(5)]
+        self.assertEqual(order, [preview, early, late, normal, batch])
+        self.assertRaises(Exception, queue.get, True, 0.01)
+
+        queue.requeue(batch)
+        self.assertTrue(queue.get_nowait() is batch)
+        for i in xrange(5):
+            queue.task_done()
+        queue.join()
+
+    @print_test_name
+    def testSchedulerStats(self):
+        stats = SchedulerStats()
+        job = RenderJob(None, None, priority=PRIORITY_BATCH)
+
+        stats.record_start(job)
+        stats.record_end(job, preempted=True)
+        stats.record_start(job)
+        stats.record_end(job)
+
+        batch = stats.snapshot()[PRIORITY_BATCH]
+        self.assertEqual((batch['started'], batch['finished'], batch['preempted']), (2, 1, 1))
+        self.assertTrue(batch['service_mean'] >= 0.0)
+        self.assertFalse(PRIORITY_NORMAL in stats.snapshot())
+
+    @print_test_name
+    def testIndependentQueues(self):
+        preview = RenderQueue(workers=2, nthreads=1)
+        final = RenderQueue(workers=1, nthreads=6)
+
+        self.assertFalse(preview._queue is final._queue)
+        preview.quit = True
+        self.assertFalse(final.quit)
+
+        first = RenderJob(None, None)
+        second = RenderJob(None, None)
+        self.assertFalse(first._lock is second._lock)
+
+        with first._lock:
+            second.cancel = True
+        self.assertTrue(second.cancel)
+
+    @print_test_name
+    def testWorkers(self):
+        class Genome(SlowGenome):
+            def render(self, buffer, progress=None, **kwargs):
+                self.nthreads = kwargs.get('nthreads')
+                return SlowGenome.render(self, buffer, progress)
+
+        first, second = Genome(300), Genome(300)
+        done = []
+
+        queue = RenderQueue(workers=2, nthreads=2)
+        queue.start()
+        try:
+            queue.queue(RenderJob(first, None, completed_cb=done.append))
+            queue.queue(RenderJob(second, None, completed_cb=done.append,
+                                  nthreads=1))
+
+            # both render at once on the two workers
+            self.assertTrue(first.started.wait(5))
+            self.assertTrue(second.started.wait(5))
+            self.assertEqual(done, [])
+            queue._queue.join()
+        finally:
+            queue.quit = True
+
+        self.assertEqual(len(done), 2)
+        self.assertEqual((first.nthreads, second.nthreads), (2, 1))
+        self.assertFalse('progress' in done[0].args)
+
+    @print_test_name
+    def testRenderProgress(self):
+        state = RenderProgress()
+        self.assertEqual(state(0.5, 1, 2.0), 0)
+        self.assertEqual((state.progress, state.stage, state.eta), (0.5, 1, 2.0))
+        self.assertEqual(state.updates, 1)
+
+        state.cancel = True
+        self.assertFalse(state.cancelled)
+        self.assertEqual(state(0.75, 1, 1.0), 1)
+        self.assertTrue(state.cancelled)
+
+        state.reset()
+        self.assertEqual((state.updates, state.cancel, state.cancelled), (0, False, False))
+
+    @print_test_name
+    def testThrottledProgress(self):
+        class Genome(object):
+            width = height = 8
+
+            def render(self, buffer, progress=None, **kwargs):
+                for n in xrange(1000):
+                    if progress(n / 10.0, 0, 0):
+                        return None
+                    time.sleep(0.0005)
+                return {}
+
+        updates = []
+        done = threading.Event()
+
+        class Job(RenderJob):
+            def process_progress(self, progress, stage):
+                updates.append(progress)
+
+        queue = RenderQueue(progress_interval=0.1)
+        queue.start()
+        try:
+            queue.queue(Job(Genome(), None, completed_cb=lambda job: done.set()))
+            done.wait(10)
+        finally:
+            queue.quit = True
+
+        self.assertTrue(done.isSet())
+        self.assertTrue(0 < len(updates) < 100)
+
+    def _process_job(self, quality, results, done, **kwargs):
+        genome = load_test_flames()[0]
+        genome.sample_density = quality
+
+        def completed_cb(job):
+            results.append(job)
+            done.set()
+
+        def error_cb(job, error):
+            results.append(error)
+            done.set()
+
+        return RenderJob(genome, RenderBuffer(32, 24, 3), completed_cb=completed_cb,
+                         error_cb=error_cb, **kwargs)
+
+    @print_test_name
+    def testProcessQueueCompleted(self):
+        results = []
+        done = threading.Event()
+        job = self._process_job(5, results, done)
+
+        queue = ProcessRenderQueue(processes=1)
+        queue.start()
+        try:
+            queue.queue(job)
+            done.wait(30)
+        finally:
+            queue.quit = True
+
+        self.assertEqual(results, [job])
+        self.assertTrue(job.completed)
+        self.assertTrue(job.stats['num_iters'] > 0)
+        self.assertTrue(job.buffer.to_string().strip('\0'))
+
+    @print_test_name
+    def testProcessQueueWorkerKilled(self):
+        results = []
+        done = threading.Event()
+        slow = self._process_job(1e6, results, done)
+
+        queue = ProcessRenderQueue(processes=1)
+        worker = queue._workers[0]
+        queue.start()
+        try:
+            queue.queue(slow)
+            while worker.job is None and not done.isSet():
+                time.sleep(0.01)
+            killed = worker.process
+            killed.terminate()
+            done.wait(30)
+
+            self.assertEqual(len(results), 1)
+            self.assertTrue(isinstance(results[0], RenderWorkerError))
+            self.assertFalse(worker.process is killed)
+            self.assertTrue(worker.process.is_alive())
+
+            # the replacement worker takes the next job
+            del results[:]
+            done.clear()
+            job = self._process_job(5, results, done)
+            queue.queue(job)
+            done.wait(30)
+            self.assertEqual(results, [job])
+        finally:
+            queue.quit = True
+
+    @print_test_name
+    def testProcessQueueIdleWorkerKilled(self):
+        results = []
+        done = threading.Event()
+
+        queue = ProcessRenderQueue(processes=1)
+        worker = queue._workers[0]
+        killed = worker.process
+        killed.terminate()
+        killed.join()
+        queue.start()
+        try:
+            queue.queue(self._process_job(5, results, done))
+            done.wait(30)
+
+            self.assertEqual(len(results), 1)
+            self.assertTrue(isinstance(results[0], RenderWorkerError))
+            self.assertFalse(worker.process is killed)
+            self.assertTrue(worker.process.is_alive())
+        finally:
+            queue.quit = True
+
+    @print_test_name
+    def testProcessQueueUnpicklableArgs(self):
+        queue = ProcessRenderQueue(processes=1)
+        try:
+            job = RenderJob(load_test_flames()[0], None, cache=threading.Lock())
+            self.assertRaises(TypeError, queue.queue, job)
+            self.assertEqual(queue._queue.qsize(), 0)
+        finally:
+            for worker in queue._workers:
+                worker.shutdown()
+
+    def _preempt(self, queue, batch_genome, urgent_genome):
+        order = []
+        batch = RenderJob(batch_genome, None, priority=PRIORITY_BATCH,
+                          completed_cb=order.append)
+        urgent = RenderJob(urgent_genome, None, priority=PRIORITY_INTERACTIVE,
+                           completed_cb=order.append)
+
+        queue.start()
+        try:
+            queue.queue(batch)
+            self.assertTrue(batch_genome.started.wait(5))
+            queue.queue(urgent)
+            queue._queue.join()
+        finally:
+            queue.quit = True
+
+        return order, batch, urgent
+
+    @print_test_name
+    def testPreempt(self):
+        order, batch, urgent = self._preempt(RenderQueue(),
+                SlowGenome(1000), SlowGenome(1))
+
+        self.assertEqual(order, [urgent, batch])
+        self.assertEqual(batch.preemptions, 1)
+
+    @print_test_name
+    def testPreemptFinishedRender(self):
+        # the batch render never looks at its RenderProgress, so it
+        # finishes although the monitor asked it to yield
+        order, batch, urgent = self._preempt(RenderQueue(progress_interval=0.01),
+                SlowGenome(300, listen=False), SlowGenome(1))
+
+        self.assertEqual(order, [batch, urgent])
+        self.assertEqual(batch.preemptions, 0)
+
+    @print_test_name
+    def testPreemptForMemory(self):
+        # a worker is free but the batch job holds the memory
+        order, batch, urgent = self._preempt(RenderQueue(workers=2, memory_budget=150),
+                SlowGenome(1000), SlowGenome(1))
+
+        self.assertEqual(order, [urgent, batch])
+        self.assertEqual(batch.preemptions, 1)
+
+    @print_test_name
+    def testPreemptRecordsAbort(self):
+        queue = RenderQueue()
+        job = RenderJob(SlowGenome(1), None)
+
+        progress = queue._progress_proc(job)
+        self.assertEqual(progress(50.0, 0, 0), 0)
+        self.assertFalse(_render_aborted(job))
+        job.cancel = True
+        self.assertEqual(progress(50.0, 0, 0), 1)
+        self.assertTrue(_render_aborted(job))
+
+        # a new run starts over, and RenderProgress reports its own
+        queue = RenderQueue(progress_interval=1.0)
+        progress = queue._progress_proc(job)
+        self.assertFalse(_render_aborted(job))
+        progress.cancel = True
+        progress(50.0, 0, 0)
+        self.assertTrue(_render_aborted(job))
+
+    @print_test_name
+    def testQuitCancelsJobs(self):
+        cancelled = []
+        running = SlowGenome(5000)
+        jobs = [RenderJob(genome, None, cancel_cb=cancelled.append)
+                for genome in [running, SlowGenome(1), SlowGenome(1)]]
+
+        # the second job waits for memory, the third in the queue
+        queue = RenderQueue(workers=2, memory_budget=150)
+        queue.start()
+        for job in jobs:
+            queue.queue(job)
+        self.assertTrue(running.started.wait(5))
+        time.sleep(0.2)
+
+        queue.quit = True
+        queue._queue.join()
+
+        self.assertEqual(sorted(cancelled), sorted(jobs))
+        self.assertEqual(queue.reserved_memory, 0)
+
+    def _process_preempt(self, budget):
+        order = []
+        done = threading.Event()
+        batch = self._process_job(1e6, order, done, priority=PRIORITY_BATCH)
+        urgent = self._process_job(5, order, done, priority=PRIORITY_INTERACTIVE)
+        batch.cancel_cb = lambda job: order.append('cancelled')
+        if budget:
+            budget = int(batch.memory_required() * 1.5)
+
+        queue = ProcessRenderQueue(processes=2 if budget else 1,
+                                   memory_budget=budget or None)
+        queue.start()
+        try:
+            queue.queue(batch)
+            while not batch.running:
+                time.sleep(0.01)
+            queue.queue(urgent)
+            done.wait(30)
+
+            # stop the batch job's rerun
+            batch.cancel = True
+            queue._queue.join()
+        finally:
+            queue.quit = True
+
+        self.assertEqual(order, [urgent, 'cancelled'])
+        self.assertEqual(batch.preemptions, 1)
+
+    @print_test_name
+    def testProcessQueuePreempt(self):
+        self._process_preempt(False)
+
+    @print_test_name
+    def testProcessQueuePreemptHeld(self):
+        self._process_preempt(True)
@@ -0,0 +1,128 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import socket
+import numpy
+from pyflam3ng import npengine, shard
+from testing_util import print_test_name, load_test_flames
+
+
+class _FailingHost(object):
+    slots = 1
+
+    def __init__(self):
+        self.tasks = []
+
+    def render(self, task):
+        self.tasks.append(task)
+        raise RuntimeError('host down')
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.genome = load_test_flames()[0]
+        self.args = dict(width=32, height=24, quality=4, oversample=1,
+                         engine='numpy', shards=5, seed=3)
+
+    @print_test_name
+    def testPlan(self):
+        tasks = shard.plan_shards(self.genome, 103, 4, seed=10)
+
+        self.assertEqual([t.nsamples for t in tasks], [26, 26, 26, 25])
+        self.assertEqual([t.seed for t in tasks], [10, 11, 12, 13])
+
+    @print_test_name
+    def testHosts(self):
+        local = shard.shard_histogram(self.genome,
+                hosts=[shard.LocalShardHost(2)], **self.args)
+        self.assertEqual(local.nsamples, 32 * 24 * 4)
+
+        server = shard.ShardServer(port=0)
+        server.start()
+        try:
+            remote = shard.shard_histogram(self.genome,
+                    hosts=[shard.RemoteShardHost(server.server_address, 2)],
+                    **self.args)
+        finally:
+            server.shutdown()
+
+        self.assertTrue(numpy.allclose(local.buckets, remote.buckets))
+
+    @print_test_name
+    def testProcesses(self):
+        image = numpy.zeros((24, 32, 3), numpy.uint8)
+        args = dict(self.args, processes=2)
+        del args['width'], args['height']
+
+        stats = shard.render_sharded(self.genome, image, **args)
+        self.assertEqual(stats['num_iters'], 32 * 24 * 4)
+        self.assertTrue(image.any())
+
+    @print_test_name
+    def testDefaultOversample(self):
+        histogram = shard.shard_histogram(self.genome,
+                hosts=[shard.LocalShardHost()], **dict(self.args, oversample=None))
+        self.assertEqual(histogram.oversample, self.genome.spatial_oversample)
+
+    @print_test_name
+    def testRetry(self):
+        failing = _FailingHost()
+        histogram = shard.shard_histogram(self.genome,
+                hosts=[failing, shard.LocalShardHost()], **self.args)
+        self.assertEqual(histogram.nsamples, 32 * 24 * 4)
+        self.assertTrue(failing.tasks)
+
+        self.assertRaises(shard.ShardError, shard.shard_histogram, self.genome,
+                          hosts=[_FailingHost(), _FailingHost()], **self.args)
+
+    @print_test_name
+    def testHungHost(self):
+        # accepts connections but never replies
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(8)
+        try:
+            hung = shard.RemoteShardHost(listener.getsockname(), timeout=0.2)
+            histogram = shard.shard_histogram(self.genome,
+                    hosts=[hung, shard.LocalShardHost()], **self.args)
+        finally:
+            listener.close()
+
+        self.assertEqual(histogram.nsamples, 32 * 24 * 4)
+
+    @print_test_name
+    def testMatchesSingleProcess(self):
+        single = numpy.zeros((48, 64, 3), numpy.uint8)
+        npengine.render(self.genome, single, quality=20, oversample=1, seed=1)
+
+        sharded = numpy.zeros((48, 64, 3), numpy.uint8)
+        stats = shard.render_sharded(self.genome, sharded, quality=20,
+                oversample=1, engine='numpy', shards=8, processes=2)
+        self.assertEqual(stats['num_iters'], 64 * 48 * 20)
+
+        # Different random samples, so only statistically equal
+        a = single.astype(numpy.float64)
+        b = sharded.astype(numpy.float64)
+        self.assertTrue(abs(a.mean() - b.mean()) < 2.0)
+        self.assertTrue(numpy.abs(a - b).mean() < 8.0)
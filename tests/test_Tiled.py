@@ -0,0 +1,48 @@
+##############################################################################
+#  The Combustion Flame Engine - pyflam3ng
+#  http://combustion.sourceforge.net
+#  http://github.com/bobbyrward/pyflam3ng/tree/master
+#
+#  Copyright (C) 2007-2008 by Bobby R. Ward <bobbyrward@gmail.com>
+#
+#  The Combustion Flame Engine is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+
+import unittest
+import numpy
+from pyflam3ng.flam3 import RenderBuffer
+from testing_util import print_test_name, load_test_flames
+
+
+class TestCase(unittest.TestCase):
+    @print_test_name
+    def testMatchesUntiled(self):
+        handle = load_test_flames()[0].genome_handle
+        handle.sample_density = 20
+
+        full = RenderBuffer(256, 192, 3)
+        handle.render(full, nthreads=1)
+
+        tiled = RenderBuffer(256, 192, 3)
+        max_bytes = handle.memory_required(256, 192) * 0.75
+        stats = handle.render_tiled(tiled, max_bytes, nthreads=1)
+        self.assertTrue(stats['tiles'] > 1)
+
+        # Different random samples, so only statistically equal
+        a = full.as_array().astype(numpy.float64)
+        b = tiled.as_array().astype(numpy.float64)
+        self.assertTrue(abs(a.mean() - b.mean()) < 2.0)
+        self.assertTrue(numpy.abs(a - b).mean() < 8.0)
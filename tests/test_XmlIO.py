@@ -22,6 +22,7 @@
 ##############################################################################
 
 import unittest
+import StringIO
 import pyflam3ng
 from testing_util import print_test_name
 
@@ -63,6 +64,20 @@ class TestCase(unittest.TestCase):
         xml = pyflam3ng.flam3.to_xml(genomes[0])
         self.assertTrue(xml)
 
+    @print_test_name
+    def testFlatten(self):
+        genome = pyflam3ng.flam3.from_xml(''.join(test_flam3))[0]
+
+        blob = pyflam3ng.flam3.flatten(genome)
+        self.assertTrue(blob)
+
+        clone = pyflam3ng.flam3.unflatten(blob)
+        self.assertEqual(pyflam3ng.flam3.to_xml(clone),
+                         pyflam3ng.flam3.to_xml(genome))
+
+        # the header is intact but the xforms are cut off
+        self.assertRaises(ValueError, pyflam3ng.flam3.unflatten, blob[:-1])
+
     def _check_genome_1(self, test):
         pass
 
@@ -85,3 +100,94 @@ class TestCase(unittest.TestCase):
 
 
 
+
+    @print_test_name
+    def testSinglePassLoad(self):
+        fast = pyflam3ng.load_flame(xml_source=''.join(test_flam3))
+        slow = [pyflam3ng.load_genome(xml_source=source)
+                for source in test_flam3[1:3]]
+
+        for a, b in zip(fast, slow):
+            self.assertEqual(a.fingerprint(), b.fingerprint())
+            self.assertEqual(a.genome_handle.fingerprint(),
+                             b.genome_handle.fingerprint())
+            self.assertTrue((a.palette.array == b.palette.array).all())
+            self.assertTrue(a.palette.array.any())
+
+    @print_test_name
+    def testHandleAttributes(self):
+        genome = pyflam3ng.load_flame(xml_source=''.join(test_flam3))[0]
+        handle = genome.genome_handle
+
+        genome.gamma = 2.5
+        self.assertEqual(handle.gamma, 2.5)
+        handle.brightness = 3.0
+        self.assertEqual(genome.brightness, 3.0)
+        self.assertEqual((genome.width, genome.height), (640, 480))
+
+        self.assertEqual(handle.palette.shape, (256, 4))
+        handle.palette[0, 0] = 0.5
+        self.assertEqual(handle.palette[0, 0], 0.5)
+
+        self.assertEqual(len(handle.xforms), 4)
+        xform = handle.xforms[0]
+        self.assertAlmostEqual(xform.weight, 0.25)
+        self.assertEqual(xform.variations, {'spherical': 1.0})
+        self.assertEqual(xform.coefs.shape, (3, 2))
+        xform.coefs[2, 0] = 0.25
+        self.assertEqual(handle.xform(0).coefs[2, 0], 0.25)
+
+        handle.background = (0.25, 0.5, 1.0)
+        mirror = pyflam3ng.load_genome(genome_handle=handle.clone())
+        self.assertEqual(tuple(mirror.background[0]), (0.25, 0.5, 1.0))
+        self.assertEqual(len(mirror.xforms), 4)
+        self.assertEqual(mirror.xforms[0].coefs[4], 0.25)
+        self.assertEqual(mirror.gamma, 2.5)
+        self.assertEqual(genome.clone().gamma, 2.5)
+
+    @print_test_name
+    def testMirrorWriteBack(self):
+        genome = pyflam3ng.load_flame(xml_source=''.join(test_flam3))[0]
+        handle = genome.genome_handle
+        handle.gamma = 2.5
+
+        genome.xforms[0].coefs = [1.0, 0.0, 0.0, 1.0, 0.5, 0.25]
+        genome.palette.array[0] = (255.0, 0.0, 51.0)
+        genome.center[0] = (0.125, -0.25)
+        genome.background[0] = (0.25, 0.5, 0.75)
+
+        clone = genome.clone()
+        self.assertTrue(genome.genome_handle is handle)
+        self.assertEqual(handle.xform(0).coefs.ravel().tolist(),
+                         [1.0, 0.0, 0.0, 1.0, 0.5, 0.25])
+        self.assertEqual(handle.palette[0, :3].tolist(), [1.0, 0.0, 0.2])
+        self.assertEqual(handle.center, (0.125, -0.25))
+        self.assertEqual(handle.background, (0.25, 0.5, 0.75))
+        self.assertEqual(clone.xforms[0].coefs, genome.xforms[0].coefs)
+        self.assertEqual(clone.palette.array[0].tolist(), [255.0, 0.0, 51.0])
+        self.assertEqual(tuple(clone.background[0]), (0.25, 0.5, 0.75))
+
+        # a new variation rebuilds the handle, keeping its settings
+        genome.xforms[1].vars.set_variation('linear', 0.5)
+        genome.xforms.append(genome.xforms[0].copy())
+        handle = genome.genome_handle
+        self.assertEqual(len(handle.xforms), 5)
+        self.assertEqual(handle.xform(1).variations.get('linear'), 0.5)
+        self.assertEqual(handle.xform(4).coefs[2].tolist(), [0.5, 0.25])
+        self.assertEqual(handle.gamma, 2.5)
+        self.assertEqual(handle.palette[0, :3].tolist(), [1.0, 0.0, 0.2])
+        self.assertEqual(len(genome.clone().xforms), 5)
+
+    @print_test_name
+    def testIterFlames(self):
+        source = ''.join([test_flam3[0]] + test_flam3[1:3] * 50 + [test_flam3[3]])
+
+        genomes = list(pyflam3ng.iter_flames(StringIO.StringIO(source)))
+        self.assertEqual(len(genomes), 100)
+        self.assertEqual(len(genomes[-1].xforms), 4)
+
+        later = list(pyflam3ng.iter_flames(StringIO.StringIO(source),
+                lambda node: float(node.get('time')) > 0))
+        self.assertEqual(len(later), 50)
+        self.assertEqual(later[0].time, 100.0)
+        self.assertEqual(later[0].fingerprint(), genomes[1].fingerprint())
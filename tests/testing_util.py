@@ -22,8 +22,19 @@
 ##############################################################################
 
 from __future__ import with_statement
+import os
 import traceback
 
+
+TEST_FLAME = os.path.join(os.path.dirname(__file__), '..', 'share', 'test.flam3')
+
+
+def load_test_flames():
+    """Load the genomes in share/test.flam3"""
+    import pyflam3ng
+    return pyflam3ng.load_flame(filename=TEST_FLAME)
+
+
 def print_test_name(test):
     def callit(*args, **kwargs):
         try: